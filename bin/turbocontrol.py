@@ -7,26 +7,42 @@ prepare for frequency analysis via NumForce or aoforce.
 """
 
 from turbogo import jobrunner, check_input_file, submit_script_prepare
-from turbogo import JobLogicError, submit_job
+from turbogo import JobLogicError, submit_job, jobsetup_all, fan_out
+from turbogo import jobsetup_source, job_dir
+from turbogo import submit_distributed, distributed_progress, Job
+from turbogo import WALLTIME_FILE, STOP_FILE
+from turbogo import preopt_job, PREOPT_DIR, PREOPT_FILES
 import turbocontrol.turbogo_helpers
 import os, sys, shutil
 from time import sleep, strftime, time
 from datetime import timedelta
 import logging
 import argparse
-from turbocontrol.screwer_op import Screwer
-from turbocontrol.freeh_op import Freeh, proc_freeh
-
-
-try:
-    import openbabel
-except ImportError:
-    reformat = False
-else:
-    from turbocontrol.formatter import convert_filetype
-    reformat = True
+from multiprocessing import Pool
+from turbocontrol.inputcache import InputCache, CACHEFILE
+from turbocontrol import discover
+from turbocontrol.results import ResultsDB, RESULTS_DB
+from turbocontrol.jobtrace import TraceWriter, TRACE_FILE, phase, record
+from turbocontrol.jobtrace import phase_totals
+from turbocontrol import jobtiming
+from turbocontrol import memplan
+from turbocontrol import scaling
+from turbocontrol import bundle
+from turbocontrol import walltime
+from turbocontrol.geometry import Geometry
 
 TOPDIR = os.path.abspath(os.path.dirname(os.curdir))
+#times an optimization stopped at its walltime is continued
+MAX_CONTINUATIONS = 3
+#a run killed without finishing after this share of its walltime ran out
+WALLTIME_SHARE = 0.9
+#times an optimization killed before its walltime (node failure, eviction)
+#is retried
+MAX_RETRIES = 1
+#orbitals a restart can start its SCF from, closed or open shell
+ORBITAL_FILES = [['mos'], ['alpha', 'beta']]
+#left by the last run, they would end or confuse the restarted one
+STALE_FILES = ['GEO_OPT_CONVERGED', 'GEO_OPT_FAILED', 'not.converged']
 
 
 class Error(Exception):
@@ -69,15 +85,45 @@ class Jobset():
         self.firstfreq = None
         self.ts = False
         self.freeh = False
+        self.runstart = None
+        self.bundled = False
+        self.continuations = 0
+        self.retries = 0
+        #%maxcycles of the optimization, and the energy file's cycles from
+        #before it started (see opt_cycles)
+        self.max_iterations = getattr(job, 'iterations', None)
+        self.cycle_base = 0
+        #'preopt' while the cheap level of a %preopt job runs
+        self.stage = None
+        self.ptime = 0
+        #{stage: (predicted seconds, h_rt hours)}, see assign_walltime
+        self.predicted = dict()
+        self.timings = list()
+        parsed = getattr(job, 'parsed', None)
+        if parsed:
+            record(self.timings, 'parse', *parsed)
 
     def submit(self):
         """
         Submits the job to turbogo for preparation and running, getting
-        freqopts, job id and the job object back
+        freqopts, job id and the job object back. Bundled jobs are only
+        prepared, and submitted later with their bundle. Jobs with %preopt
+        start with their pre-optimization (see check_preopt).
         """
-        os.chdir(self.indir)
         try:
-            self.jobid, freqopt, self.name, self.jobtype = jobrunner(job=self.job)
+            turbogo_helpers.ensure_dir(self.indir)
+            os.chdir(self.indir)
+            job = self.job
+            if self.job.preopt:
+                job = preopt_job(self.job)
+                self.stage = 'preopt'
+                if self.job.autort and 'preopt' in self.predicted:
+                    job.rt = '{}:00:00'.format(self.predicted['preopt'][1])
+            self.jobid, freqopt, self.name, self.jobtype = jobrunner(
+                job=job, timings=self.timings, submit=not self.bundled)
+            if self.stage == 'preopt':
+                freqopt = self.job.freqopts
+                self.jobtype = self.job.jobtype
             if self.jobtype != 'sp':
                 self.freqopt = freqopt.split('+')[0]
                 if len(freqopt.split('+')) == 2:
@@ -93,6 +139,8 @@ class Jobset():
                         self.freqopt = 'numforce'
             elif self.jobtype == 'sp':
                 self.status = 'SP Submitted'
+            if self.stage == 'preopt':
+                self.status = 'Preopt Submitted'
         except Exception as e:
             self.jobid = None
             self.job = None
@@ -101,51 +149,144 @@ class Jobset():
         os.chdir(TOPDIR)
 
 
-def find_inputs():
+def _parse_input(infile):
     """
-    Finds the inputs in subdirs. Verifies the appropriateness of
-    each input file. Returns Dictionary of {dir: inputfile}
+    Reads every job of a (possibly multi-job) input file. Returns (jobs, None),
+    or (False, error) if the file is not valid input. Each job's parsed is
+    the (start, end) time of reading the file.
     """
-    inputdirs = list()
-    filetree = dict()
+    start = time()
+    try:
+        jobs = list(jobsetup_all(infile))
+    except Exception as e:
+        return False, getattr(e, 'msg', None) or str(e) or repr(e)
+    end = time()
+    for job in jobs:
+        job.parsed = (start, end)
+    return jobs, None
 
-    results = list()
-    #find files in dirs:
-    for d, _, filenames in os.walk(os.curdir):
-        for f in filenames:
-            fileExt = os.path.splitext(f)[-1]
-            if (fileExt == '.in' or fileExt == '.gjf' or fileExt == '.com'
-                or fileExt == '.inp' or fileExt == '.input'):
-                results.append(os.path.join(d,f))
-
-    for r in results:
-        if os.path.dirname(r) in filetree:
-            filetree[os.path.dirname(r)].append(os.path.basename(r))
-        else:
-            filetree[os.path.dirname(r)] = [os.path.basename(r)]
 
+def check_inputs(infiles, cache=None, pool=None):
+    """
+    Checks the input files. Returns {infile: jobs}, where jobs is the list of
+    jobs read from the file or False if it is not valid input. With an
+    InputCache, results for unchanged files are reused instead of parsing them
+    again. Files that do need parsing are spread over pool, if given.
+    """
+    checked = dict()
+    stamps = dict()
+    results = dict()
+    todo = list()
+    for infile in infiles:
+        if cache is not None:
+            cached, stamps[infile] = cache.lookup(infile)
+            if cached is not None:
+                #not parsed this time
+                for job in cached[0] or []:
+                    job.parsed = None
+                results[infile] = cached
+                continue
+        todo.append(infile)
+    if pool is not None and len(todo) > 1:
+        parsed = pool.map(_parse_input, todo)
+    else:
+        parsed = [_parse_input(infile) for infile in todo]
+    for infile, result in zip(todo, parsed):
+        results[infile] = result
+        if cache is not None:
+            cache.store(infile, stamps[infile], result)
+    for infile in infiles:
+        jobs, error = results[infile]
+        if error:
+            logging.warning(
+                "Input file '{}' is not valid. Error {}".format(infile, error))
+        checked[infile] = jobs
+    return checked
+
+
+def check_input_jobs(infile, cache=None):
+    """
+    Checks every job of a (possibly multi-job) input file. Returns the list of
+    jobs, or False if the file is not valid input. With an InputCache, the
+    result for an unchanged file is reused instead of parsing it again.
+    """
+    return check_inputs([infile], cache)[infile]
+
+
+def find_inputs(cache=None, workers=1, include=None, exclude=None):
+    """
+    Finds the inputs in subdirs. Verifies the appropriateness of
+    each input file. Returns Dictionary of {dir: [inputfile, job]}, where the
+    jobs of multi-job inputs are fanned out to their own working dirs. Parse
+    results are kept in and reused from cache, if given.
+
+    The tree is searched a level at a time, parsing each level's candidates in
+    workers processes. Dirs holding a valid input are not searched further,
+    nor are Turbomole output dirs (numforce etc.). include and exclude are
+    lists of globs selecting input files and skipping files or dirs.
+    """
     multidir = list()
     badinput = list()
-
-    logging.debug("{} potential inputs found".format(len(filetree)))
+    results = list()
     inputdirs = dict()
-    for key in filetree:
-        for v in filetree[key]:
-            job = check_input_file(os.path.join(key, v))
-            if job:
-                if key in inputdirs:
-                    logging.warning("More than one valid input file in {}." \
-                        "Please have only one input per directory.".format(key))
-                    multidir.append(key)
-                else:
-                    inputdirs[key] = [v, job]
-            else:
-                logging.warning("File {} not valid input.".format(
-                    str(os.path.join(key, v))))
-                badinput.append(str(os.path.join(key, v)))
-        if key not in inputdirs:
-            logging.warning(
-                "Directory {} does not contain valid input.".format(key))
+    pool = None
+    if workers > 1:
+        pool = Pool(workers)
+
+    try:
+        level = [os.curdir]
+        while level:
+            filetree = dict()
+            subdirs = dict()
+            for d in level:
+                subdirs[d], filetree[d] = discover.scan_dir(d, include,
+                                                            exclude)
+            candidates = [f for d in level for f in filetree[d]]
+            results.extend(candidates)
+            logging.debug("{} potential inputs found".format(len(candidates)))
+            checked = check_inputs(candidates, cache, pool)
+
+            nextlevel = list()
+            for key in level:
+                valid = False
+                for infile in filetree[key]:
+                    jobs = checked[infile]
+                    v = os.path.basename(infile)
+                    if jobs:
+                        if valid:
+                            logging.warning("More than one valid input file " \
+                                "in {}. Please have only one input per " \
+                                "directory.".format(key))
+                            multidir.append(key)
+                        else:
+                            valid = True
+                            for workdir, job in fan_out(key, v, jobs):
+                                inputdirs[workdir] = [v, job]
+                            if len(jobs) > 1:
+                                logging.info("{} jobs read from {}.".format(
+                                    len(jobs), infile))
+                    else:
+                        logging.warning("File {} not valid input.".format(
+                            str(infile)))
+                        badinput.append(str(infile))
+                if valid:
+                    continue
+                if filetree[key]:
+                    logging.warning(
+                        "Directory {} does not contain valid input."
+                        .format(key))
+                nextlevel.extend(subdirs[key])
+            level = nextlevel
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if cache is not None:
+        cache.prune(results)
+        cache.save()
+        logging.debug("Input cache: {} parsed, {} reused.".format(
+            cache.misses, cache.hits))
 
     if len(badinput) > 0:
         logging.info("Following inputs have errors:\n{}".format(
@@ -158,11 +299,93 @@ def find_inputs():
     return inputdirs
 
 
+def source_names(sources):
+    """
+    The working dir name of each source file: its name without the
+    extension, or where sources share that, its path with the extension
+    (a/conf.xyz is a-conf-xyz). Any still shared get a -2, -3... suffix.
+    """
+    stems = [os.path.splitext(os.path.basename(source))[0]
+             for source in sources]
+    names = list()
+    for source, stem in zip(sources, stems):
+        if stems.count(stem) > 1:
+            stem = os.path.relpath(source)
+        for sep in [os.sep, '.']:
+            stem = stem.replace(sep, '-')
+        stem = stem.strip('-')
+        name = stem
+        n = 1
+        while name in names:
+            n += 1
+            name = '{}-{}'.format(stem, n)
+        names.append(name)
+    return names
+
+
+def source_jobsets(template, sources):
+    """
+    Yields a Jobset for each record of the multi-record xyz/sdf sources, set up
+    from the template. Records are read lazily, and each job gets a numbered
+    working dir named after its source file (see source_names). A bad record
+    ends its source.
+    """
+    for source, name in zip(sources, source_names(sources)):
+        try:
+            for num, job in enumerate(jobsetup_source(template, source), 1):
+                yield Jobset(job_dir(os.curdir, name, num),
+                             os.path.basename(source), job)
+        except Exception as e:
+            logging.warning(
+                "Error {} reading jobs from {}. Remaining records skipped."
+                .format(e, source))
+
+
+def record_run(job, stage):
+    """
+    Records the queue wait and run of the job's last submission, which has
+    just left the queue. The run starts when the submit script touched
+    startfile, or failing that when the job was first seen running. Staging
+    through node-local scratch during the run is recorded too.
+    """
+    timings = getattr(job, 'timings', None)
+    if timings is None or not job.curstart:
+        return
+    end = time()
+    runstart = job.runstart
+    try:
+        mtime = os.stat(os.path.join(job.indir, 'startfile')).st_mtime
+    except OSError:
+        pass
+    else:
+        if job.curstart <= mtime <= end:
+            runstart = mtime
+    if runstart:
+        record(timings, 'queue', job.curstart, runstart, stage=stage)
+        record(timings, 'run', runstart, end, stage=stage)
+    else:
+        record(timings, 'queue', job.curstart, end, stage=stage)
+    #copies to and from node-local scratch, from the job's timing log
+    for run in jobtiming.read_timing(os.path.join(job.indir,
+                                                  jobtiming.TIMING_FILE)):
+        if (run.program in jobtiming.STAGING and run.end is not None and
+                run.start >= job.curstart):
+            record(timings, jobtiming.STAGING[run.program], run.start,
+                   run.end, stage=stage)
+            logging.debug("Job {} {} took {:.1f}s.".format(
+                job.name, jobtiming.STAGING[run.program], run.seconds))
+    job.runstart = None
+
+
 def check_opt(job):
     """
     Check if an opt job is done or crashed, if done: resubmit to queue if freq
     is required. Return a status string
     """
+    record_run(job, job.jobtype)
+    jobtiming.write_summary(job.indir, job.name)
+    stopped = walltime_stopped(job)
+    clear_checkpoint(job.indir)
     if turbogo_helpers.check_files_exist([
         os.path.join(job.indir, 'GEO_OPT_CONVERGED')]):
         #Job converged
@@ -179,6 +402,8 @@ def check_opt(job):
             job.otime += opttime
         else:
             job.otime += (time() - job.curstart)
+        with phase(getattr(job, 'timings', None), 'geometry'):
+            write_geometries(job)
 
         if job.freqopt != None:
             newid = freq_submit(job)
@@ -191,11 +416,22 @@ def check_opt(job):
                 job.status = "Freq Setup Failed"
                 return 'fcrashed'
         else:
-            if reformat:
-                convert_filetype(os.path.join(job.indir, 'finalgeometry.xyz'),
-                                 os.path.join(job.indir, 'finalgeometry.mol'))
             return 'completed'
 
+    elif stopped:
+        if job.continuations < MAX_CONTINUATIONS:
+            job.continuations += 1
+            return continue_opt(job, 'stopped at its walltime')
+        logging.warning("Job {} ran out of walltime {} times.".format(
+            job.name, job.continuations + 1))
+        job.status = "Opt Walltime Exceeded"
+        return 'ocrashed'
+
+    elif (killed(job) and has_orbitals(job.indir) and
+          job.retries < MAX_RETRIES):
+        job.retries += 1
+        return continue_opt(job, 'was killed')
+
     else:
         logging.warning("Job {} crashed in optimization."
                      .format(job.name))
@@ -203,12 +439,259 @@ def check_opt(job):
         return 'ocrashed'
 
 
+def check_preopt(job):
+    """
+    Check a finished pre-optimization (%preopt) and start the job at its
+    requested level from its geometry and orbitals. One that didn't converge
+    still hands on its last geometry. Return a status string
+    """
+    record_run(job, 'preopt')
+    jobtiming.write_summary(job.indir, job.name)
+    clear_checkpoint(job.indir)
+    opttime = turbogo_helpers.get_calc_time(job.indir, 'opt.out')
+    job.ptime += opttime or (time() - job.curstart)
+    cycles = energy_cycles(job.indir)
+    if os.path.isfile(os.path.join(job.indir, 'GEO_OPT_CONVERGED')):
+        logging.info("Job {} pre-optimized in {} cycles ({}).".format(
+            job.name, cycles, turbogo_helpers.time_readable(int(job.ptime))))
+    else:
+        logging.warning("Job {} pre-optimization did not converge in {} "
+                        "cycles.".format(job.name, cycles))
+    job.stage = None
+    return start_refine(job)
+
+
+def start_refine(job):
+    """
+    Moves the files of a job's pre-optimization to PREOPT_DIR and submits
+    the requested level from its last geometry, with define projecting its
+    orbitals as the start guess. Return 'opt', or 'ocrashed' if it couldn't
+    be submitted.
+    """
+    predir = os.path.join(job.indir, PREOPT_DIR)
+    if os.path.isdir(predir):
+        shutil.rmtree(predir)
+    turbogo_helpers.ensure_dir(predir)
+    for name in PREOPT_FILES:
+        if os.path.exists(os.path.join(job.indir, name)):
+            shutil.move(os.path.join(job.indir, name),
+                        os.path.join(predir, name))
+    try:
+        geometry = Geometry.from_coord_lines(turbogo_helpers.read_clean_file(
+            os.path.join(predir, 'coord')))
+    except (turbogo_helpers.FileAccessError, KeyError, ValueError) as e:
+        geometry = Geometry()
+        logging.debug("Error reading pre-optimized coord: {}".format(e))
+    if len(geometry) == len(job.job.geometry):
+        job.job.geometry = geometry
+    else:
+        logging.warning("No pre-optimized geometry for job {}, starting from "
+                        "its input.".format(job.name))
+    if has_orbitals(predir):
+        job.job.guess = os.path.join(PREOPT_DIR, 'control')
+    opt_cycles(job)
+    stage = walltime.stage_of(job.job.jobtype)
+    if job.job.autort and stage in job.predicted:
+        job.job.rt = '{}:00:00'.format(job.predicted[stage][1])
+    timings = getattr(job, 'timings', None)
+    os.chdir(job.indir)
+    try:
+        with phase(timings, 'resubmit'):
+            jobid = jobrunner(job=job.job, timings=timings)[0]
+    except Exception as e:
+        logging.warning("Error {} submitting job {} after its "
+                        "pre-optimization.".format(e, job.name))
+        jobid = None
+    os.chdir(TOPDIR)
+    job.job.guess = None
+    if jobid is None:
+        job.status = "Opt Submit Failed"
+        return 'ocrashed'
+    logging.info("Job {} submitted at {} from its pre-optimization.".format(
+        job.name, job.job.basis))
+    job.jobid = jobid
+    job.curstart = time()
+    job.status = "Opt Submitted"
+    return 'opt'
+
+
+def walltime_stopped(job):
+    """
+    True if the job's last run ended at its walltime: stopped by the
+    checkpoint (WALLTIME marker), or killed before the end of the job script
+    once most of its h_rt had passed.
+    """
+    if os.path.isfile(os.path.join(job.indir, WALLTIME_FILE)):
+        return True
+    run = last_run(job)
+    if run is None or run.end is not None:
+        return False
+    hours = int(str(job.job.rt).split(':')[0])
+    return time() - run.start >= WALLTIME_SHARE * hours * 3600
+
+
+def last_run(job):
+    """The timing.log run of the job script since the job was last
+    submitted, None if it has none"""
+    runs = [run for run in jobtiming.read_timing(
+        os.path.join(job.indir, jobtiming.TIMING_FILE))
+            if run.program == 'job' and run.start >= job.curstart]
+    if runs:
+        return runs[-1]
+    return None
+
+
+def killed(job):
+    """True if the job script's last run never reached its end: the job
+    was deleted, evicted or lost with its node"""
+    run = last_run(job)
+    return run is not None and run.end is None
+
+
+def clear_checkpoint(indir):
+    """Removes the checkpoint's stop file and marker, which would stop the
+    next Turbomole run"""
+    for name in [STOP_FILE, WALLTIME_FILE]:
+        try:
+            os.remove(os.path.join(indir, name))
+        except OSError:
+            pass
+
+
+def continue_opt(job, reason):
+    """
+    Resubmits an optimization whose last run ended early (reason, for the
+    log). jobex carries on from the coord and orbitals of its last step (see
+    warm_restart), for the cycles it has left. The last run's output is kept
+    numbered. Returns 'opt', or 'ocrashed' if it can't be continued.
+    """
+    outfile = 'ts.out' if job.job.jobtype == 'ts' else 'opt.out'
+    opttime = turbogo_helpers.get_calc_time(job.indir, outfile)
+    job.otime += opttime or (time() - job.curstart)
+    budget = job.max_iterations or job.job.iterations
+    done = energy_cycles(job.indir) - job.cycle_base
+    left = budget - done
+    if left <= 0:
+        logging.warning("Job {} used its {} cycles without converging."
+                        .format(job.name, budget))
+        job.status = "Opt Not Converged"
+        return 'ocrashed'
+    outpath = os.path.join(job.indir, outfile)
+    if os.path.isfile(outpath):
+        os.rename(outpath, '{}.{}'.format(
+            outpath, job.continuations + job.retries))
+    job.job.iterations = left
+    jobid = warm_restart(job)
+    if jobid is None:
+        job.status = "Opt Continue Failed"
+        return 'ocrashed'
+    logging.info("Job {} {} after {} cycles, continued for {} more.".format(
+        job.name, reason, done, left))
+    job.jobid = jobid
+    job.curstart = time()
+    job.status = "Opt Continued"
+    return 'opt'
+
+
+def energy_cycles(indir):
+    """Cycles in the energy file of indir, which jobex adds to every run"""
+    try:
+        return len(turbogo_helpers.read_energies(
+            os.path.join(indir, 'energy')))
+    except turbogo_helpers.FileAccessError:
+        return 0
+
+
+def opt_cycles(job):
+    """
+    Starts the count of a new optimization of the job from the cycles
+    already in its energy file, with all of its %maxcycles.
+    """
+    job.cycle_base = energy_cycles(job.indir)
+    if job.max_iterations:
+        job.job.iterations = job.max_iterations
+
+
+def has_orbitals(indir):
+    """True if indir holds a control file and the orbitals of an earlier
+    SCF"""
+    if not os.path.isfile(os.path.join(indir, 'control')):
+        return False
+    return any(all(os.path.isfile(os.path.join(indir, name))
+                   for name in names) for names in ORBITAL_FILES)
+
+
+def warm_restart(job, geometry=None):
+    """
+    Resubmits the optimization of a jobset from the files of its last run,
+    without running define again. control and the orbitals are kept, so the
+    SCF starts from converged MOs instead of a new Hueckel guess. Only coord
+    (with geometry, if given) and the memory plan and walltime of the
+    optimization are updated. Returns the new jobid, or None if it wasn't
+    submitted.
+    """
+    job.job.jobtype = getattr(job, 'jobtype', None) or job.job.jobtype
+    stage = walltime.stage_of(job.job.jobtype)
+    predicted = getattr(job, 'predicted', None) or dict()
+    if job.job.autort and stage in predicted:
+        job.job.rt = '{}:00:00'.format(predicted[stage][1])
+    os.chdir(job.indir)
+    try:
+        if geometry is not None:
+            job.job.geometry = geometry
+            turbogo_helpers.write_file('coord', geometry.coord_lines())
+            #screwer's displaced geometry, once written to coord
+            turbogo_helpers.remove_control(['$newcoord'])
+        for name in STALE_FILES:
+            if os.path.isfile(name):
+                os.remove(name)
+        with phase(getattr(job, 'timings', None), 'memory plan',
+                   stage=job.job.jobtype):
+            control_add = memplan.apply_plan(job.job)
+        if control_add and job.job.automod:
+            turbogo_helpers.add_or_modify_control(control_add)
+        script = submit_script_prepare(job.job)
+        with phase(getattr(job, 'timings', None), 'qsub',
+                   stage=job.job.jobtype):
+            jobid = submit_job(job.job, script)
+    except Exception as e:
+        logging.warning("Error {} restarting job {}".format(e, job.indir))
+        jobid = None
+    os.chdir(TOPDIR)
+    return jobid
+
+
+def write_geometries(job):
+    """
+    Writes the optimization trajectory and final geometry of a job as xyz
+    from its coord and gradient files, unless the submit script already has,
+    and the final geometry as mol.
+    """
+    from turbocontrol.trajectory import write_xyz_files, FINAL_XYZ
+    from turbocontrol.formatter import convert_filetype
+    final = os.path.join(job.indir, FINAL_XYZ)
+    coord = os.path.join(job.indir, 'coord')
+    try:
+        if (not os.path.isfile(final) or not os.path.isfile(coord) or
+                os.path.getmtime(final) < os.path.getmtime(coord)):
+            write_xyz_files(job.indir)
+    except (turbogo_helpers.FileAccessError,
+            turbogo_helpers.InputCheckError) as e:
+        logging.warning("Error writing xyz files for {}: {}".format(
+            job.name, e))
+        return
+    convert_filetype(os.path.join(job.indir, FINAL_XYZ),
+                     os.path.join(job.indir, 'final_geometry.mol'))
+
+
 def check_freq(job):
     """
     Check if a freq job is done or crashed, if done: check for imaginary and
     send for adjustment if required.
     Return a status string
     """
+    record_run(job, job.freqopt)
+    jobtiming.write_summary(job.indir, job.name)
 
     if job.freqopt == 'numforce':
         filetoread = os.path.join(job.indir, 'numforce', 'aoforce.out')
@@ -229,7 +712,21 @@ def check_freq(job):
     else:
         if "   ****  force : all done  ****" in endstatus:
 
-            freqtime = turbogo_helpers.get_calc_time(job.indir, endfile)
+            if distributed(job):
+                #prep, pieces and NumForce ran as separate queue jobs
+                freqtime = jobtiming.wall_time(jobtiming.read_timing(
+                    os.path.join(job.indir, jobtiming.TIMING_FILE)),
+                    job.curstart)
+                done, total = distributed_progress(job.indir)
+                logging.info("Job {}: {} of {} displacements run in {} "
+                             "pieces.".format(job.name, done, total,
+                                              job.job.freqjobs))
+                if total and not done:
+                    logging.warning("No displacements of job {} were run in "
+                                    "pieces, NumForce ran them all.".format(
+                                        job.name))
+            else:
+                freqtime = turbogo_helpers.get_calc_time(job.indir, endfile)
             if freqtime:
                 job.ftime += freqtime
             else:
@@ -244,7 +741,8 @@ def check_freq(job):
             if status == 'completed':
                 if job.freeh:
                     logging.debug('Do Freeh')
-                    do_freeh(job)
+                    with phase(getattr(job, 'timings', None), 'freeh'):
+                        do_freeh(job)
                 return 'completed'
             elif status == 'error':
                 return 'ocrashed'
@@ -299,9 +797,11 @@ def ensure_not_ts(job):
         job.firstfreq = vib1
         if vib1 < 0:
             os.chdir(newdir)
+            from turbocontrol.screwer_op import Screwer
             screwer = Screwer(mode)
             try:
-                screwer.run_screwer()
+                with phase(getattr(job, 'timings', None), 'screwer'):
+                    screwer.run_screwer()
             except Exception as e:
                 logging.warning("Error '{}' running screwer on job {}.".format(
                     e, job.name))
@@ -319,16 +819,42 @@ def ensure_not_ts(job):
                     newcoord.append(line)
                 elif readin == -1:
                     readin = True
+            os.chdir(TOPDIR)
+            try:
+                geometry = Geometry.from_coord_lines(newcoord)
+            except (KeyError, ValueError) as e:
+                logging.warning("Error '{}' reading the displaced geometry of "
+                                "job {}.".format(e, job.name))
+                return "error"
             if job.freqopt == 'numforce':
-                os.chdir(os.pardir)
-                turbogo_helpers.write_file('coord', newcoord)
                 try:  # Better to remove numforce, if not no biggie
+                    shutil.rmtree(os.path.join(job.indir, 'numforce'))
+                except OSError:
+                    pass
+            #the frequency run left the job set up for its own jobtype
+            job.job.jobtype = job.jobtype
+            opt_cycles(job)
+            timings = getattr(job, 'timings', None)
+            if has_orbitals(job.indir):
+                #restart from the converged orbitals, without define
+                with phase(timings, 'resubmit'):
+                    jobid = warm_restart(job, geometry)
+                if jobid is None:
+                    return 'error'
+                job.jobid = jobid
+                job.curstart = time()
+                return 'opt'
+            job.job.geometry = geometry
+            os.chdir(job.indir)
+            if job.freqopt == 'numforce':
+                try:
                     os.remove(os.path.join(os.curdir, 'control'))
-                    shutil.rmtree(os.path.join(os.curdir, 'numforce'))
                 except OSError:
                     pass
             try:
-                job.jobid, job.freqopt, job.name, job.jobtype = jobrunner(job=self.job)
+                with phase(timings, 'resubmit'):
+                    job.jobid, _freqopts, job.name, job.jobtype = jobrunner(
+                        job=job.job, timings=timings)
                 job.curstart = time()
             except Exception as e:
                 logging.warning("Error {} resubmitting job {}.".format(
@@ -407,6 +933,7 @@ def do_freeh(job):
         newdir = job.indir
 
     os.chdir(newdir)
+    from turbocontrol.freeh_op import Freeh, proc_freeh
     freeh = Freeh()
     logging.debug('doing freeh')
     try:
@@ -419,173 +946,17 @@ def do_freeh(job):
 
     os.chdir(TOPDIR)
 
-    if job.params:
-        write_freeh(job)
-        logging.debug('freeh written')
-    
-
-def write_stats(job):
-    """
-    Writes a line to the stats file for each job that completes successfully.
-    """
-    if not turbogo_helpers.check_files_exist(['stats.txt']):
-        #write the header to the file
-        try:
-            with open('stats.txt', 'w') as f:
-                f.write("{name:^16}{directory:^20}{optsteps:^10}{opttime:^12}" \
-                        "{freqtime:^12}{tottime:^12}{firstfreq:^16}{energy:^16}"
-                .format(
-                    name='Name',
-                    directory = 'Directory',
-                    optsteps = 'Opt Steps',
-                    opttime = 'Opt Time',
-                    freqtime = 'Freq Time',
-                    tottime = 'Total Time',
-                    firstfreq = '1st Frequency',
-                    energy = 'Energy',
-                ))
-                f.write('\n')
-        except IOError as e:
-            logging.warning("Error preparing stats file: {}".format(e))
-        except Exception as e:
-            logging.warning("Unknown error {}".format(e))
-    name = job.name
-    directory = os.path.join(job.indir, job.infile)
-    try:
-        with open(os.path.join(job.indir, 'energy')) as f:
-            lines = f.readlines()
-    except IOError as e:
-        logging.warning("Error reading energy file for stats: {}".format(e))
-        optsteps = '?'
-        energy = '?'
-    except Exception as e:
-        logging.warning("Unknown error {}.".format(e))
-    else:
-        optsteps = lines[-2][:6].strip()
-        energy = lines[-2][6:22].strip()
-    opttime = turbogo_helpers.time_readable(job.otime)
-    freqtime = turbogo_helpers.time_readable(job.ftime)
-    tottime = turbogo_helpers.time_readable(job.otime + job.ftime)
-    firstfreq = job.firstfreq
-    try:
-        with open('stats.txt', 'a') as f:
-            f.write("{name:^16.16}{directory:^20.20}{optsteps:^10.10}" \
-                    "{opttime:^12.12}{freqtime:^12.12}{tottime:^12.12}" \
-                    "{firstfreq:^16.16}{energy:^16.16}"
-            .format(
-                name=name,
-                directory = directory,
-                optsteps = optsteps,
-                opttime = opttime,
-                freqtime = freqtime,
-                tottime = tottime,
-                firstfreq = firstfreq,
-                energy = energy,
-            ))
-            f.write('\n')
-    except (OSError, IOError) as e:
-        logging.warning("Error writing stats file: {}".format(e))
-
-
-def write_freeh(job):
-    """
-    Writes a line to the freeh file for each job that completes successfully
-    with freeh requested.
-    """
-    if not turbogo_helpers.check_files_exist(['freeh.txt']):
-        #write the header to the file
-        try:
-            with open('freeh.txt', 'w') as f:
-                f.write("{name:^16}{directory:^20}{zpe:^14}{t:^10}" \
-                        "{p:^11}{qtrans:^12}{qrot:^10}" \
-                        "{pot:^14}{eng:^14}{entr:^20}{cv:^14}{cp:^14}{enth:^14}\n"
-                .format(
-                    name='Name',
-                    directory = 'Directory',
-                    zpe = 'ZPE (kJ/mol)',
-                    t = 'Temp (K)',
-                    p = 'p (MPa)',
-                    qtrans = 'ln(qtrans)',
-                    qrot = 'ln(qrot)',
-                    qvib = 'ln(qvib)',
-                    pot = 'Pot (kJ/mol)',
-                    eng = 'Eng (kJ/mol)',
-                    entr = 'Entropy (kJ/mol/K)',
-                    cv = 'Cv (kJ/molK)',
-                    cp = 'Cp (kJ/molK)',
-                    enth = 'Enthalpy (kJ/mol)'
-                ))
-                logging.debug("Wrote freeh titles")
-        except IOError as e:
-            logging.warning("Error preparing freeh file: {}".format(e))
-        except Exception as e:
-            logging.warning("Unknown error {}".format(e))
-    name = job.name
-    directory = os.path.join(job.indir, job.infile)
-    zpe = job.data['zpe']
-    t = job.data['t']
-    p = job.data['p']
-    qtrans = job.data['qtrans']
-    qrot = job.data['qrot']
-    qvib = job.data['qvib']
-    pot = job.data['pot']
-    eng = job.data['eng']
-    entr = job.data['entr']
-    cv = job.data['cv']
-    cp = job.data['cp']
-    enth = job.data['enth']
-    
-    try:
-        with open('freeh.txt', 'a') as f:
-            f.write("{name:^16}{directory:^20}{zpe:^14}{t:^10}" \
-                    "{p:^11}{qtrans:^12}{qrot:^10}" \
-                    "{pot:^14}{eng:^14}{entr:^20}{cv:^14}{cp:^14}{enth:^14}\n"
-            .format(
-                name=name,
-                directory = directory,
-                zpe = zpe,
-                t = t[0],
-                p = p[0],
-                qtrans = qtrans[0],
-                qrot = qrot[0],
-                qvib = qvib[0],
-                pot = pot[0],
-                eng = eng[0],
-                entr = entr[0],
-                cv = cv[0],
-                cp = cp[0],
-                enth = enth[0]
-            ))
-            if len(t) > 1: #don't rewrite name/zpe for each line
-                for i in range(1, len(t)):
-                    f.write("{name:^16}{directory:^20}{zpe:^14}{t:^8}" \
-                    "{p:^11}{qtrans:^12}{qrot:^10}" \
-                    "{pot:^14}{eng:^14}{entr:^20}{cv:^14}{cp:^14}{enth:^14}\n"
-                .format(
-                    name='',
-                    directory = '',
-                    zpe = '',
-                    t = t[i],
-                    p = p[i],
-                    qtrans = qtrans[i],
-                    qrot = qrot[i],
-                    qvib = qvib[i],
-                    pot = pot[i],
-                    eng = eng[i],
-                    entr = entr[i],
-                    cv = cv[i],
-                    cp = cp[i],
-                    enth = enth[i]
-                ))
-    except (OSError, IOError) as e:
-        logging.warning("Error writing freeh file: {}".format(e))
-
-
-def watch_jobs(jobs):
+def watch_jobs(jobs, results=None, trace=None):
     """
     Monitors jobs running. If jobs request frequency, then submits to frequency
-    calculation
+    calculation. Finished jobs are recorded in the results database after each
+    check of the queue, and the reports are written from it at the end. The
+    phases timed for each job are appended to the trace as they complete.
     """
+    if results is None:
+        results = ResultsDB(os.path.join(TOPDIR, RESULTS_DB))
+    if trace is None:
+        trace = TraceWriter(os.path.join(TOPDIR, TRACE_FILE))
     orunning = list()
     frunning = list()
     ocomplete = list()
@@ -603,7 +974,8 @@ def watch_jobs(jobs):
     starttime = time()
 
     for job in jobs:
-        if job.status == 'Opt Submitted' or job.status == 'TS Submitted':
+        if job.status in ['Opt Submitted', 'TS Submitted',
+                          'Preopt Submitted']:
             orunning.append(job.jobid)
             jobdict[job.jobid] = job
         elif job.status == 'Freq Submitted':
@@ -622,6 +994,7 @@ def watch_jobs(jobs):
             len(failed_submit),
             turbogo_helpers.list_str(failed_submit)
             ))
+    trace.write(jobs)
     if len(jobdict) == 0:
         exit()
 
@@ -631,18 +1004,26 @@ def watch_jobs(jobs):
     sleep(60)
 
     while not allcomplete:
-        alljobs = turbogo_helpers.get_all_active_jobs()
-        if len(alljobs) == 0 and (len(orunning) > 0 or len(frunning) > 0):
+        states = turbogo_helpers.get_job_states()
+        if len(states) == 0 and (len(orunning) > 0 or len(frunning) > 0):
             #possible fail at getting jobs from queue
             sleep(60)
-            alljobs = turbogo_helpers.get_all_active_jobs()
-            if len(alljobs) == 0:
+            states = turbogo_helpers.get_job_states()
+            if len(states) == 0:
                 #One more try
                 sleep(300)
-                alljobs = turbogo_helpers.get_all_active_jobs()
+                states = turbogo_helpers.get_job_states()
+        #jobs running in a bundle are in the queue until marked done
+        states = bundle.member_states(states, jobdict)
+        alljobs = list(states)
+        for jobid, state in states.items():
+            if 'r' in state and jobid in jobdict:
+                if not jobdict[jobid].runstart:
+                    jobdict[jobid].runstart = time()
 
         checkojobs = list(orunning)
         checkfjobs = list(frunning)
+        finished = list()
 
         for job in alljobs:
             if job in checkojobs:
@@ -657,7 +1038,10 @@ def watch_jobs(jobs):
                 del jobdict[ojob]
                 orunning.remove(job.jobid)
                 #find out what happened to the job & deal with it
-                status = check_opt(job)
+                if job.stage == 'preopt':
+                    status = check_preopt(job)
+                else:
+                    status = check_opt(job)
                 if status == 'freq':
                     ocomplete.append(job.name)
                     frunning.append(job.jobid)
@@ -666,6 +1050,15 @@ def watch_jobs(jobs):
                         "Job {} submitted for freq with jobid {}.".format(
                         job.name, job.jobid
                     ))
+                elif status == 'opt':
+                    #continued after running out of walltime, or refined
+                    #after its pre-optimization
+                    orunning.append(job.jobid)
+                    jobdict[job.jobid] = job
+                    logging.debug(
+                        "Job {} continued with jobid {}.".format(
+                        job.name, job.jobid
+                    ))
                 elif status == 'fcrashed':
                     fcrashed.append(job.name)
                     crashed.append(job.name)
@@ -680,7 +1073,7 @@ def watch_jobs(jobs):
                     ))
                 else:
                     completed.append(job.name)
-                    write_stats(job)
+                    finished.append(job)
                     logging.debug("Job {} completed opt.".format(
                         job.name
                     ))
@@ -716,24 +1109,32 @@ def watch_jobs(jobs):
                     ))
                 elif status == 'same' or status == 'imaginary':
                     stuck.append(job.name)
-                    write_stats(job)
+                    finished.append(job)
                     logging.info(
                         "Job {} stuck on transition state with freq {}.".format(
                             job.name, job.firstfreq))
                 elif status == 'ts':
-                    write_stats(job)
+                    finished.append(job)
                     completed.append(job.name)
                     logging.debug("Job {} completed ts.".format(
                         job.name
                     ))
                 else:
-                    write_stats(job)
+                    finished.append(job)
                     completed.append(job.name)
                     logging.debug("Job {} completed freq.".format(
                         job.name
                     ))
             change = True
 
+        if finished:
+            os.chdir(TOPDIR)
+            try:
+                results.record(finished)
+            except Exception as e:
+                logging.warning("Error recording results: {}".format(e))
+        trace.write(jobs)
+
         if len(orunning) == 0 and len(frunning) == 0:
             #all jobs finished or crashed:
             allcomplete = True
@@ -745,10 +1146,12 @@ def watch_jobs(jobs):
                 logstring += "At {}:\n".format(strftime("%d/%m/%y %H:%M:%S"))
                 if len(orunning) > 0:
                     logstring += "There are {} running opt jobs:\n{}\n".format(
-                        len(orunning), turbogo_helpers.list_str(orunning))
+                        len(orunning), turbogo_helpers.list_str(
+                            running_lines(orunning, jobdict)))
                 if len(frunning) > 0:
                     logstring += "There are {} running freq jobs:\n{}\n".format(
-                        len(frunning), turbogo_helpers.list_str(frunning))
+                        len(frunning), turbogo_helpers.list_str(
+                            running_lines(frunning, jobdict)))
                 if len(crashed) > 0:
                     logstring += "There are {} crashed jobs:\n{}\n".format(
                         len(crashed),
@@ -767,6 +1170,9 @@ def watch_jobs(jobs):
             sleep(10*60)
 
     #after job finished/crashed logging
+    os.chdir(TOPDIR)
+    results.write_reports()
+    log_phase_totals(jobs)
     elapsed = turbogo_helpers.time_readable(time()-starttime)
 
     logging.warning("{} jobs completed. {} jobs crashed.".format(
@@ -791,29 +1197,282 @@ def watch_jobs(jobs):
     logging.info(logstring)
 
 
+def running_lines(jobids, jobdict):
+    """Status report lines for running jobs, with their in-job timing"""
+    lines = list()
+    for jobid in jobids:
+        line = str(jobid)
+        if jobid in jobdict:
+            job = jobdict[jobid]
+            timing = jobtiming.status_line(jobtiming.read_profile(job.indir))
+            line += ' {}'.format(job.name)
+            if timing:
+                line += ': ' + timing
+        lines.append(line)
+    return lines
+
+
+def log_phase_totals(jobs):
+    """Logs the time spent in each phase over all of the jobs"""
+    totals = phase_totals(entry for job in jobs
+                          for entry in getattr(job, 'timings', None) or [])
+    if not totals:
+        return
+    logstring = "Time by phase:\n"
+    for name, (count, seconds) in sorted(totals.items(),
+                                         key=lambda t: -t[1][1]):
+        logstring += "{:<14}{:>8} x {}\n".format(
+            name, count, turbogo_helpers.time_readable(int(seconds)))
+    logging.info(logstring.rstrip())
+
+
+def distributed(job):
+    """True if the job's NumForce is split over several queue jobs"""
+    return job.freqopt == 'numforce' and (job.job.freqjobs or 1) > 1
+
+
 def freq_submit(job):
     """
     Sends job for frequency analysis of type 'job.freqtype'
     """
     os.chdir(job.indir)
+    job.job.jobtype = job.freqopt
+    with phase(getattr(job, 'timings', None), 'memory plan',
+               stage=job.freqopt):
+        control_add = memplan.apply_plan(job.job)
+    if not job.job.automod:
+        control_add = list()
+    if job.freqopt in job.predicted and job.job.autort:
+        job.job.rt = '{}:00:00'.format(job.predicted[job.freqopt][1])
     if job.freqopt == 'aoforce':
+        control_add.insert(0, '$les all 2')
+    if control_add:
         try:
-            turbogo_helpers.add_or_modify_control(['$les all 2', '$maxcor 2056'])
+            turbogo_helpers.add_or_modify_control(control_add)
         except turbogo_helpers.ControlFileError:
             logging.warn("Error modifying control file. Attempting to continue.")
-    job.job.jobtype = job.freqopt
-    script = submit_script_prepare(job.job)
     try:
-        jobid = submit_job(job.job, script)
+        with phase(getattr(job, 'timings', None), 'qsub', stage=job.freqopt):
+            if distributed(job):
+                jobid = submit_distributed(job.job)
+            else:
+                script = submit_script_prepare(job.job)
+                jobid = submit_job(job.job, script)
     except Exception as e:
         logging.warning("Error {} submiting freq job {}".format(e, job.indir))
         return -99
+    if jobid is None:
+        logging.warning("Freq job {} not submitted".format(job.indir))
+        return -99
     logging.info("Job {} submitted for {} analysis"
                  .format(job.name, job.freqopt))
     os.chdir(TOPDIR)
     return jobid
 
 
+def _submit_jobset(job):
+    """Prepares and submits one jobset. Module level so worker processes can
+    call it."""
+    job.submit()
+    job.curstart = time()
+    return job
+
+
+def assign_nproc(jobs, slots=None, auto=False):
+    """
+    Chooses nproc and para_arch for the jobsets asking for it (%nproc=auto,
+    or every job with auto), sharing slots concurrent slots (default, every
+    slot gridengine reports) by the scaling policy fitted to the results
+    database, each on one node. Jobs asking for more slots than any node has
+    are cut down, unless their parallel environment spans nodes.
+    Returns the jobsets as a list.
+    """
+    jobs = list(jobs)
+    hosts = memplan.node_hosts()
+    max_slots = max([count for count, _memory in hosts] or [0]) or None
+    chosen = list()
+    for job in jobs:
+        if auto or job.job.autoproc:
+            chosen.append(job)
+        elif (max_slots and job.job.nproc > max_slots and
+              not scaling.spans_nodes(turbogo_helpers.parallel_environment(
+                  job.job.para_arch, job.job.pe))):
+            logging.warning("Job {} asks for {} processors, more than any node "
+                            "has. Using {}.".format(job.name, job.job.nproc,
+                                                    max_slots))
+            job.job.nproc = max_slots
+    if not chosen:
+        return jobs
+    dbfile = os.path.join(TOPDIR, RESULTS_DB)
+    history = list()
+    if os.path.isfile(dbfile):
+        db = ResultsDB(dbfile)
+        history = db.scaling_history()
+        db.close()
+    models = scaling.fit(history)
+    if not slots:
+        slots = sum(count for count, _memory in hosts) or len(chosen)
+    sizes = [(memplan.estimate_functions(job.job.geometry, job.job.basis),
+              job.job.para_arch) for job in chosen]
+    for job, (nproc, arch) in zip(chosen, scaling.assign(sizes, slots, models,
+                                                         max_slots)):
+        job.job.nproc = nproc
+        if nproc > 1 and job.job.jobtype in ['opt', 'optfreq', 'ts', 'sp']:
+            job.job.para_arch = arch
+            if job.job.automod and job.job.jobtype in ['opt', 'optfreq']:
+                turbogo_helpers.parallel_control_mod(job.job.control_add,
+                                                     job.job)
+        logging.debug("Job {}: {} processors ({}).".format(
+            job.name, nproc, job.job.para_arch))
+    logging.info("{} processors chosen for {} jobs sharing {} slots.".format(
+        sum(job.job.nproc for job in chosen), len(chosen), slots))
+    return jobs
+
+
+def assign_walltime(jobs):
+    """
+    Predicts the run time of each stage of the jobsets from the results
+    database (see turbocontrol.walltime), and asks for the predicted h_rt
+    for jobs without %rt. Predictions are kept with every job, so their
+    error is recorded when it completes. Returns the jobsets as a list.
+    """
+    jobs = list(jobs)
+    dbfile = os.path.join(TOPDIR, RESULTS_DB)
+    if not os.path.isfile(dbfile):
+        return jobs
+    db = ResultsDB(dbfile)
+    models = scaling.fit(db.scaling_history())
+    runtimes = walltime.fit(db.runtime_history(), models)
+    db.close()
+    if not runtimes:
+        return jobs
+    count = 0
+    for job in jobs:
+        job.predicted = walltime.predict(job.job, runtimes, models)
+        stage = walltime.stage_of(job.job.jobtype)
+        if job.job.autort and stage in job.predicted:
+            job.job.rt = '{}:00:00'.format(job.predicted[stage][1])
+            count += 1
+            logging.debug("Job {}: {} predicted to take {}, h_rt {}.".format(
+                job.name, stage, turbogo_helpers.time_readable(
+                    int(job.predicted[stage][0])), job.job.rt))
+    logging.info("Walltimes predicted for {} jobs ({}).".format(
+        count, ', '.join('{} x{:.2f} margin'.format(stage, model.margin)
+                         for stage, model in sorted(runtimes.items()))))
+    return jobs
+
+
+def submit_bundles(jobs, size):
+    """
+    Submits the prepared jobsets size to a bundle (see turbocontrol.bundle).
+    Each is given the id bundleid.n, or fails with its bundle.
+    """
+    jobs = [job for job in jobs if job.job is not None]
+    for number, first in enumerate(range(0, len(jobs), size), 1):
+        members = jobs[first:first + size]
+        start = time()
+        try:
+            bundledir, script = bundle.write_bundle(members, TOPDIR, number)
+            os.chdir(bundledir)
+            bundleid = submit_job(Job(name=os.path.basename(bundledir),
+                                      jobtype='bundle'), script)
+        except Exception as e:
+            logging.warning("Error {} submitting bundle {}".format(e, number))
+            bundleid = None
+        os.chdir(TOPDIR)
+        end = time()
+        for n, job in enumerate(members, 1):
+            record(job.timings, 'qsub', start, end, stage=job.jobtype)
+            if bundleid is None:
+                job.jobid = None
+                job.status = "Submit Failed: bundle not submitted"
+            else:
+                job.jobid = bundle.member_id(bundleid, n)
+        if bundleid is not None:
+            logging.info("{} jobs submitted in bundle {}.".format(
+                len(members), bundleid))
+
+
+def submit_jobs(jobs, workers=1, bundle_size=0):
+    """
+    Prepares and submits the jobsets (any iterable) in batches, each run
+    through define and qsub by a pool of worker processes. With bundle_size,
+    small jobs are prepared only and submitted bundle_size to a queue job.
+    Returns the list of submitted jobsets.
+    """
+    if bundle_size > 1:
+        jobs = list(jobs)
+        for job in jobs:
+            job.bundled = job.job is not None and bundle.is_small(job.job)
+    if workers > 1:
+        pool = Pool(workers)
+        try:
+            jobs = list(pool.imap(_submit_jobset, jobs, chunksize=4))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        jobs = [_submit_jobset(job) for job in jobs]
+    if bundle_size > 1:
+        submit_bundles([job for job in jobs if job.bundled], bundle_size)
+    return jobs
+
+
+def console_logging(ch, args):
+    """Sets up the console log handler ch for the verbosity args"""
+    if args.verbose:
+        ch.setLevel(logging.DEBUG)
+    elif args.quiet:
+        ch.setLevel(logging.WARNING)
+        logging.getLogger().setLevel(logging.INFO)
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - [%(levelname)s] - %(message)s'
+        )
+    ch.setFormatter(formatter)
+
+    logging.getLogger().addHandler(ch)
+
+
+def harvest_main(argv):
+    """turbocontrol harvest: collect the results of a completed job tree"""
+    parser = argparse.ArgumentParser(
+        prog="TurboControl harvest",
+        description="Collect the results of every job directory below the "
+        "current one into one table")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-v', '--verbose', action='store_true',
+                        help='Run more verbose (show debugging info)')
+    group.add_argument('-q', '--quiet', action="store_true",
+                        help='Run less verbose (show only warnings)')
+    parser.add_argument('-j', '--jobs', dest="workers", type=int, default=1,
+                        help='Read job directories in WORKERS parallel '
+                        'processes')
+    parser.add_argument('-o', '--output', dest="output", default='harvest',
+                        help='Write the table to OUTPUT.csv and OUTPUT.npz. '
+                        'Default harvest')
+    parser.add_argument('--rescan', dest="rescan", action="store_true",
+                        help='Read every job directory, even those unchanged '
+                        'since the last harvest')
+    parser.add_argument('--xyz', dest="xyz", action="store_true",
+                        help='Write optimization.xyz and final_geometry.xyz '
+                        'in each job directory from coord and gradient')
+    parser.add_argument('--merge', dest="merge", metavar="FILE",
+                        help='Write the final geometry of every job to one '
+                        'multi-frame xyz FILE')
+    parser.add_argument('--convert', dest="convert", metavar="FORMAT",
+                        help='Also convert each final_geometry.xyz to FORMAT '
+                        '(mol, sdf, pdb or any openbabel format)')
+    args = parser.parse_args(argv)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setLevel(logging.INFO)
+    console_logging(ch, args)
+    start = time()
+    from turbocontrol.harvest import harvest
+    harvest(os.curdir, args.workers, args.output, args.rescan,
+            convert=args.convert, xyz=args.xyz, merge=args.merge)
+    logging.info("Harvested in {:.1f} seconds.".format(time() - start))
+
+
 def main():
     """First call on the code"""
     logging.basicConfig(
@@ -821,6 +1480,9 @@ def main():
         filename='turbocontrol.log',
         level=logging.DEBUG)
     logging.info('Started')
+    if len(sys.argv) > 1 and sys.argv[1] == 'harvest':
+        harvest_main(sys.argv[2:])
+        exit()
     p = argparse.ArgumentParser()
     parser = argparse.ArgumentParser(prog="TurboControl",
                                      description="Usage: %prog [options]")
@@ -831,45 +1493,86 @@ def main():
                         help='Run less verbose (show only warnings)')
     parser.add_argument('-s', '--solvent', dest="solvent", action="store_true",
                         help='Show solvents known to Turbocontrol')
+    parser.add_argument('-j', '--jobs', dest="workers", type=int, default=1,
+                        help='Prepare and submit jobs in WORKERS parallel '
+                        'processes')
+    parser.add_argument('-t', '--template', dest="template",
+                        help='Input file without geometry giving the keywords '
+                        'and route for jobs read from --source files')
+    parser.add_argument('--source', dest="sources", action="append",
+                        help='Multi-record .xyz or .sdf FILE to run one job '
+                        'per record from, instead of searching subdirs for '
+                        'inputs. May be repeated')
+    parser.add_argument('--no-cache', dest="cache", action="store_false",
+                        help='Parse every input again instead of reusing the '
+                        'results cached in {} by earlier runs'.format(
+                            CACHEFILE))
+    parser.add_argument('--include', dest="include", action="append",
+                        help='Only read input files matching the GLOB (path '
+                        'or file name). May be repeated')
+    parser.add_argument('--exclude', dest="exclude", action="append",
+                        help='Skip input files and dirs matching the GLOB '
+                        '(path or name). May be repeated')
+    parser.add_argument('-r', '--report', dest="report", action="store_true",
+                        help='Write the stats and freeh reports from the '
+                        'results database, then quit')
+    parser.add_argument('--auto-nproc', dest="auto_nproc",
+                        action="store_true",
+                        help='Choose the processors of every job (as for '
+                        '%%nproc=auto) from its size and earlier speedups')
+    parser.add_argument('--slots', dest="slots", type=int,
+                        help='Slots the jobs may use at once when choosing '
+                        'processors. Default all the slots of the queue')
+    parser.add_argument('--bundle', dest="bundle", type=int, default=0,
+                        metavar='N',
+                        help='Run small jobs (one processor sp or opt, up to '
+                        '{} basis functions) N to a queue job'.format(
+                            bundle.MAX_NBF))
     args = parser.parse_args()
+    if args.sources and not args.template:
+        parser.error('--source requires a --template')
     ch = logging.StreamHandler(sys.stdout)
     ch.setLevel(logging.INFO)
     if args.solvent:
-        print "\n".join(sorted(turbogo_helpers.DIELECTRICS.keys(), key=lambda s: s.lower()))
+        print "\n".join(sorted(turbogo_helpers.dielectrics().keys(), key=lambda s: s.lower()))
         exit()
-    if args.verbose:
-        ch.setLevel(logging.DEBUG)
-    elif args.quiet:
-        ch.setLevel(logging.WARNING)
-        logging.getLogger().setLevel(logging.INFO)
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - [%(levelname)s] - %(message)s'
-        )
-    ch.setFormatter(formatter)
-
-    logging.getLogger().addHandler(ch)
+    if args.report:
+        ResultsDB(os.path.join(TOPDIR, RESULTS_DB)).write_reports()
+        exit()
+    console_logging(ch, args)
 
     start = time()
 
-    inputdirs = find_inputs()
-    inputfiles = list()
-    for key in inputdirs:
-        inputfiles.append(str(os.path.join(key, inputdirs[key][0])))
-
-    logging.info("Inputs found at:\n{}".format(
-        turbogo_helpers.list_str(sorted(inputfiles))))
-
-    jobs = list()
-    for key in inputdirs:
-        job = Jobset(key, inputdirs[key][0], inputdirs[key][1])
-        job.submit()
-        job.curstart = time()
-        if not args.verbose:
+    if args.sources:
+        logging.info("Reading jobs from:\n{}".format(
+            turbogo_helpers.list_str(args.sources)))
+        jobs = submit_jobs(assign_walltime(assign_nproc(
+            source_jobsets(args.template, args.sources), args.slots,
+            args.auto_nproc)), args.workers, args.bundle)
+    else:
+        cache = None
+        if args.cache:
+            cache = InputCache(os.path.join(TOPDIR, CACHEFILE))
+        inputdirs = find_inputs(cache, args.workers, args.include,
+                                args.exclude)
+        inputfiles = list()
+        for key in inputdirs:
+            inputfiles.append(str(os.path.join(key, inputdirs[key][0])))
+
+        logging.info("Inputs found at:\n{}".format(
+            turbogo_helpers.list_str(sorted(inputfiles))))
+
+        jobs = list()
+        for key in inputdirs:
+            jobs.append(Jobset(key, inputdirs[key][0], inputdirs[key][1]))
+        jobs = submit_jobs(assign_walltime(assign_nproc(
+            jobs, args.slots, args.auto_nproc)), args.workers, args.bundle)
+    if not args.verbose:
+        for job in jobs:
             try:
-                os.remove(os.path.join(key, 'define.log'))
+                os.remove(os.path.join(job.indir, 'define.log'))
             except (OSError, IOError):
                 pass
-        jobs.append(job)
     end = time() - start
     logging.info("Set up and submitted {} jobs in {} seconds.".format(
         len(jobs),end))
@@ -8,17 +8,130 @@ Input files are formatted as gaussian, with additional/alternative keywords.
 """
 
 import argparse
+import copy
 import time
 import logging
 import sys
+from itertools import chain
 from subprocess import Popen, PIPE
 
-import turbocontrol.def_op
-import turbocontrol.cosmo_op
 import turbocontrol.turbogo_helpers
+from turbocontrol.geometry import Geometry
+from turbocontrol import molreader
+from turbocontrol.jobtrace import phase
+from turbocontrol import memplan
+from turbocontrol.bundle import BUNDLE_BODY
 import os
 
 DEFAULT_FREQ = 'numforce'
+#jobex convergence of the route's loose and tight (default energy 6, gcart 3)
+JOBEX_CONVERGENCE = {'loose': ' -energy 5 -gcart 2',
+                     'tight': ' -energy 7 -gcart 4'}
+PREOPT_JOBTYPES = ['opt', 'optfreq']
+#the pre-optimization's files, moved here when the requested level starts
+PREOPT_DIR = turbogo_helpers.PREOPT_DIR
+PREOPT_FILES = ['control', 'basis', 'auxbasis', 'mos', 'alpha', 'beta',
+                'coord', 'energy', 'gradient', 'opt.out', 'job.start',
+                'job.last', 'statistics', 'GEO_OPT_CONVERGED',
+                'GEO_OPT_FAILED', 'not.converged', 'timing.log',
+                'timing_summary.txt']
+
+#Turbomole programs timed in every job by wrapper scripts put first on PATH
+TIMED_PROGRAMS = ['ridft', 'dscf', 'rdgrad', 'grad', 'statpt', 'relax',
+                  'aoforce', 'escf', 'egrad']
+#Writes timestamps to timing.log around the whole job (tm_stamp) and each
+#run of the timed programs, see turbocontrol.jobtiming
+TIMING_SETUP = r"""export TM_TIMING=`pwd`/timing.log
+tm_stamp() { echo "$1 $2 $(date +%s.%N) $$ $3" >> "$TM_TIMING"; }
+mkdir -p .tmbin
+for prog in """ + ' '.join(TIMED_PROGRAMS) + r"""; do
+    real=`which $prog 2>/dev/null` || continue
+    printf '#!/bin/bash\necho "start %s $(date +%%s.%%N) $$ $PWD" >> "%s"\n"%s" "$@"\nstatus=$?\necho "end %s $(date +%%s.%%N) $$ $status" >> "%s"\nexit $status\n' $prog "$TM_TIMING" "$real" $prog "$TM_TIMING" > .tmbin/$prog.$$
+    chmod +x .tmbin/$prog.$$
+    mv -f .tmbin/$prog.$$ .tmbin/$prog
+done
+export PATH=`pwd`/.tmbin:$PATH"""
+#With %scratch, copies the job to a directory under the scratch base on the
+#node and runs it there (with Turbomole's temporary files there too). Results
+#are copied back when the script exits, or when gridengine warns of the
+#walltime kill (-notify). The copies are stamped in timing.log. If the copy in
+#fails, or the job's slots are on more than one node, the job runs in place.
+STAGING = r"""export TM_SUBMITDIR=`pwd`
+export TM_SCRATCH={scratch}/tm.${{JOB_ID:-$$}}
+tm_stage_out() {{
+    trap - EXIT USR1 USR2 TERM
+    cd "$TM_SUBMITDIR"
+    tm_stamp start stage-out "$TM_SUBMITDIR"
+    rm -rf "$TM_SCRATCH"/.tmbin "$TM_SCRATCH"/timing.log \
+        "$TM_SCRATCH"/*.stdout "$TM_SCRATCH"/twoint*
+    cp -rp "$TM_SCRATCH"/. "$TM_SUBMITDIR"/
+    status=$?
+    tm_stamp end stage-out $status
+    [ $status -eq 0 ] && rm -rf "$TM_SCRATCH"
+}}
+if [ "${{TM_NODES:-1}}" -gt 1 ]; then
+    echo "Job spans $TM_NODES nodes, running in $TM_SUBMITDIR"
+else
+    tm_stamp start stage-in "$TM_SUBMITDIR"
+    if mkdir -p "$TM_SCRATCH" && cp -rp . "$TM_SCRATCH"/; then
+        tm_stamp end stage-in 0
+        trap tm_stage_out EXIT
+        trap 'tm_stage_out; exit 143' USR1 USR2 TERM
+        cd "$TM_SCRATCH"
+        export TURBOTMPDIR="$TM_SCRATCH"
+    else
+        tm_stamp end stage-in 1
+        echo "Staging to $TM_SCRATCH failed, running in $TM_SUBMITDIR"
+    fi
+fi
+"""
+#Walltime checkpoint of jobex jobs. gridengine sends SIGUSR1 at the soft
+#walltime limit (s_rt, RESTART_MARGIN before h_rt). jobex runs in the
+#background ignoring it, and on the signal the script asks jobex to stop after
+#the current step (the 'stop' file) and leaves the WALLTIME marker for
+#turbocontrol, which continues the optimization from coord and mos.
+CHECKPOINT = r"""tm_checkpoint() {
+    tm_stamp signal walltime 0
+    touch stop WALLTIME
+}
+tm_wait() {
+    while :; do
+        wait $1
+        status=$?
+        kill -0 $1 2>/dev/null || return $status
+    done
+}
+trap tm_checkpoint USR1
+"""
+WALLTIME_FILE = 'WALLTIME'
+STOP_FILE = 'stop'
+#share of the walltime left for the last step after the warning, in minutes
+RESTART_MARGIN = 0.1
+MAX_RESTART_MARGIN = 60
+CHECKPOINT_JOBTYPES = ['opt', 'optfreq', 'ts']
+#writes optimization.xyz and final_geometry.xyz from coord and gradient
+XYZ_COMMAND = ('{python} -c "from turbocontrol.trajectory import '
+               'write_xyz_files; write_xyz_files()"\n')
+#Distributed NumForce (%freqjobs): a prep job writes the displaced geometries
+#(NumForce -prep, one Turbomole directory each in numforce/KraftWerk), an
+#array job of freqjobs tasks works through them, task n taking every n-th,
+#and NumForce run again once they are done picks up the finished gradients,
+#computes any left over and assembles the force constants.
+NUMFORCE_PIECES = r"""n=0
+for dir in `ls -d numforce/KraftWerk/*/ 2>/dev/null | sort`; do
+    [ -f "$dir"control ] || continue
+    n=$((n + 1))
+    [ $(( (n - 1) % {pieces} + 1 )) -eq ${{SGE_TASK_ID:-1}} ] || continue
+    [ -f "$dir"{done} ] && continue
+    (cd "$dir" && {scf} > scf.out && {grad} > grad.out && touch {done})
+done"""
+PIECE_DONE = '.piece_done'
+#(part, script) of a distributed NumForce job in submission order
+DISTRIBUTED_PARTS = [('prep', 'submitscript_prep.sge'),
+                     ('pieces', 'submitscript_pieces.sge'),
+                     (None, 'submitscript.sge')]
+LINK1 = '--link1--'
+GEOM_SEPARATOR = '--geom--'
 
 
 class Error(Exception):
@@ -81,7 +194,9 @@ class Job():
                  jobtype='opt', spin=1, iterations=300, charge=0, ri=None,
                  marij=None, disp=None, para_arch='GA', nproc=1,
                  freqopts=None, freeh=None, rt=168, cosmo=None, data=None,
-                 params=None, indir=None, infile=None):
+                 params=None, indir=None, infile=None, scratch=None,
+                 memory=None, pe=None, freqjobs=None, preopt=None,
+                 converge=None):
         #data doesn't need to be validated, it is when read from inputfile
         self.name = name
         self.basis = basis
@@ -108,10 +223,23 @@ class Job():
             self.para_arch = para_arch
         self.control_add = list()
         self.control_remove = list()
-        self.geometry = list()
+        self.geometry = Geometry()
         self.freqopts = freqopts
         self.rt = "{}:00:00".format(rt)
         self.cosmo = cosmo
+        self.scratch = scratch
+        self.memory = memory
+        self.pe = pe
+        self.freqjobs = freqjobs
+        #basis of a cheaper optimization run first (%preopt)
+        self.preopt = preopt
+        self.converge = converge
+        #control file whose MOs define projects as the start guess
+        self.guess = None
+        self.automod = True
+        self.autoproc = False
+        #walltime predicted by turbocontrol unless %rt is given
+        self.autort = True
         self.data = data
         self.params = params
         self.indir = indir
@@ -124,107 +252,226 @@ def jobsetup(infile):
     Read the input file, get the keyword flags & geometry. Utilizes a gaussian
     type input file.
     """
+    try:
+        f = open(infile, 'r')
+    except (OSError, IOError) as e:
+        raise turbogo_helpers.FileAccessError(
+            "Error reading file {}.".format(infile), e)
+    with f:
+        return parse_input(f)
 
-    lines = turbogo_helpers.read_clean_file(infile)
 
-    iargs = list()
-    igeom = list()
-    control_add = list()
-    control_remove = list()
+def jobsetup_all(infile):
+    """
+    Read every job of an input file, which may hold several --Link1--
+    sections and --Geom-- separated geometries. Jobs are yielded one at a
+    time as the file is read.
+    """
+    try:
+        f = open(infile, 'r')
+    except (OSError, IOError) as e:
+        raise turbogo_helpers.FileAccessError(
+            "Error reading file {}.".format(infile), e)
+    with f:
+        for job in parse_jobs(f):
+            yield job
 
-    #first parse %args from top of file
-    lines.reverse()
-    moreargs = True
-    while moreargs:
-        if lines[-1][0] == '%':
-            iargs.append(lines.pop())
+
+def parse_input(stream):
+    """
+    Parse a gaussian type input from any iterable of lines (an open file, a
+    list) in a single pass and return the Job.
+    """
+    jobs = list(parse_jobs(stream))
+    if len(jobs) != 1:
+        logging.error("Input holds {} jobs, expected one.".format(len(jobs)))
+        raise InputSyntaxError(len(jobs), """Input must hold exactly one job.
+                               Multi-job inputs are read with jobsetup_all.""")
+    return jobs[0]
+
+
+def parse_jobs(stream):
+    """
+    Parse a gaussian type input holding one or more jobs from any iterable of
+    lines, yielding a Job for each --Link1-- section and each geometry of a
+    multi-geometry block.
+    """
+    for section in split_sections(stream):
+        for job in parse_section(section):
+            yield job
+
+
+def split_sections(stream):
+    """Yield the stripped lines of each --Link1-- separated input section"""
+    section = list()
+    for line in stream:
+        line = line.strip()
+        if line.lower() == LINK1:
+            if any(section):
+                yield section
+            section = list()
+        elif line or section:
+            section.append(line)
+    if any(section):
+        yield section
+
+
+def parse_section(section):
+    """
+    Parse one input section in a single pass. Returns a list of Jobs, one per
+    geometry in the geometry block.
+    """
+    lines = (line.strip() for line in section)
+    args, route, title, ch_spin = parse_header(lines)
+
+    #Input Geometry in xyz cartesian format, ended by the gaussian spec
+    #blank line (or the end of the file). --Geom-- lines separate the frames
+    #of a multi-geometry block.
+    frames = [list()]
+    for line in lines:
+        if not line:
+            break
+        if line.lower() == GEOM_SEPARATOR:
+            frames.append(list())
         else:
-            moreargs = False
+            frames[-1].append(line)
+
+    geoms = [turbogo_helpers.check_geom(igeom) for igeom in frames]
+    logging.debug("{} geometries of {} atoms processed".format(
+        len(geoms), sum(len(geom) for geom in geoms)))
+
+    control_add, control_remove = parse_control(lines)
+
+    if len(geoms) == 1:
+        return [build_job(args, route, title, ch_spin, geoms[0], control_add,
+                          control_remove)]
+    return [build_job(args, route, "{} {}".format(title, num), ch_spin, geom,
+                      control_add, control_remove)
+            for num, geom in enumerate(geoms, 1)]
+
+
+def parse_header(lines):
+    """
+    Parse the %args, route card, title and charge & spin from the start of an
+    iterator of stripped input lines. Returns (args, route, title, ch_spin).
+    """
+    #first parse %args from top of file
+    iargs = list()
+    line = next(lines, None)
+    while line is not None and line[:1] == '%':
+        iargs.append(line)
+        line = next(lines, None)
 
     args = turbogo_helpers.check_args(iargs)
     logging.debug("{} args processed".format(len(args)))
 
     #immediately following %args is the #route card
-    if not lines[-1][0] == '#':
+    if line is None or line[:1] != '#':
         logging.error("""Syntax error at route. Must immediately follow
                       arguements ('%') and start with #""")
-        raise InputSyntaxError(str(lines[0]), """Syntax error at route.
+        raise InputSyntaxError(str(line), """Syntax error at route.
                                Must immediately follow arguements ('%') and
                                start with #""")
-    else:
-        iroute = lines.pop()
 
     logging.debug("Parsing input route card.")
-    route = turbogo_helpers.check_route(iroute)
+    route = turbogo_helpers.check_route(line)
     logging.debug("{} Route parameters processed".format(len(route)))
 
     #specs from gaussian: blank line required
-    if not lines[-1] == '':
+    line = next(lines, None)
+    if line != '':
         logging.error("""Syntax error after route. Blank line required before
                       title""")
-        raise InputSyntaxError(str(lines[0]), """Syntax error after route.
+        raise InputSyntaxError(str(line), """Syntax error after route.
                                Blank line required before title""")
-    else:
-        del lines[-1]
 
     #Now is the job title.
-    title = str(lines[-1])
+    title = str(next(lines, ''))
     logging.debug("Title: {}".format(title))
-    del lines[-1]
 
     #Gaussian spec another blank line
-    if not lines[-1] == '':
+    line = next(lines, None)
+    if line != '':
         logging.error("""Syntax error after title. Blank line required before
                       charge & spin""")
-        raise InputSyntaxError(str(lines[0]), """Syntax error after title.
+        raise InputSyntaxError(str(line), """Syntax error after title.
                                Blank line required before charge & spin""")
-    else:
-        del lines[-1]
 
     #Charge and spin (0 1)
-    ichspin = lines[-1]
-    ch_spin = turbogo_helpers.check_chspin(ichspin)
+    ch_spin = turbogo_helpers.check_chspin(next(lines, ''))
     logging.debug("Charge of {} and spin of {}.".format(ch_spin['ch'],
                                                    ch_spin['spin']))
-    del lines[-1]
+    return args, route, title, ch_spin
 
-    #Input Geometry in xyz cartesian format
-    moregeom = True
-    while moregeom:
-        if not lines[-1][:1] == '':
-            igeom.append(lines.pop())
-        else:
-            moregeom = False
-
-    geom = turbogo_helpers.check_geom(igeom)
-    logging.debug("{} lines of geometry processed".format(len(geom)))
-
-    #gaussian spec blankline
-    if not lines[-1] == '':
-        logging.error("Syntax error after geometry. Blank line required.")
-        raise InputSyntaxError(str(lines[0]), """Syntax error after geometry.
-                               Blank line required.""")
-    else:
-        del lines[-1]
 
+def parse_control(lines):
+    """
+    Parse the control file modifications following the geometry. Returns
+    (control_add, control_remove).
+    """
     #new spec: manual add or subtract from control file with:
     #$opt to add, or:
     #-$opt to remove
-    if len(lines) > 0:
-        logging.debug("Parsing additional control arguements")
-        morelines = True
-        while morelines:
-            try:
-                if lines[-1][0] == '$' or lines[-1][0] == '-' and lines[-1][1] == '$':
-                    if lines[-1][0] == '$':
-                        control_add.append(lines.pop())
-                    else:
-                        control_remove.append(lines.pop())
-                else:
-                    morelines = False
-            except IndexError:
-                morelines = False
-        logging.debug("{} additional lines processed".format(len(control_add)))
+    control_add = list()
+    control_remove = list()
+    for line in lines:
+        if line[:1] == '$':
+            control_add.append(line)
+        elif line[:2] == '-$':
+            control_remove.append(line)
+        else:
+            break
+    logging.debug("{} additional lines processed".format(len(control_add)))
+    return control_add, control_remove
+
+
+def read_template(infile):
+    """
+    Read a job template: an input file without geometry (charge & spin
+    followed by a blank line, then any control file modifications). Returns a
+    dict of the checked args, route, title, ch_spin, control_add and
+    control_remove.
+    """
+    try:
+        f = open(infile, 'r')
+    except (OSError, IOError) as e:
+        raise turbogo_helpers.FileAccessError(
+            "Error reading file {}.".format(infile), e)
+    with f:
+        lines = (line.strip() for line in f)
+        args, route, title, ch_spin = parse_header(lines)
+        for line in lines:
+            if not line:
+                break
+            logging.warning("Geometry line '{}' in template ignored.".format(
+                line))
+        control_add, control_remove = parse_control(lines)
+    return {'args': args, 'route': route, 'title': title, 'ch_spin': ch_spin,
+            'control_add': control_add, 'control_remove': control_remove}
+
+
+def jobsetup_source(template, source):
+    """
+    Yields a Job for each record of a multi-record xyz or sdf structure file,
+    set up from the template file. Records are read as the jobs are used.
+    Untitled records are named from the template title and record number.
+    """
+    parts = read_template(template)
+    for num, (title, geom) in enumerate(molreader.read_records(source), 1):
+        if not title:
+            title = "{} {}".format(parts['title'], num)
+        yield build_job(parts['args'], parts['route'], title,
+                        parts['ch_spin'], geom, parts['control_add'],
+                        parts['control_remove'])
+
+
+def build_job(args, route, title, ch_spin, geom, control_add=None,
+              control_remove=None):
+    """
+    Set up a Job from checked args, route, title, charge & spin and geometry.
+    """
+    control_add = list(control_add or [])
+    control_remove = list(control_remove or [])
 
     #Set up job.class
     logging.debug("Setting up Job with collected information.")
@@ -263,6 +510,10 @@ def jobsetup(infile):
         job.disp = True
     if 'freeh' in route:
         job.freeh = True
+    if 'loose' in route:
+        job.converge = 'loose'
+    elif 'tight' in route:
+        job.converge = 'tight'
     if job.freeh:
         job.freqopts += '+freeh'
     if 'iterations' in args:
@@ -270,11 +521,31 @@ def jobsetup(infile):
     elif 'maxcycles' in args:
         job.iterations = int(args['maxcycles'])
     if 'nproc' in args:
-        job.nproc = int(args['nproc'])
+        if args['nproc'] == 'auto':
+            #chosen with the other jobs when submitted by turbocontrol
+            job.autoproc = True
+        else:
+            job.nproc = int(args['nproc'])
     if 'cosmo' in args:
         job.cosmo = args['cosmo']
     if 'rt' in args:
         job.rt = "{}:00:00".format(args['rt'])
+        job.autort = False
+    if 'scratch' in args:
+        job.scratch = args['scratch']
+    if 'pe' in args:
+        job.pe = args['pe']
+    if 'freqjobs' in args:
+        job.freqjobs = int(args['freqjobs'])
+    if 'preopt' in args:
+        if job.jobtype not in PREOPT_JOBTYPES:
+            logging.warning("Pre-optimization of {} job ignored.".format(
+                job.jobtype))
+        elif args['preopt'].lower() == job.basis.lower():
+            logging.warning("Pre-optimization in the job's own basis "
+                            "ignored.")
+        else:
+            job.preopt = args['preopt']
     if job.jobtype != 'freq':
         if 'arch' in args:
             job.para_arch = args['arch']
@@ -282,6 +553,7 @@ def jobsetup(infile):
         job.para_arch = 'SMP'
     if 'mod' in args and not args['mod']:
         logging.debug("No mod of control requested")
+        job.automod = False
     else:
         control_add = turbogo_helpers.auto_control_mod(control_add, job)
     job.control_add = control_add
@@ -290,16 +562,61 @@ def jobsetup(infile):
     return job
 
 
+def fan_out(indir, infile, jobs):
+    """
+    Pair each job read from infile with its working directory. A lone job
+    runs in indir, the jobs of a multi-job input get numbered subdirectories
+    of indir named after the input file. Directories are not created here.
+    """
+    jobs = iter(jobs)
+    first = next(jobs, None)
+    if first is None:
+        return
+    second = next(jobs, None)
+    if second is None:
+        yield indir, first
+        return
+    for num, job in enumerate(chain([first, second], jobs), 1):
+        yield job_dir(indir, infile, num), job
+
+
+def job_dir(indir, infile, num):
+    """Working dir of job number num from the multi-job input infile"""
+    stem = os.path.splitext(os.path.basename(infile))[0]
+    return os.path.join(indir, stem, '{:04d}'.format(num))
+
+
+def preopt_job(job):
+    """
+    The pre-optimization of job (%preopt): an RI optimization in the cheap
+    basis job.preopt to loose convergence, without frequencies. turbocontrol
+    runs the job itself from its result (see PREOPT_DIR).
+    """
+    pre = copy.copy(job)
+    pre.basis = job.preopt
+    pre.jobtype = 'opt'
+    pre.ri = True
+    pre.marij = True
+    pre.converge = 'loose'
+    pre.freqopts = None
+    pre.freeh = None
+    pre.preopt = None
+    pre.guess = None
+    pre.control_add = list(job.control_add)
+    pre.control_remove = list(job.control_remove)
+    return pre
+
+
 def write_coord(job, filename='coord'):
     """Write the coord file"""
-    job.geometry.insert(0, '$coord')
-    job.geometry.append('$end')
-    turbogo_helpers.write_file(filename, job.geometry)
+    turbogo_helpers.write_file(filename, job.geometry.coord_lines())
     logging.debug('File {} written.'.format(filename))
 
 
 def run_define(job):
     """Setup and Run Define"""
+    #pexpect is only loaded when define is actually run
+    from turbocontrol import def_op
     define = def_op.Define()
     define.setup_define(job)
     define.start_define()
@@ -307,24 +624,41 @@ def run_define(job):
     
 def run_cosmo(job):
     """Set up and run CosmoPrep"""
+    from turbocontrol import cosmo_op
     cosmo = cosmo_op.Cosmo()
     cosmo.setup_cosmo(job)
     cosmo.start_cosmo()
     exitcode = cosmo.run_cosmo()
 
 
-def control_edit(job, filename='control'):
-    """Edit the control files to include or remove the required lines"""
+def control_edit(job, filename='control', extra=None):
+    """
+    Edit the control files to include or remove the required lines. extra
+    lines (the memory plan) are added with the job's own.
+    """
     logging.debug("Editing control file to add additional info.")
     turbogo_helpers.remove_control(job.control_remove, filename)
-    turbogo_helpers.add_or_modify_control(job.control_add, filename)
+    turbogo_helpers.add_or_modify_control(job.control_add + (extra or []),
+                                          filename)
 
 
-def submit_script_prepare(job, filename='submitscript.sge'):
-    """Write a submit script for gridengine for the job."""
+def submit_script_prepare(job, filename='submitscript.sge', part=None,
+                          hold=None, body=None):
+    """
+    Write a submit script for gridengine for the job. part is 'prep' or
+    'pieces' for the one slot steps of a distributed NumForce job, run before
+    the job itself, and hold the job id the script waits for. The commands of
+    the job alone, for a bundle's worker to run, are also written to body if
+    it's given.
+    """
 
     logging.debug("Preparing gridengine submit script")
 
+    #the steps of a distributed NumForce job are serial and backfill anywhere
+    slots = job.nproc
+    if part:
+        slots = 1
+
     #NPROC has to be one less for MPI jobs
     nproc = job.nproc
     if job.para_arch == "MPI":
@@ -348,22 +682,37 @@ def submit_script_prepare(job, filename='submitscript.sge'):
 export PARNODES={nproc}
 cat $PE_HOSTFILE | awk '{{for(i=0;i<$2;i++) print $1}}' > hosts_file
 export HOSTS_FILE=`readlink -f hosts_file`
+export TM_NODES=`awk '{{print $1}}' $PE_HOSTFILE | sort -u | wc -l`
 """.format(nproc = nproc)
 
-    if job.nproc > 1:
+    if slots > 1:
         parallel_preamble = preamble_template
     else:
         parallel_preamble = ''
 
     #set up the job command call itself
-    if job.jobtype == 'opt' or job.jobtype == 'optfreq':
+    if part == 'prep':
+        jobcommand = 'NumForce -prep -central'
+        if job.ri:
+            jobcommand += ' -ri'
+        jobcommand += ' > numforce_prep.out'
+
+    elif part == 'pieces':
+        if job.ri:
+            scf, grad = 'ridft', 'rdgrad'
+        else:
+            scf, grad = 'dscf', 'grad'
+        jobcommand = NUMFORCE_PIECES.format(pieces=job.freqjobs,
+                                            done=PIECE_DONE, scf=scf,
+                                            grad=grad)
+
+    elif job.jobtype == 'opt' or job.jobtype == 'optfreq':
         jobcommand = 'jobex'
         jobcommand += ' -c {}'.format(job.iterations)
         if job.ri:
             jobcommand += ' -ri'
-        #add making xyz sp geom and opt trajectory xyz files after jobex
+        jobcommand += JOBEX_CONVERGENCE.get(job.converge, '')
         jobcommand += ' > opt.out'
-        jobcommand += '\nt2x > optimization.xyz\nt2x -c > final_geometry.xyz'
 
     elif job.jobtype == 'aoforce':
         jobcommand = 'aoforce'
@@ -391,12 +740,70 @@ export HOSTS_FILE=`readlink -f hosts_file`
             jobcommand = 'dscf\ngrad\njobex -trans'
         if job.iterations:
             jobcommand += ' -c {}'.format(job.iterations)
+        jobcommand += JOBEX_CONVERGENCE.get(job.converge, '')
         jobcommand += ' > ts.out'
-        jobcommand += '\nt2x > optimization.xyz\nt2x -c > final_geometry.xyz'
 
     logging.debug('Job submit script: {} completed.'.format(
         jobcommand.replace('\n', ' & ')))
 
+    #stop jobex cleanly before the walltime
+    if job.jobtype in CHECKPOINT_JOBTYPES and not part:
+        softrt = '\n#$ -l s_rt={}'.format(soft_walltime(job.rt))
+        checkpoint = CHECKPOINT
+        jobcommand = "( trap '' USR1\n{}\n) &\ntm_wait $!".format(
+            jobcommand)
+    else:
+        softrt = ''
+        checkpoint = ''
+
+    #xyz files of optimizations, written by the python turbogo runs under so
+    #jobs run without the controller have them too
+    if job.jobtype in ['opt', 'optfreq', 'ts'] and not part:
+        geometries = XYZ_COMMAND.format(python=sys.executable)
+    else:
+        geometries = ''
+
+    #stage the job through node-local scratch. Not the distributed NumForce
+    #steps, which share the job directory
+    if job.scratch and not part:
+        staging = STAGING.format(scratch=job.scratch)
+        notify = '\n#$ -notify'
+    else:
+        staging = ''
+        notify = ''
+
+    #parallel environment of the para_arch; MPI ones may span nodes, each
+    #listed per slot in hosts_file
+    pe = turbogo_helpers.parallel_environment(job.para_arch, job.pe)
+
+    #array of tasks, and the job to wait for
+    queueing = ''
+    if part == 'pieces':
+        queueing += '\n#$ -t 1-{}'.format(job.freqjobs)
+    if hold:
+        queueing += '\n#$ -hold_jid {}'.format(hold)
+
+    #memory per slot from the memory plan
+    if job.memory:
+        vmem = '\n#$ -l h_vmem={}M'.format(job.memory)
+    else:
+        vmem = ''
+
+    #the job's own commands, from its start marker
+    job_body = """touch startfile
+
+{timing}
+{staging}{checkpoint}tm_stamp start job "$PWD"
+{jobcommand}
+tm_stamp end job $?
+{geometries}""".format(
+            jobcommand=jobcommand,
+            timing=TIMING_SETUP,
+            staging=staging,
+            checkpoint=checkpoint,
+            geometries=geometries,
+        )
+
     #make one big sumbit script
     #runs the jobcommand
     submit_script = """#!/bin/bash
@@ -405,23 +812,25 @@ export HOSTS_FILE=`readlink -f hosts_file`
 #$ -j y
 #$ -o {jobname}.stdout
 #$ -N tm.{jobname}
-#$ -l h_rt={rt}
+#$ -l h_rt={rt}{softrt}{vmem}
 #$ -R y
-#$ -pe threaded {nproc}
+#$ -pe {pe} {nproc}{notify}{queueing}
 {env_mod}
 {parallel_preamble}
 source $TURBODIR/Config_turbo_env
 
 ulimit -s unlimited
 
-touch startfile
-
-{jobcommand}
-""".format(
+{job_body}""".format(
             jobname=turbogo_helpers.slug(job.name),
-            nproc=job.nproc,
+            pe=pe,
+            nproc=slots,
             parallel_preamble=parallel_preamble,
-            jobcommand=jobcommand,
+            job_body=job_body,
+            notify=notify,
+            queueing=queueing,
+            softrt=softrt,
+            vmem=vmem,
             env_mod=env_mod,
             rt = job.rt
         )
@@ -429,12 +838,26 @@ touch startfile
     #listify script by lines and write lines to file
     try:
         turbogo_helpers.write_file(filename, submit_script.split('\n'))
+        if body:
+            turbogo_helpers.write_file(body, job_body.split('\n'))
     except turbogo_helpers.FileAccessError:
         logging.warning("Error writing submit script to file.")
     logging.debug('Submit script generated at {}.'.format(filename))
     return submit_script
 
 
+def soft_walltime(rt):
+    """
+    The soft walltime limit (s_rt) for h_rt rt (H:MM:SS), RESTART_MARGIN of
+    it (at most MAX_RESTART_MARGIN minutes) before.
+    """
+    fields = [int(f) for f in str(rt).split(':')] + [0, 0]
+    minutes = fields[0] * 60 + fields[1]
+    margin = min(MAX_RESTART_MARGIN, int(minutes * RESTART_MARGIN))
+    minutes = max(1, minutes - margin)
+    return '{}:{:02d}:00'.format(minutes // 60, minutes % 60)
+
+
 def submit_job(job, script=None):
     """Submit the specified job to queue for calculation"""
 
@@ -449,7 +872,8 @@ def submit_job(job, script=None):
     p = Popen('qsub', stdin=PIPE, stdout=PIPE)
     poutput, perr = p.communicate(input=script)
     if 'has been submitted' in poutput:
-        jobid = poutput.split('\n')[0].split(' ')[2]
+        #array jobs are reported as id.first-last:step
+        jobid = poutput.split('\n')[0].split(' ')[2].split('.')[0]
         if turbogo_helpers.is_int(jobid):
             job.jobid = jobid
             logging.info('Job {} with job id {} submitted'.format(
@@ -464,6 +888,35 @@ def submit_job(job, script=None):
     return job.jobid
 
 
+def submit_distributed(job):
+    """
+    Submit a distributed NumForce job (%freqjobs): the prep job, the array of
+    pieces waiting for it, and NumForce itself waiting for the pieces.
+    Returns the job id of the last, which finishes the job, or None.
+    """
+    hold = None
+    for part, filename in DISTRIBUTED_PARTS:
+        script = submit_script_prepare(job, filename, part, hold)
+        hold = submit_job(job, script)
+        if hold is None:
+            return None
+    return hold
+
+
+def distributed_progress(indir=os.curdir):
+    """(finished by the pieces, all) displacements of a distributed NumForce
+    job in indir"""
+    kraftwerk = os.path.join(indir, 'numforce', 'KraftWerk')
+    try:
+        dirs = [os.path.join(kraftwerk, d) for d in os.listdir(kraftwerk)]
+    except OSError:
+        return 0, 0
+    dirs = [d for d in dirs
+            if os.path.isfile(os.path.join(d, 'control'))]
+    done = [d for d in dirs if os.path.isfile(os.path.join(d, PIECE_DONE))]
+    return len(done), len(dirs)
+
+
 def check_input_file(infile):
     """Checks to see if input file is of valid format. Returns true or false"""
     try:
@@ -474,14 +927,18 @@ def check_input_file(infile):
         return False
 
 
-def jobrunner(infile = None, job = None):
+def jobrunner(infile = None, job = None, timings = None, submit = True):
     """
-    run the job prep and submit from a specific file or supplied prepared job
+    run the job prep and submit from a specific file or supplied prepared job.
+    The time of each step is added to the timings list, if given. With submit
+    False the job is prepared but not submitted (to be run in a bundle).
     """
     starttime = time.time()
+    jobid = None
     if not job:
         if infile:
-            job = jobsetup(infile)
+            with phase(timings, 'parse'):
+                job = jobsetup(infile)
             logging.debug('Job setup complete.')
         else:
             logging.critical('Job input file or prepared job must be supplied.')
@@ -492,13 +949,15 @@ def jobrunner(infile = None, job = None):
     logging.debug('coord written')
     if job.jobtype == 'opt' or job.jobtype == 'optfreq' or job.jobtype == 'ts' or job.jobtype == 'sp' or job.jobtype == 'prep':
         defstart = time.time()
-        run_define(job)
+        with phase(timings, 'define'):
+            run_define(job)
         logging.debug('define complete.')
         defend = time.time()
         logging.debug("define ended in {0:.2f}s".format(defend-defstart))
     if job.cosmo != None:
         try:
-            run_cosmo(job)
+            with phase(timings, 'cosmoprep'):
+                run_cosmo(job)
         except Exception as e:
             logging.warn("Some error in cosmo running: {}".format(e))
     elif job.jobtype == 'aoforce' or job.jobtype == 'numforce':
@@ -509,20 +968,47 @@ def jobrunner(infile = None, job = None):
                 )
             raise JobLogicError("Convergence required before {} job.".format(
                 job.jobtype))
-    if job.control_remove or job.control_add:
-        control_edit(job)
+    with phase(timings, 'memory plan'):
+        memory_lines = memplan.apply_plan(job)
+    if not job.automod:
+        memory_lines = list()
+    if job.control_remove or job.control_add or memory_lines:
+        with phase(timings, 'control edit'):
+            control_edit(job, extra=memory_lines)
         logging.debug('control file editing complete.')
     else:
         logging.debug('No control file edits')
-    script = submit_script_prepare(job)
+    script = submit_script_prepare(job, body=None if submit else BUNDLE_BODY)
     logging.debug('Submit script written.')
-    if job.jobtype != 'prep':
-        jobid = submit_job(job, script)
-    else:
+    if job.jobtype == 'prep':
         logging.info('Job not submitted - prep flag in input.')
+    elif submit:
+        with phase(timings, 'qsub', stage=job.jobtype):
+            jobid = submit_job(job, script)
+    else:
+        logging.debug('Job prepared for a bundle.')
     logging.debug("Submitted in {0:.2f} seconds.".format(time.time() - starttime))
     return jobid, job.freqopts, job.name, job.jobtype
 
+def check_jobs(infile):
+    """
+    Reads and validates every job of infile, reporting each one. Nothing is
+    written and define is never run. Returns True if the input is valid.
+    """
+    try:
+        jobs = list(jobsetup_all(infile))
+    except Exception as e:
+        logging.critical("Input file {} is not valid. Error {}".format(
+            infile, getattr(e, 'msg', None) or e))
+        return False
+    for job in jobs:
+        logging.info("Job '{}': {} {}/{}, {} atoms, charge {}, spin {}".format(
+            job.name, job.jobtype, job.functional, job.basis,
+            len(job.geometry), job.charge, job.spin))
+    logging.info("{} is valid input for {} job(s).".format(infile, len(jobs)))
+    return True
+
+
 def main():
     """Manages the code"""
     logging.basicConfig(
@@ -538,6 +1024,9 @@ def main():
                         help='Run more verbose (show debugging info)')
     group.add_argument('-q', '--quiet', action="store_true",
                         help='Run less verbose (show only warnings)')
+    parser.add_argument('-c', '--check', action='store_true',
+                        help='Only check FILE, without setting up or '
+                        'submitting any jobs')
     args = parser.parse_args()
 
     ch = logging.StreamHandler(sys.stdout)
@@ -559,14 +1048,31 @@ def main():
     if not ifile:
         logging.critical('Input file {} does not exist.'.format(infile))
         exit()
+    if args.check:
+        sys.exit(0 if check_jobs(infile) else 1)
     #file is good. let's go!
-    jobid, freqopts, _name, _type = jobrunner(infile = infile)
-    if not args.verbose:
+    topdir = os.path.abspath(os.curdir)
+    for workdir, job in fan_out(os.curdir, infile, jobsetup_all(infile)):
+        turbogo_helpers.ensure_dir(workdir)
+        os.chdir(workdir)
+        if job.preopt:
+            logging.info("Pre-optimization is run by turbocontrol. Job {} "
+                         "runs at its own level only.".format(job.name))
         try:
-            os.remove(os.path.join(os.path.curdir, 'define.log'))
-        except (OSError, IOError):
-            pass
-    logging.debug('Jobid: {}\nFreqStatus: {}'.format(jobid, freqopts))
+            jobid, freqopts, _name, _type = jobrunner(job=job)
+        except Exception as e:
+            logging.warning("Error {} setting up job in {}.".format(
+                e, workdir))
+            continue
+        else:
+            if not args.verbose:
+                try:
+                    os.remove(os.path.join(os.path.curdir, 'define.log'))
+                except (OSError, IOError):
+                    pass
+            logging.debug('Jobid: {}\nFreqStatus: {}'.format(jobid, freqopts))
+        finally:
+            os.chdir(topdir)
     exit()
 
 if __name__ == "__main__":
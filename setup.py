@@ -14,8 +14,9 @@ setup(name='turbocontrol',
       license='MIT',
       url='http://github.com/pbulsink/turbocontrol',
       packages=['turbocontrol'],
+      package_data={'turbocontrol': ['dielectricsolvents.csv']},
       scripts=scripts,
-      requires=['pexpect'],
+      requires=['pexpect', 'numpy'],
       classifiers=["Programming Language :: Python",
                    "Programming Language :: Python :: 2.7",
                    "Development Status :: 4 - Beta",
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Import-time benchmark for the turbogo and turbocontrol scripts. Each script
+is imported in a fresh interpreter, repeatedly, and the median time over a
+bare interpreter start is reported along with any heavy modules (pexpect,
+openbabel and the modules driving Turbomole programs) loaded on the way.
+Exits non-zero if a heavy module is loaded or a --max time is exceeded, so it
+can guard against import-time regressions.
+"""
+
+import argparse
+import imp
+import os
+import subprocess
+import sys
+import time
+
+HEAVY = ['pexpect', 'openbabel', 'turbocontrol.def_op',
+         'turbocontrol.cosmo_op', 'turbocontrol.screwer_op',
+         'turbocontrol.freeh_op', 'turbocontrol.formatter']
+
+REPORT = "import sys; print ' '.join(m for m in {} if m in sys.modules)"
+
+
+def targets():
+    """Returns [(name, code)] importing each script"""
+    bindir = os.path.dirname(imp.find_module('turbogo')[1])
+    return [
+        ('turbogo', 'import turbogo'),
+        ('turbocontrol', "import imp; imp.load_source('tcbin', {!r})".format(
+            os.path.join(bindir, 'turbocontrol.py'))),
+        ]
+
+
+def run(code):
+    """Run code in a fresh interpreter, return (elapsed, output)"""
+    start = time.time()
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return time.time() - start, out.strip()
+
+
+def median(times):
+    times = sorted(times)
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser("Usage: %prog [options]")
+    parser.add_argument('-n', '--repeat', type=int, default=10,
+                        help="Interpreter starts per script. Default 10")
+    parser.add_argument('--max', type=float,
+                        help="Fail if an import takes longer than MAX s")
+    args = parser.parse_args()
+    base = median([run('pass')[0] for _ in range(args.repeat)])
+    print "Interpreter start: {:.1f} ms".format(base * 1000)
+    failed = False
+    for name, code in targets():
+        code = '; '.join([code, REPORT.format(HEAVY)])
+        results = [run(code) for _ in range(args.repeat)]
+        elapsed = median([t for t, _ in results]) - base
+        heavy = results[0][1]
+        print "{:<14} {:8.1f} ms  {}".format(
+            name, elapsed * 1000, 'loads ' + heavy if heavy else '')
+        if heavy or (args.max and elapsed > args.max):
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for input parsing. Writes a tree of gaussian type inputs to a
+temporary directory and reports jobsetup throughput over the whole tree.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from turbogo import jobsetup
+from turbocontrol.turbogo_helpers import write_file
+
+HEADER = """%nproc=4
+%arch=GA
+%maxcycles=200
+# opt freq b3-lyp/def2-tzvp ri marij numforce
+
+Benchmark {num}
+
+0 1"""
+
+FOOTER = """
+$disp
+-$paraoptions
+"""
+
+
+def make_tree(topdir, nfiles, natoms):
+    """Write nfiles inputs of natoms atoms each, one per subdirectory"""
+    for i in range(nfiles):
+        indir = os.path.join(topdir, 'job{}'.format(i))
+        os.mkdir(indir)
+        lines = HEADER.format(num=i).split('\n')
+        for _ in range(natoms):
+            lines.append('{} {:.6f} {:.6f} {:.6f}'.format(
+                random.choice(['C', 'H', 'N', 'O']),
+                random.uniform(-10, 10),
+                random.uniform(-10, 10),
+                random.uniform(-10, 10)))
+        lines.extend(FOOTER.split('\n'))
+        write_file(os.path.join(indir, 'input.com'), lines)
+
+
+def bench(topdir, nfiles):
+    """Parse every input in the tree, return the elapsed time"""
+    start = time.time()
+    for i in range(nfiles):
+        jobsetup(os.path.join(topdir, 'job{}'.format(i), 'input.com'))
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser("Usage: %prog [options]")
+    parser.add_argument('-n', '--nfiles', type=int, default=1000,
+                        help="Number of input files. Default 1000")
+    parser.add_argument('-a', '--natoms', type=int, default=50,
+                        help="Atoms per input file. Default 50")
+    args = parser.parse_args()
+    topdir = tempfile.mkdtemp()
+    try:
+        make_tree(topdir, args.nfiles, args.natoms)
+        elapsed = bench(topdir, args.nfiles)
+    finally:
+        shutil.rmtree(topdir)
+    print "Parsed {} files ({} atoms each) in {:.3f} s".format(
+        args.nfiles, args.natoms, elapsed)
+    print "{:.1f} files/s, {:.0f} atoms/s".format(
+        args.nfiles / elapsed, args.nfiles * args.natoms / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,16 +8,31 @@ Runs all test files
 
 from unittest import TestLoader, TextTestRunner, TestSuite
 from test_turbogo import TestControlEdit, TestJob, TestSetup
-from test_turbogo import TestWriteCoord, TestSubmitScriptPrep
+from test_turbogo import TestWriteCoord, TestSubmitScriptPrep, TestMultiJob
+from test_turbogo import TestTemplate, TestCheck
 from test_turbogo_helpers import TestArgs, TestChSpin
 from test_turbogo_helpers import TestControlMods, TestGeom
 from test_turbogo_helpers import TestRoute, TestSimpleFuncs
 from test_turbocontrol import TestJobset, TestFindInputs
 from test_turbocontrol import TestJobChecker, TestWriteStats, TestWriteFreeh
+from test_turbocontrol import TestAssignNproc, TestCheckpoint, TestSources
 from test_def_op import TestDefine
 from test_screwer_op import TestScrewer
 from test_freeh_op import TestFreeh
 from test_cosmo_op import TestCosmo
+from test_geometry import TestGeometry
+from test_molreader import TestReaders
+from test_inputcache import TestInputCache
+from test_discover import TestScanDir
+from test_harvest import TestHarvest
+from test_formatter import TestFormatter
+from test_trajectory import TestTrajectory
+from test_jobtrace import TestJobTrace
+from test_jobtiming import TestJobTiming
+from test_memplan import TestMemPlan
+from test_scaling import TestScaling, TestJobScaling
+from test_bundle import TestBundle
+from test_walltime import TestWalltime, TestRuntimeHistory
 
 if __name__ == "__main__":
     loader = TestLoader()
@@ -27,6 +42,9 @@ if __name__ == "__main__":
         loader.loadTestsFromTestCase(TestSetup),
         loader.loadTestsFromTestCase(TestWriteCoord),
         loader.loadTestsFromTestCase(TestSubmitScriptPrep),
+        loader.loadTestsFromTestCase(TestMultiJob),
+        loader.loadTestsFromTestCase(TestTemplate),
+        loader.loadTestsFromTestCase(TestCheck),
         loader.loadTestsFromTestCase(TestArgs),
         loader.loadTestsFromTestCase(TestChSpin),
         loader.loadTestsFromTestCase(TestControlMods),
@@ -37,11 +55,29 @@ if __name__ == "__main__":
         loader.loadTestsFromTestCase(TestFindInputs),
         loader.loadTestsFromTestCase(TestJobChecker),
         loader.loadTestsFromTestCase(TestWriteStats),
+        loader.loadTestsFromTestCase(TestAssignNproc),
+        loader.loadTestsFromTestCase(TestCheckpoint),
+        loader.loadTestsFromTestCase(TestSources),
         loader.loadTestsFromTestCase(TestDefine),
         loader.loadTestsFromTestCase(TestScrewer),
         loader.loadTestsFromTestCase(TestFreeh),
         loader.loadTestsFromTestCase(TestCosmo),
         loader.loadTestsFromTestCase(TestWriteFreeh),
+        loader.loadTestsFromTestCase(TestGeometry),
+        loader.loadTestsFromTestCase(TestReaders),
+        loader.loadTestsFromTestCase(TestInputCache),
+        loader.loadTestsFromTestCase(TestScanDir),
+        loader.loadTestsFromTestCase(TestHarvest),
+        loader.loadTestsFromTestCase(TestFormatter),
+        loader.loadTestsFromTestCase(TestTrajectory),
+        loader.loadTestsFromTestCase(TestJobTrace),
+        loader.loadTestsFromTestCase(TestJobTiming),
+        loader.loadTestsFromTestCase(TestMemPlan),
+        loader.loadTestsFromTestCase(TestScaling),
+        loader.loadTestsFromTestCase(TestJobScaling),
+        loader.loadTestsFromTestCase(TestBundle),
+        loader.loadTestsFromTestCase(TestWalltime),
+        loader.loadTestsFromTestCase(TestRuntimeHistory),
         ))
 
     runner = TextTestRunner(verbosity = 2)
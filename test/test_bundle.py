@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+from collections import namedtuple
+from turbocontrol import bundle, memplan
+from turbocontrol.geometry import Geometry
+from turbocontrol.turbogo_helpers import read_clean_file
+from turbogo import Job
+
+#what write_bundle reads of a turbocontrol Jobset
+Member = namedtuple('Member', 'indir name job')
+Predicted = namedtuple('Predicted', 'indir name job stage predicted')
+
+
+def small_job(name, atoms=3, **kwargs):
+    job = Job(name=name, basis='def2-SVP', **kwargs)
+    job.geometry = Geometry.from_angstrom(['C'] * atoms, [[0, 0, 0]] * atoms)
+    return job
+
+
+class TestBundle(unittest.TestCase):
+    """Tests bundling small jobs into one submission"""
+    def setUp(self):
+        memplan._hosts = [(16, 64000.0), (4, 16000.0)]
+        self.members = list()
+        for n in range(3):
+            indir = os.path.join('bundletop', 'job{}'.format(n))
+            os.makedirs(indir)
+            self.members.append(Member('job{}'.format(n), 'job{}/in'.format(n),
+                                       small_job('Job {}'.format(n), rt=2)))
+
+    def tearDown(self):
+        shutil.rmtree('bundletop')
+        memplan._hosts = None
+
+    def test_is_small(self):
+        """One processor opt and sp jobs of few basis functions"""
+        self.assertTrue(bundle.is_small(small_job('a')))
+        self.assertTrue(bundle.is_small(small_job('a', jobtype='sp')))
+        self.assertFalse(bundle.is_small(small_job('a', atoms=30)))
+        self.assertFalse(bundle.is_small(small_job('a', nproc=4)))
+        self.assertFalse(bundle.is_small(small_job('a', jobtype='ts')))
+
+    def test_bundle_script(self):
+        """Walltime for each worker's share, the largest memory asked"""
+        jobs = [small_job('a', rt=2), small_job('b', rt=3, memory=900),
+                small_job('c', rt=1)]
+        script = bundle.bundle_script(jobs, 'bundle-0001', 2).split('\n')
+        self.assertEqual(script[4:9], ['#$ -o bundle-0001.stdout',
+                                       '#$ -N tm.bundle-0001',
+                                       '#$ -l h_rt=5:00:00',
+                                       '#$ -l h_vmem=900M',
+                                       '#$ -R y'])
+        self.assertEqual(script[9], '#$ -pe threaded 2')
+        os.environ['TURBOCONTROL_PE_SMP'] = 'smp'
+        try:
+            script = bundle.bundle_script(jobs, 'bundle-0002', 2)
+        finally:
+            del os.environ['TURBOCONTROL_PE_SMP']
+        self.assertIn('#$ -pe smp 2', script)
+        self.assertIn('bash {}'.format(bundle.BUNDLE_BODY), script)
+
+    def test_bundle_hours(self):
+        """A worker's share and one more job, within the queue's limit"""
+        self.assertEqual(bundle.bundle_hours([2, 3, 1], 2), 5)
+        self.assertEqual(bundle.bundle_hours([1] * 20, 8), 3)
+        self.assertEqual(bundle.bundle_hours([168] * 20, 8),
+                         bundle.walltime.MAX_HOURS)
+        member = self.members[0]
+        self.assertEqual(bundle.member_hours(member), 2)
+        predicted = Predicted(member.indir, member.name, member.job, None,
+                              {'opt': (1800.0, 1), 'preopt': (60.0, 3)})
+        self.assertEqual(bundle.member_hours(predicted), 1)
+        self.assertEqual(bundle.member_hours(predicted._replace(
+            stage='preopt')), 3)
+
+    def test_write_bundle(self):
+        """The job list, and markers of earlier runs are cleared"""
+        jobdir = os.path.join('bundletop', 'job1')
+        os.mkdir(os.path.join(jobdir, bundle.BUNDLE_CLAIM))
+        open(os.path.join(jobdir, bundle.BUNDLE_DONE), 'w').close()
+        bundledir, script = bundle.write_bundle(self.members, 'bundletop', 7)
+        self.assertEqual(bundledir, os.path.join('bundletop', 'bundles',
+                                                 'bundle-0007'))
+        self.assertIn('#$ -pe threaded 3', script)
+        lines = read_clean_file(os.path.join(bundledir, bundle.BUNDLE_LIST))
+        self.assertEqual(lines[1], '{}\tjob-1.stdout'.format(
+            os.path.abspath(jobdir)))
+        self.assertEqual(os.listdir(jobdir), [])
+        bundledir, script = bundle.write_bundle(self.members * 4,
+                                                'bundletop', 8)
+        self.assertIn('#$ -pe threaded 8', script)
+
+    def test_member_states(self):
+        """Bundled jobs are queued until marked done"""
+        jobdict = dict()
+        for n, member in enumerate(self.members, 1):
+            jobdict[bundle.member_id('42', n)] = Member(
+                os.path.join('bundletop', member.indir), member.name,
+                member.job)
+        open(os.path.join('bundletop', 'job1', bundle.BUNDLE_DONE),
+             'w').close()
+        states = bundle.member_states({'42': 'r', '7': 'qw'}, jobdict)
+        self.assertEqual(states, {'42': 'r', '7': 'qw', '42.1': 'r',
+                                  '42.3': 'r'})
+        self.assertEqual(bundle.member_states({'7': 'qw'}, jobdict),
+                         {'7': 'qw'})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
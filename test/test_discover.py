@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+from os import path
+from turbocontrol import discover
+from turbocontrol.turbogo_helpers import write_file
+
+
+class TestScanDir(unittest.TestCase):
+    """Tests directory scanning"""
+    def setUp(self):
+        os.mkdir('scandir')
+        for d in ['job1', 'numforce', 'KraftWerk', '.hidden', 'skipme']:
+            os.mkdir(path.join('scandir', d))
+        for f in ['job.in', 'job.gjf', 'coord', 'control', 'old.inp']:
+            write_file(path.join('scandir', f), [''])
+
+    def tearDown(self):
+        shutil.rmtree('scandir')
+
+    def test_list_dir(self):
+        """Dirs and files are told apart"""
+        dirs, files = discover.list_dir('scandir')
+        self.assertEqual(sorted(dirs), ['.hidden', 'KraftWerk', 'job1',
+                                        'numforce', 'skipme'])
+        self.assertEqual(sorted(files), ['control', 'coord', 'job.gjf',
+                                         'job.in', 'old.inp'])
+
+    def test_scan_dir(self):
+        """Output and hidden dirs are pruned, only inputs are candidates"""
+        subdirs, candidates = discover.scan_dir('scandir')
+        self.assertEqual(subdirs, [path.join('scandir', 'job1'),
+                                   path.join('scandir', 'skipme')])
+        self.assertEqual(candidates, [path.join('scandir', 'job.gjf'),
+                                      path.join('scandir', 'job.in'),
+                                      path.join('scandir', 'old.inp')])
+
+    def test_scan_dir_globs(self):
+        """Exclude globs skip files and dirs, include globs select files"""
+        subdirs, candidates = discover.scan_dir(
+            'scandir', include=['*.in*'], exclude=['skip*', 'scandir/old*'])
+        self.assertEqual(subdirs, [path.join('scandir', 'job1')])
+        self.assertEqual(candidates, [path.join('scandir', 'job.in')])
+
+    def test_missing(self):
+        """Unreadable dirs are skipped"""
+        self.assertEqual(discover.scan_dir('notadir'), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import numpy as np
+from turbocontrol import formatter
+from turbocontrol.geometry import Geometry
+from turbocontrol.formatter import convert_filetype, convert_files, bonds
+from turbocontrol.molreader import read_records
+from turbocontrol.turbogo_helpers import write_file, read_clean_file
+
+
+class TestFormatter(unittest.TestCase):
+    """Tests the built in structure file conversion"""
+    def setUp(self):
+        self.xyz = ['3', 'water',
+                    'O   0.000000   0.000000   0.117300',
+                    'H   0.000000   0.757200  -0.469200',
+                    'H   0.000000  -0.757200  -0.469200',
+                    '3', 'water 2',
+                    'O   0.000000   0.000000   0.120000',
+                    'H   0.000000   0.760000  -0.470000',
+                    'H   0.000000  -0.760000  -0.470000']
+        write_file('testgeom.xyz', self.xyz)
+
+    def tearDown(self):
+        for f in ['testgeom.xyz', 'testgeom.mol', 'testgeom.sdf',
+                  'testgeom.pdb', 'testgeom.cml']:
+            if os.path.isfile(f):
+                os.remove(f)
+
+    def test_bonds(self):
+        """Bonds from covalent radii"""
+        _title, geom = next(read_records('testgeom.xyz'))
+        self.assertEqual(sorted(bonds(geom)), [(0, 1), (0, 2)])
+
+    def test_bonds_large(self):
+        """Cells find the same bonds as comparing every pair"""
+        np.random.seed(7)
+        coords = np.random.rand(1500, 3) * 25.0
+        symbols = [['C', 'H', 'O', 'Cl'][n % 4] for n in range(1500)]
+        geom = Geometry.from_angstrom(symbols, coords)
+        radii = np.array([formatter.COVALENT_RADII[s] for s in symbols])
+        dist = np.sqrt(((coords[:, None, :] - coords[None, :, :]) ** 2)
+                       .sum(axis=2))
+        limit = radii[:, None] + radii[None, :] + formatter.BOND_TOLERANCE
+        i, j = np.nonzero(np.triu((dist < limit) & (dist > 0.1), 1))
+        self.assertEqual(bonds(geom), zip(i.tolist(), j.tolist()))
+
+    def test_mol(self):
+        """Write the first frame as a molfile"""
+        self.assertTrue(convert_filetype('testgeom.xyz', 'testgeom.mol'))
+        lines = read_clean_file('testgeom.mol')
+        self.assertEqual(lines[0], 'water')
+        self.assertEqual(lines[3].split()[:2], ['3', '2'])
+        self.assertEqual(lines[4].split()[:4], ['0.0000', '0.0000', '0.1173',
+                                                'O'])
+        self.assertEqual(lines[-1], 'M  END')
+        records = list(read_records('testgeom.mol'))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0][1].symbols, ['O', 'H', 'H'])
+
+    def test_sdf(self):
+        """Write every frame to an sdf file, and read it back"""
+        self.assertTrue(convert_filetype('testgeom.xyz', 'testgeom.sdf',
+                                         outtype='sdf'))
+        records = list(read_records('testgeom.sdf'))
+        self.assertEqual([title for title, _ in records],
+                         ['water', 'water 2'])
+        self.assertAlmostEqual(records[1][1].angstrom()[1][1], 0.76)
+
+    def test_pdb(self):
+        """Write frames as pdb models"""
+        self.assertTrue(convert_filetype('testgeom.xyz', 'testgeom.pdb',
+                                         outtype='pdb'))
+        lines = read_clean_file('testgeom.pdb')
+        atoms = [line for line in lines if line.startswith('HETATM')]
+        self.assertEqual(len(atoms), 6)
+        self.assertEqual(atoms[1][12:16], 'H1  ')
+        self.assertEqual(float(atoms[1][38:46]), 0.757)
+        self.assertEqual(atoms[1][76:78], ' H')
+        self.assertEqual(lines.count('ENDMDL'), 2)
+
+    def test_convert_files(self):
+        """Batch conversion reports failures"""
+        failed = convert_files(['testgeom.xyz', 'missing.xyz'], 'pdb')
+        self.assertEqual(failed, ['missing.xyz'])
+        self.assertTrue(os.path.isfile('testgeom.pdb'))
+
+    def test_convert_files_workers(self):
+        """Batch conversion in a pool"""
+        write_file('testgeom2.xyz', self.xyz)
+        try:
+            failed = convert_files(['testgeom.xyz', 'testgeom2.xyz'], 'sdf',
+                                   workers=2)
+            self.assertEqual(failed, [])
+            self.assertEqual(len(list(read_records('testgeom2.sdf'))), 2)
+        finally:
+            for f in ['testgeom2.xyz', 'testgeom2.sdf']:
+                if os.path.isfile(f):
+                    os.remove(f)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
 import unittest
+import pickle
+import numpy as np
 from turbocontrol.freeh_op import Freeh, proc_freeh, FreehError
 from turbocontrol.turbogo_helpers import write_file
 import os
@@ -46,13 +48,46 @@ class TestFreeh(unittest.TestCase):
         resultparams = {'pstart': '0.1000E+00', 'pend': '0.1000E+00',
                         'nump': '1', 'tstart': '298.1', 'tend': '298.1',
                         'numt': '1'}
-        resultdata =  {'zpe': '481.3', 't': ['298.15'], 'p': ['0.1000000'],
-                       'qtrans': ['19.81'], 'qrot': ['15.66'], 'qvib': ['15.89'],
-                       'pot': ['353.99'], 'eng': ['530.06'], 'entr': ['0.59886'],
-                       'cv': ['0.2849985'], 'cp': ['0.2933128'], 'enth': ['532.54']}
         funcparams, funcdata = proc_freeh('testfreeh')
         self.assertEqual(funcparams, resultparams)
-        self.assertEqual(funcdata, resultdata)
+        self.assertEqual(funcdata.zpe, 481.3)
+        self.assertEqual(len(funcdata), 1)
+        self.assertEqual(funcdata.t.tolist(), [298.15])
+        self.assertEqual(funcdata.p.tolist(), [0.1])
+        self.assertEqual(funcdata.pot.tolist(), [353.99])
+        self.assertEqual(funcdata.entr.tolist(), [0.59886])
+        self.assertEqual(funcdata.cp.tolist(), [0.2933128])
+        self.assertEqual(funcdata.enth.tolist(), [532.54])
+
+    def test_freeh_grid(self):
+        """Test a T, p grid with a short second table"""
+        rows = ['{:7.2f}   {:9.7f}      19.81    15.66    15.89    {:6.2f}'
+                '    530.06   0.59886'.format(t, p, t + p)
+                for p in (0.1, 0.2) for t in (298.15, 308.15, 318.15)]
+        cprows = ['{:7.2f}   {:9.7f}     0.2849985     0.2933128    {:6.2f}'
+                  .format(t, p, t) for p in (0.1, 0.2) for t in (298.15, 318.15)]
+        lines = self.freehfile.split('\n')
+        start = lines.index(' 298.15   0.1000000      19.81    15.66    15.89    353.99    530.06   0.59886')
+        lines[start:start + 1] = rows
+        cpstart = lines.index(' 298.15   0.1000000     0.2849985     0.2933128    532.54')
+        lines[cpstart:cpstart + 1] = cprows
+        #enthalpy column missing from the last row
+        lines[cpstart + 3] = lines[cpstart + 3][:-10]
+        write_file('testfreeh', lines)
+        _params, data = proc_freeh('testfreeh')
+        self.assertEqual(len(data), 6)
+        self.assertEqual(data.pot.tolist()[:2], [298.25, 308.25])
+        self.assertEqual(data.enth[0], 298.15)
+        self.assertTrue(np.isnan(data.cv[1]))
+        self.assertEqual(data.enth[2], 318.15)
+        self.assertTrue(np.isnan(data.enth[5]))
+        self.assertEqual(data.cv[5], 0.2849985)
+
+    def test_freeh_pickle(self):
+        """FreehData survives pickling"""
+        _params, data = proc_freeh('testfreeh')
+        data = pickle.loads(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(data.enth.tolist(), [532.54])
 
     def test_start_cosmo(self):
         """Test starting cosmo"""
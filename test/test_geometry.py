@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import unittest
+import pickle
+import numpy as np
+from turbocontrol.geometry import Geometry, BOHR
+
+
+class TestGeometry(unittest.TestCase):
+    """Tests the Geometry Class"""
+    def setUp(self):
+        self.coords = [[0.0, 0.0, 0.0], [0.0, 0.0, 1.0]]
+        self.geom = Geometry.from_angstrom(['H', 'Cl'], self.coords)
+
+    def test_units(self):
+        """Coordinates are stored in bohr and returned in angstrom"""
+        self.assertAlmostEqual(self.geom.coords[1][2], 1.0 / BOHR)
+        self.assertAlmostEqual(self.geom.angstrom()[1][2], 1.0)
+
+    def test_symbols(self):
+        """Element indices map back to symbols"""
+        self.assertEqual(self.geom.symbols, ['H', 'Cl'])
+        self.assertEqual(len(self.geom), 2)
+
+    def test_read_only(self):
+        """The stored arrays can't be changed in place"""
+        with self.assertRaises(ValueError):
+            self.geom.coords[0][0] = 1.0
+        self.geom.angstrom()[0][0] = 1.0
+        self.assertEqual(self.geom.coords[0][0], 0.0)
+
+    def test_mismatch(self):
+        """Element and coordinate counts must agree"""
+        with self.assertRaises(ValueError):
+            Geometry([1, 2], [[0.0, 0.0, 0.0]])
+
+    def test_coord_lines(self):
+        """Test the $coord block"""
+        lines = self.geom.coord_lines()
+        self.assertEqual(lines[0], '$coord')
+        self.assertEqual(lines[-1], '$end')
+        self.assertEqual(lines[2].split(),
+                         ['0.00000000000000', '0.00000000000000',
+                          '1.88972613288564', 'cl'])
+
+    def test_from_coord_lines(self):
+        """The $coord block reads back, screwer's $newcoord rows too"""
+        geom = Geometry.from_coord_lines(self.geom.coord_lines())
+        self.assertEqual(geom.symbols, ['H', 'Cl'])
+        self.assertTrue(np.allclose(geom.coords, self.geom.coords))
+        geom = Geometry.from_coord_lines(
+            ['   -8.35953193391576     -0.99142962091868     -1.333262428  c'])
+        self.assertEqual(geom.symbols, ['C'])
+        self.assertAlmostEqual(geom.coords[0][0], -8.35953193391576)
+
+    def test_xyz_lines(self):
+        """Test the xyz output"""
+        lines = self.geom.xyz_lines('HCl')
+        self.assertEqual(lines[:2], ['2', 'HCl'])
+        self.assertEqual(lines[3].split(),
+                         ['Cl', '0.00000000', '0.00000000', '1.00000000'])
+
+    def test_pickle(self):
+        """Geometries survive the trip to worker processes"""
+        geom = pickle.loads(pickle.dumps(self.geom, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(geom, self.geom)
+        self.assertFalse(geom.coords.flags.writeable)
+
+    def test_large(self):
+        """Large geometries round trip through the writers"""
+        coords = np.random.rand(10000, 3)
+        geom = Geometry.from_angstrom(['C'] * 10000, coords)
+        lines = geom.coord_lines()
+        self.assertEqual(len(lines), 10002)
+        self.assertAlmostEqual(float(lines[1].split()[0]), coords[0][0] / BOHR)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+from os import path
+import numpy as np
+from turbocontrol import harvest, results
+from turbocontrol.results import ResultsDB
+from turbocontrol.turbogo_helpers import write_file, read_clean_file
+
+CONTROL = """$title
+{title}
+$atoms
+c  1-2                                                                         \\
+   basis =c def2-TZVP
+$dft
+   functional {functional}
+   gridsize   m4
+$vibrational spectrum
+#  mode     symmetry     wave number   IR intensity    selection rules
+#                         cm**(-1)        km/mol         IR     RAMAN
+     1                        0.00         0.00000         -       -
+     7        a             {freq}         1.23000        YES     YES
+$end"""
+
+ENERGY = """$energy      SCF               SCFKIN            SCFPOT
+     1 -1508.413363988      1452.770765492     -2961.184129480
+     2 -1508.439522519      1452.185335264     -2960.624857784
+$end"""
+
+FREEH = """          ------------------
+           your wishes are :
+          ------------------
+
+  pstart=  0.1000E+00  pend=  0.1000E+00  nump=   1
+
+  tstart=   298.1      tend=   298.1      numt=   1
+
+           zero point vibrational energy
+           -----------------------------
+           zpe=   481.3     kJ/mol
+
+   T        p       ln(qtrans) ln(qrot) ln(qvib) chem.pot.   energy    entropy
+  (K)      (MPa)                                 (kJ/mol)   (kJ/mol) (kJ/mol/K)
+
+ 298.15   0.1000000      19.81    15.66    15.89    353.99    530.06   0.59886
+
+   T        P              Cv            Cp       enthalpy
+  (K)     (MPa)        (kJ/mol-K)    (kJ/mol-K)   (kJ/mol)
+ 298.15   0.1000000     0.2849985     0.2933128    532.54
+
+"""
+
+
+class TestHarvest(unittest.TestCase):
+    """Test harvesting completed job trees"""
+    def setUp(self):
+        os.mkdir('harvestdir')
+        os.chdir('harvestdir')
+        for name, freq in [('job1', '123.45'), ('job2', '-55.00')]:
+            os.makedirs(path.join('batch', name, 'numforce'))
+            write_file(path.join('batch', name, name + '.in'), [''])
+            write_file(path.join('batch', name, 'control'), CONTROL.format(
+                title=name, functional='b3-lyp', freq=freq).split('\n'))
+            write_file(path.join('batch', name, 'energy'), ENERGY.split('\n'))
+            write_file(path.join('batch', name, 'numforce', 'control'),
+                       CONTROL.format(title=name, functional='b3-lyp',
+                                      freq=freq).split('\n'))
+        write_file(path.join('batch', 'job1', 'numforce', 'freeh'),
+                   FREEH.split('\n'))
+        write_file(path.join('batch', 'job1', 'GEO_OPT_CONVERGED'), [''])
+
+    def tearDown(self):
+        os.chdir(os.pardir)
+        shutil.rmtree('harvestdir')
+
+    def test_find_job_dirs(self):
+        """Job dirs are found, numforce and preopt dirs skipped"""
+        os.mkdir(path.join('batch', 'job1', 'preopt'))
+        write_file(path.join('batch', 'job1', 'preopt', 'control'), [''])
+        self.assertEqual(harvest.find_job_dirs(os.curdir),
+                         [path.join('.', 'batch', 'job1'),
+                          path.join('.', 'batch', 'job2')])
+
+    def test_harvest_dir(self):
+        """A job dir is read with the results parsers"""
+        result = harvest.harvest_dir(path.join('batch', 'job1'))
+        self.assertEqual(result['job'][:7],
+                         ['job1', path.join('batch', 'job1', 'job1.in'),
+                          'b3-lyp', 'def2-TZVP', None, 'Opt Converged',
+                          123.45])
+        self.assertEqual(result['energies'][-1], (2, -1508.439522519))
+        self.assertEqual(result['thermo'][0][:3], [481.3, 298.15, 0.1])
+
+    def test_job_input(self):
+        """Keyed by the input, as when recorded while watching"""
+        self.assertEqual(harvest.job_input(path.join('.', 'batch', 'job1')),
+                         'job1.in')
+        os.makedirs(path.join('batch', 'multi', '0002'))
+        write_file(path.join('batch', 'multi.in'), [''])
+        write_file(path.join('batch', 'multi', '0002', 'control'),
+                   CONTROL.format(title='multi', functional='b3-lyp',
+                                  freq='12.0').split('\n'))
+        jobdir = path.join('.', 'batch', 'multi', '0002')
+        self.assertEqual(harvest.harvest_dir(jobdir)['job'][1],
+                         results.job_directory(jobdir, 'multi.in'))
+        os.makedirs(path.join('other', '0001'))
+        self.assertEqual(harvest.job_input(path.join('other', '0001')), None)
+
+    def test_harvest(self):
+        """The tree is written to csv, npz and the results database"""
+        rows = harvest.harvest(os.curdir, output='out')
+        self.assertEqual(len(rows), 2)
+        lines = read_clean_file('out.csv')
+        self.assertEqual(lines[0].split(','), harvest.COLUMNS)
+        self.assertEqual(len(lines), 3)
+        columns = np.load('out.npz')
+        self.assertEqual(list(columns['name']), ['job1', 'job2'])
+        self.assertEqual(list(columns['n_imaginary']), [0.0, 1.0])
+        self.assertEqual(columns['pot'][0], 353.99)
+        self.assertTrue(np.isnan(columns['pot'][1]))
+        thermo = ResultsDB('results.db').thermo(t=298.15)
+        self.assertEqual([row['name'] for row in thermo], ['job1'])
+
+    def test_reharvest(self):
+        """Only changed dirs are read again"""
+        harvest.harvest(os.curdir, output='out')
+        write_file(path.join('batch', 'job2', 'energy'),
+                   ENERGY.replace('$end', '     3 -1508.5 0.0 0.0\n$end')
+                   .split('\n'))
+        read = list()
+        harvest_dir = harvest.harvest_dir
+        def counting(indir):
+            read.append(indir)
+            return harvest_dir(indir)
+        harvest.harvest_dir = counting
+        try:
+            rows = harvest.harvest(os.curdir, output='out')
+        finally:
+            harvest.harvest_dir = harvest_dir
+        self.assertEqual(read, [path.join('.', 'batch', 'job2')])
+        self.assertEqual([row[6] for row in rows], [2, 3])
+
+    def test_parallel(self):
+        """Dirs are read in worker processes"""
+        rows = harvest.harvest(os.curdir, workers=2, output='out')
+        self.assertEqual(sorted(row[1] for row in rows), ['job1', 'job2'])
+
+    def test_xyz_merge(self):
+        """xyz files written from coord, and merged"""
+        write_file(path.join('batch', 'job2', 'coord'),
+                   ['$coord', '0.0 0.0 0.0 c', '0.0 0.0 2.13 o', '$end'])
+        harvest.harvest(os.curdir, output='out', xyz=True, merge='all.xyz')
+        self.assertEqual(read_clean_file(path.join(
+            'batch', 'job2', 'final_geometry.xyz'))[0], '2')
+        self.assertFalse(os.path.isfile(
+            path.join('batch', 'job1', 'final_geometry.xyz')))
+        self.assertEqual(read_clean_file('all.xyz')[1],
+                         path.join('.', 'batch', 'job2'))
+
+    def test_convert(self):
+        """Final geometries are converted once"""
+        geomfile = path.join('batch', 'job1', 'final_geometry.xyz')
+        write_file(geomfile, ['2', '', 'c 0.0 0.0 0.0', 'o 0.0 0.0 1.13'])
+        harvest.harvest(os.curdir, output='out', convert='mol')
+        molfile = path.join('batch', 'job1', 'final_geometry.mol')
+        self.assertEqual(read_clean_file(molfile)[3].split()[:2], ['2', '1'])
+        self.assertFalse(os.path.isfile(
+            path.join('batch', 'job2', 'final_geometry.mol')))
+        self.assertEqual(harvest.convert_geometries(
+            [path.join('batch', 'job1')], 'mol'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import cPickle as pickle
+from turbocontrol.inputcache import InputCache, CACHE_VERSION
+from turbocontrol.turbogo_helpers import write_file
+
+
+class TestInputCache(unittest.TestCase):
+    """Tests the InputCache Class"""
+    def setUp(self):
+        self.cachefile = 'testcache'
+        self.infile = 'cachetest.in'
+        write_file(self.infile, ['some', 'input'])
+
+    def tearDown(self):
+        for f in [self.cachefile, self.infile]:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def cached(self):
+        """Stores a result for the input file and saves the cache"""
+        cache = InputCache(self.cachefile)
+        result, stamp = cache.lookup(self.infile)
+        self.assertEqual(result, None)
+        cache.store(self.infile, stamp, 'parsed')
+        cache.save()
+
+    def test_reuse(self):
+        """Results for unchanged files are reused from the saved cache"""
+        self.cached()
+        cache = InputCache(self.cachefile)
+        self.assertEqual(cache.lookup(self.infile)[0], 'parsed')
+        self.assertEqual(cache.hits, 1)
+
+    def test_touched(self):
+        """A new mtime with the same contents is still a hit"""
+        self.cached()
+        st = os.stat(self.infile)
+        os.utime(self.infile, (st.st_atime, st.st_mtime + 10))
+        cache = InputCache(self.cachefile)
+        self.assertEqual(cache.lookup(self.infile)[0], 'parsed')
+        self.assertTrue(cache.changed)
+
+    def test_changed(self):
+        """Changed contents are a miss, even with the same mtime and size"""
+        self.cached()
+        st = os.stat(self.infile)
+        write_file(self.infile, ['sone', 'input'])
+        os.utime(self.infile, (st.st_atime, st.st_mtime + 10))
+        cache = InputCache(self.cachefile)
+        self.assertEqual(cache.lookup(self.infile)[0], None)
+        self.assertEqual(cache.misses, 1)
+
+    def test_prune(self):
+        """Entries for files that are gone are dropped"""
+        self.cached()
+        cache = InputCache(self.cachefile)
+        cache.prune([])
+        self.assertEqual(cache.entries, {})
+
+    def test_version(self):
+        """Caches from other versions are ignored"""
+        with open(self.cachefile, 'wb') as f:
+            pickle.dump((CACHE_VERSION + 1, {self.infile: None}), f)
+        self.assertEqual(InputCache(self.cachefile).entries, {})
+
+    def test_corrupt(self):
+        """Unreadable caches are ignored"""
+        write_file(self.cachefile, ['not a pickle'])
+        self.assertEqual(InputCache(self.cachefile).entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+from turbocontrol.jobtiming import read_timing, profile, read_profile
+from turbocontrol.jobtiming import status_line, write_summary, SUMMARY_FILE
+from turbocontrol.jobtiming import wall_time
+from turbocontrol.turbogo_helpers import write_file, read_clean_file
+
+TIMING = """start job 1000.0 100 /scratch/job
+start ridft 1001.0 200 /scratch/job
+end ridft 1011.0 200 0
+start rdgrad 1011.5 201 /scratch/job
+end rdgrad 1015.5 201 0
+start statpt 1016.0 202 /scratch/job
+end statpt 1017.0 202 0
+start ridft 1020.0 203 /scratch/job
+end ridft 1028.0 203 0
+start rdgrad 1028.0 204 /scratch/job
+end rdgrad 1031.0 204 0
+start statpt 1031.0 205 /scratch/job
+end statpt 1031.5 205 0
+end job 1032.0 100 0
+start job 2000.0 300 /scratch/job
+start ridft 2001.0 400 /scratch/job/numforce/KraftWerk/dx1
+end ridft 2005.0 400 0
+start rdgrad 2005.0 401 /scratch/job/numforce/KraftWerk/dx1
+end rdgrad 2007.0 401 0
+start ridft 2008.0 402 /scratch/job/numforce/KraftWerk/dx2
+end ridft 2012.0 402 0
+garbled line
+start aoforce 2013.0 403 /scratch/job
+end aoforce 2020.0 403 0
+start ridft 2021.0 404 /scratch/job/numforce/KraftWerk/dx3"""
+
+#a job staged to node-local scratch, submitted twice
+STAGED = """start stage-in 1000.0 100 /home/job
+end stage-in 1003.0 100 0
+start job 1003.5 100 /tmp/tm.1
+start ridft 1004.0 200 /tmp/tm.1
+end ridft 1010.0 200 0
+end job 1011.0 100 0
+start stage-out 1011.0 100 /home/job
+end stage-out 1016.0 100 0
+start stage-in 2000.0 300 /home/job
+end stage-in 2002.0 300 0
+start job 2002.0 300 /tmp/tm.2
+start ridft 2003.0 400 /tmp/tm.2
+end ridft 2008.0 400 0
+end job 2009.0 300 0"""
+
+
+class TestJobTiming(unittest.TestCase):
+    """Tests reading the in-job timing log"""
+    def setUp(self):
+        os.mkdir('timingdir')
+        write_file(os.path.join('timingdir', 'timing.log'), TIMING.split('\n'))
+
+    def tearDown(self):
+        shutil.rmtree('timingdir')
+
+    def test_read_timing(self):
+        """Start and end lines are paired"""
+        runs = read_timing(os.path.join('timingdir', 'timing.log'))
+        self.assertEqual(len(runs), 13)
+        self.assertEqual(runs[0].program, 'job')
+        self.assertEqual(runs[0].seconds, 32.0)
+        self.assertEqual(runs[1].status, 0)
+        self.assertEqual(runs[-1].end, None)
+        self.assertEqual(runs[-1].seconds, 0.0)
+
+    def test_profile(self):
+        """Runs are split into cycles, displacements and other stages"""
+        prof = read_profile('timingdir')
+        self.assertEqual(len(prof['jobs']), 2)
+        self.assertEqual(len(prof['cycles']), 2)
+        first = prof['cycles'][0]
+        self.assertEqual((first['seconds'], first['scf'], first['gradient'],
+                          first['relax'], first['other']),
+                         (19.0, 10.0, 4.0, 1.0, 4.0))
+        self.assertEqual(prof['cycles'][1]['seconds'], 11.5)
+        self.assertEqual(prof['displacements'], (3, 10.0))
+        self.assertEqual(prof['stages'], {'aoforce': 7.0})
+
+    def test_profile_staged(self):
+        """Staging is a stage, and each job's runs are in its scratch dir"""
+        write_file(os.path.join('timingdir', 'timing.log'),
+                   STAGED.split('\n'))
+        prof = read_profile('timingdir')
+        self.assertEqual(len(prof['cycles']), 2)
+        self.assertEqual(prof['displacements'], (0, 0.0))
+        self.assertEqual(prof['stages'], {'stage in': 5.0, 'stage out': 5.0})
+
+    def test_wall_time(self):
+        """From the first job script started to the last end"""
+        runs = read_timing(os.path.join('timingdir', 'timing.log'))
+        self.assertEqual(wall_time(runs), 32.0)
+        self.assertEqual(wall_time(runs, 1500), 0.0)
+        self.assertEqual(wall_time(profile([])['jobs']), 0.0)
+
+    def test_status_line(self):
+        """One line summary"""
+        self.assertEqual(status_line(read_profile('timingdir')),
+                         "2 cycles, 15s/cycle (scf 9s, grad 4s, relax 1s, "
+                         "other 2s); 3 displacements, 3s each; aoforce 7s")
+        self.assertEqual(status_line(profile([])), '')
+
+    def test_write_summary(self):
+        """The summary file is written, unless there is no timing log"""
+        write_summary('timingdir', 'job1')
+        lines = read_clean_file(os.path.join('timingdir', SUMMARY_FILE))
+        self.assertEqual(lines[0], 'Timing summary job1')
+        self.assertEqual(lines[1], 'Job wall time 0:00:32 (exit status 0)')
+        self.assertEqual(lines[2], 'Job started 2000.0, not finished')
+        self.assertEqual(lines[5].split(), ['1', '19.0', '10.0', '4.0', '1.0',
+                                            '4.0'])
+        self.assertEqual(lines[7].split()[0], 'mean')
+        self.assertEqual(lines[-1], 'aoforce 7.0s')
+        os.remove(os.path.join('timingdir', 'timing.log'))
+        self.assertEqual(write_summary('timingdir'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
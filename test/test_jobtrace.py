@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import json
+from turbocontrol.jobtrace import record, phase, TraceWriter, read_trace
+from turbocontrol.jobtrace import phase_totals
+
+
+class TracedJob(object):
+    """Stand in for a Jobset"""
+    def __init__(self, name):
+        self.name = name
+        self.indir = name
+        self.jobid = '42'
+        self.timings = list()
+
+
+class TestJobTrace(unittest.TestCase):
+    """Tests the per-phase job timing trace"""
+    def tearDown(self):
+        if os.path.isfile('testtrace.jsonl'):
+            os.remove('testtrace.jsonl')
+
+    def test_record(self):
+        """Phases are recorded with their details"""
+        timings = list()
+        record(timings, 'queue', 10.0, 25.5, stage='opt')
+        self.assertEqual(timings, [{'phase': 'queue', 'start': 10.0,
+                                    'end': 25.5, 'stage': 'opt'}])
+        record(None, 'queue', 10.0)
+
+    def test_phase(self):
+        """The with block is timed, even if it raises"""
+        timings = list()
+        with phase(timings, 'define'):
+            pass
+        with self.assertRaises(ValueError):
+            with phase(timings, 'cosmoprep'):
+                raise ValueError
+        self.assertEqual([t['phase'] for t in timings],
+                         ['define', 'cosmoprep'])
+        self.assertTrue(timings[0]['end'] >= timings[0]['start'])
+
+    def test_writer(self):
+        """Only new phases are appended to the trace"""
+        job = TracedJob('job1')
+        writer = TraceWriter('testtrace.jsonl')
+        record(job.timings, 'define', 0.0, 2.0)
+        writer.write([job])
+        record(job.timings, 'qsub', 2.0, 2.5, stage='opt')
+        writer.write([job])
+        writer.write([job])
+        events = list(read_trace('testtrace.jsonl'))
+        self.assertEqual([e['phase'] for e in events], ['define', 'qsub'])
+        self.assertEqual(events[1], {'job': 'job1', 'dir': 'job1',
+                                     'jobid': '42', 'phase': 'qsub',
+                                     'stage': 'opt', 'start': 2.0,
+                                     'end': 2.5, 'seconds': 0.5})
+
+    def test_totals(self):
+        """Time is totalled by phase"""
+        timings = list()
+        record(timings, 'run', 0.0, 100.0, stage='opt')
+        record(timings, 'run', 200.0, 250.0, stage='numforce')
+        record(timings, 'queue', 100.0, 200.0, stage='numforce')
+        self.assertEqual(phase_totals(timings), {'run': (2, 150.0),
+                                                 'queue': (1, 100.0)})
+
+
+if __name__ == '__main__':
+    unittest.main()
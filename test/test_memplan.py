@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import math
+from turbocontrol import memplan
+from turbocontrol.memplan import MemoryPlan, read_atoms, read_basis
+from turbocontrol.memplan import count_functions, parse_memory, read_qhost
+from turbocontrol.turbogo_helpers import write_file
+from turbocontrol.geometry import Geometry
+from turbogo import Job
+
+CONTROL = """$title
+methane
+$coord    file=coord
+$atoms
+c  1                                                                           \\
+   basis =c def2-SVP                                                           \\
+   jbas  =c def2-SVP
+h  2-5                                                                         \\
+   basis =h def2-SVP                                                           \\
+   jbas  =h def2-SVP
+$basis    file=basis
+$jbas    file=auxbasis
+$end"""
+
+BASIS = """$basis
+*
+h def2-SVP
+*
+   3  s
+     13.0107010              0.19682158E-01
+      1.9622572              0.13796524
+      0.44453796             0.47831935
+   1  s
+      0.12194962             1.0000000
+   1  p
+      0.80000000             1.0000000
+*
+c def2-SVP
+*
+   5  s
+   1238.4016938              0.54568832E-02
+   1  s
+      0.55727557             1.0000000
+   1  s
+      0.17832732             1.0000000
+   3  p
+      9.4680970              0.38387871E-01
+   1  p
+      0.20182466             1.0000000
+   1  d
+      0.55000000             1.0000000
+*
+$end"""
+
+AUXBASIS = """$jbas
+*
+h def2-SVP
+*
+   1  s
+      4.0000000              1.0000000
+   1  p
+      1.0000000              1.0000000
+*
+c def2-SVP
+*
+   1  s
+     80.0000000              1.0000000
+   1  s
+      8.0000000              1.0000000
+   1  p
+      2.0000000              1.0000000
+   1  d
+      1.0000000              1.0000000
+   1  f
+      1.0000000              1.0000000
+*
+$end"""
+
+QHOST = """HOSTNAME                ARCH         NCPU NSOC NCOR NTHR  LOAD  MEMTOT  MEMUSE  SWAPTO  SWAPUS
+----------------------------------------------------------------------------------------------
+global                  -               -    -    -    -     -       -       -       -       -
+node01                  lx-amd64       16    2    8   16  0.01   62.8G    1.2G    2.0G     0.0
+node02                  lx-amd64        4    1    4    4  0.01    7.7G  512.0M    2.0G     0.0
+node03                  lx-amd64        8    1    8    8     -       -       -       -       -"""
+
+
+class TestMemPlan(unittest.TestCase):
+    """Tests the memory planner"""
+    def setUp(self):
+        os.mkdir('memdir')
+        write_file(os.path.join('memdir', 'control'), CONTROL.split('\n'))
+        write_file(os.path.join('memdir', 'basis'), BASIS.split('\n'))
+        write_file(os.path.join('memdir', 'auxbasis'), AUXBASIS.split('\n'))
+        self.environ = os.environ.pop(memplan.NODE_MEMORY_VAR, None)
+
+    def tearDown(self):
+        shutil.rmtree('memdir')
+        memplan._hosts = None
+        if self.environ is not None:
+            os.environ[memplan.NODE_MEMORY_VAR] = self.environ
+
+    def test_read_atoms(self):
+        """Atom groups with their basis sets"""
+        groups = read_atoms(os.path.join('memdir', 'control'))
+        self.assertEqual(groups, [
+            {'atoms': 1, 'basis': 'c def2-svp', 'jbas': 'c def2-svp'},
+            {'atoms': 4, 'basis': 'h def2-svp', 'jbas': 'h def2-svp'}])
+
+    def test_read_basis(self):
+        """Spherical functions of each basis set"""
+        self.assertEqual(read_basis(os.path.join('memdir', 'basis')),
+                         {'h def2-svp': 5, 'c def2-svp': 14})
+        self.assertEqual(read_basis(os.path.join('memdir', 'auxbasis')),
+                         {'h def2-svp': 4, 'c def2-svp': 17})
+
+    def test_count_functions(self):
+        """Atoms, basis and auxiliary functions of the job"""
+        self.assertEqual(count_functions('memdir'), (5, 34, 33))
+        os.remove(os.path.join('memdir', 'auxbasis'))
+        self.assertEqual(count_functions('memdir'), (5, 34, 0))
+
+    def test_parse_memory(self):
+        """Memory sizes in MB"""
+        self.assertEqual(parse_memory('62.5G'), 64000.0)
+        self.assertEqual(parse_memory('512M'), 512.0)
+        self.assertEqual(parse_memory('2048'), 2048.0)
+        self.assertEqual(parse_memory('1gb'), 1024.0)
+        self.assertEqual(parse_memory('-'), None)
+
+    def test_node_memory(self):
+        """Smallest node with enough slots, or the configured size"""
+        self.assertEqual(read_qhost(QHOST), [(16, 62.8 * 1024),
+                                             (4, 7.7 * 1024)])
+        memplan._hosts = read_qhost(QHOST)
+        self.assertAlmostEqual(memplan.node_memory(4), 7.7 * 1024)
+        self.assertAlmostEqual(memplan.node_memory(8), 62.8 * 1024)
+        self.assertEqual(memplan.node_memory(32), memplan.DEFAULT_NODE_MB)
+        os.environ[memplan.NODE_MEMORY_VAR] = '32G'
+        try:
+            self.assertEqual(memplan.node_memory(4), 32768.0)
+        finally:
+            del os.environ[memplan.NODE_MEMORY_VAR]
+
+    def test_plan_small(self):
+        """Small jobs keep all of the RI integrals, and ask for little"""
+        plan = MemoryPlan(34, 33, 5, processes=4, nproc=4, ri=True,
+                          node_mb=16000)
+        self.assertEqual(plan.ricore, 1)
+        self.assertEqual(plan.maxcor, None)
+        self.assertEqual(plan.control_lines(), [
+            '$ricore 1', '$paroptions ga_memperproc {0} {0}'.format(
+                int(memplan.MIN_GA_MB * memplan.MB))])
+        self.assertEqual(plan.vmem(), 1108)
+
+    def test_plan_large(self):
+        """RI integrals are cut to what fits beside the matrices"""
+        plan = MemoryPlan(3000, 8000, 200, processes=1, nproc=8,
+                          jobtype='aoforce', ri=True, node_mb=64000)
+        base = 250 + 12 * 3000 ** 2 * 8 / memplan.MB
+        self.assertEqual(plan.ricore, int(64000 * 0.9 - base) - 500)
+        self.assertEqual(plan.maxcor, 500)
+        self.assertEqual(plan.ga, None)
+        self.assertEqual(plan.control_lines(['$ricore']),
+                         ['$maxcor {}'.format(plan.maxcor)])
+
+    def test_plan_budget(self):
+        """$ricore, $maxcor and global arrays share a process' budget"""
+        for nbf, natoms in [(34, 5), (800, 60), (3000, 200)]:
+            for node_mb in [16000, 32000, 64000]:
+                for processes in [1, 8]:
+                    for jobtype, ri in [('numforce', True), ('aoforce', True),
+                                        ('aoforce', False), ('opt', True)]:
+                        plan = MemoryPlan(nbf, 3 * nbf, natoms, processes,
+                                          processes, jobtype, ri, node_mb)
+                        least = memplan.DEFAULT_MAXCOR + (
+                            memplan.MIN_GA_MB if processes > 1 else 0)
+                        if plan.budget - plan.base >= least:
+                            self.assertLessEqual(plan.process, plan.budget)
+        #an 8 process RI NumForce job of 800 basis functions on a 32 GB node
+        #fits on the node, global arrays included
+        plan = MemoryPlan(800, 2400, 60, processes=8, nproc=8,
+                          jobtype='numforce', ri=True, node_mb=32000)
+        self.assertLessEqual(plan.vmem() * 8, 32000)
+
+    def test_apply_plan(self):
+        """The job's memory is set, and given keywords are kept"""
+        job = Job(name='methane', ri=True, nproc=2, para_arch='GA')
+        job.control_add = ['$ricore 400', '$paroptions ga_memperproc 1 1']
+        memplan._hosts = read_qhost(QHOST)
+        self.assertEqual(memplan.apply_plan(job, 'memdir'), [])
+        self.assertEqual(job.memory, 250 + 400 + 500 + 100 + 256 + 1)
+        job = Job(name='methane', jobtype='numforce', nproc=2)
+        self.assertEqual(memplan.apply_plan(job, 'memdir'),
+                         ['$ricore 1', '$maxcor 500',
+                          '$paroptions ga_memperproc {0} {0}'.format(
+                              int(memplan.MIN_GA_MB * memplan.MB))])
+        job = Job(name='missing')
+        self.assertEqual(memplan.apply_plan(job, 'nodir'), [])
+        self.assertEqual(job.memory, None)
+
+    def test_estimate_functions(self):
+        """Basis functions from the geometry, before define"""
+        geom = Geometry.from_angstrom(['C', 'H', 'H', 'Cl'], [[0, 0, 0]] * 4)
+        self.assertEqual(memplan.estimate_functions(geom, 'def2-SVP'),
+                         14 + 5 + 5 + 18)
+        self.assertEqual(memplan.estimate_functions(geom, 'sto-3g'),
+                         31 + 6 + 6 + 37)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+from turbocontrol.molreader import read_xyz, read_sdf, read_records
+from turbocontrol.turbogo_helpers import InputCheckError, write_file
+
+
+class TestReaders(unittest.TestCase):
+    """Tests the multi-record structure readers"""
+    def setUp(self):
+        self.xyz = """3
+water 1
+O   0.000000   0.000000   0.117300
+H   0.000000   0.757200  -0.469200
+H   0.000000  -0.757200  -0.469200
+3
+
+o   0.000000   0.000000   0.120000   -0.8
+h   0.000000   0.760000  -0.470000    0.4
+h   0.000000  -0.760000  -0.470000    0.4
+
+"""
+        self.sdf = """methane
+  generated
+
+  5  4  0  0  0  0  0  0  0  0999 V2000
+    0.0000    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0
+    0.6291    0.6291    0.6291 H   0  0  0  0  0  0  0  0  0  0  0  0
+   -0.6291   -0.6291    0.6291 H   0  0  0  0  0  0  0  0  0  0  0  0
+   -0.6291    0.6291   -0.6291 H   0  0  0  0  0  0  0  0  0  0  0  0
+    0.6291   -0.6291   -0.6291 H   0  0  0  0  0  0  0  0  0  0  0  0
+  1  2  1  0
+  1  3  1  0
+  1  4  1  0
+  1  5  1  0
+M  END
+> <energy>
+-40.5
+
+$$$$
+ammonia
+
+
+  1  0  0  0  0  0  0  0  0  0999 V2000
+    0.0000    0.0000    0.0000 N   0  0  0  0  0  0  0  0  0  0  0  0
+M  END
+$$$$
+"""
+        write_file('testrecords.sdf', self.sdf.split('\n'))
+
+    def tearDown(self):
+        os.remove('testrecords.sdf')
+
+    def test_xyz(self):
+        """Read frames from an xyz file"""
+        records = list(read_xyz(self.xyz.split('\n')))
+        self.assertEqual([title for title, _ in records], ['water 1', ''])
+        self.assertEqual(records[1][1].symbols, ['O', 'H', 'H'])
+        self.assertAlmostEqual(records[1][1].angstrom()[1][1], 0.76)
+
+    def test_xyz_truncated(self):
+        """A frame with missing atoms is an error"""
+        with self.assertRaises(InputCheckError):
+            list(read_xyz(self.xyz.split('\n')[:4]))
+
+    def test_xyz_element(self):
+        """Unknown elements are an error"""
+        with self.assertRaises(InputCheckError):
+            list(read_xyz(['1', '', 'Q 0.0 0.0 0.0']))
+
+    def test_sdf(self):
+        """Read records from an sdf file"""
+        records = list(read_sdf(self.sdf.split('\n')))
+        self.assertEqual([title for title, _ in records],
+                         ['methane', 'ammonia'])
+        self.assertEqual(records[0][1].symbols, ['C', 'H', 'H', 'H', 'H'])
+        self.assertAlmostEqual(records[0][1].angstrom()[4][0], 0.6291)
+
+    def test_records(self):
+        """Read records lazily from a file"""
+        records = read_records('testrecords.sdf')
+        title, geom = next(records)
+        self.assertEqual(title, 'methane')
+        self.assertEqual(len(geom), 5)
+
+    def test_unknown_type(self):
+        """Unknown extensions are rejected"""
+        with self.assertRaises(InputCheckError):
+            next(read_records('records.pdb'))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
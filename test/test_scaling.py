@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+from turbocontrol import scaling
+from turbocontrol.scaling import Scaling, fit, assign, best_arch
+from turbocontrol.scaling import read_submit_script, job_scaling
+from turbocontrol.scaling import read_allocation_rule
+from turbocontrol.results import ResultsDB
+from turbocontrol.turbogo_helpers import write_file
+from test_memplan import CONTROL, BASIS
+
+TIMING = """start job 1000.0 100 {0}
+start ridft 1001.0 200 {0}
+end ridft 1011.0 200 0
+start rdgrad 1011.5 201 {0}
+end rdgrad 1013.5 201 0
+start statpt 1016.0 202 {0}
+end statpt 1017.0 202 0
+start ridft 1020.0 203 {0}
+end ridft 1028.0 203 0
+end job 1032.0 100 0"""
+
+
+class TestScaling(unittest.TestCase):
+    """Tests the nproc policy"""
+
+    def test_speedup(self):
+        """Amdahl speedups, better for larger jobs"""
+        model = Scaling(0.1)
+        self.assertEqual(model.speedup(500, 1), 1.0)
+        self.assertAlmostEqual(model.speedup(500, 4), 1 / (0.1 + 0.9 / 4))
+        self.assertTrue(model.efficiency(2000, 8) > model.efficiency(200, 8))
+        self.assertAlmostEqual(model.cost(1000, 1) / model.cost(500, 1), 8.0)
+
+    def test_fit(self):
+        """The serial fraction is recovered from cycle times"""
+        true = Scaling(0.05)
+        history = [(nbf, nproc, 'GA', 30 * true.cost(nbf, nproc))
+                   for nbf in [200, 400, 800] for nproc in [1, 2, 4, 8]]
+        history.append((300, 4, 'SMP', 10.0))
+        models = fit(history)
+        self.assertEqual(sorted(models), ['GA', 'SMP'])
+        self.assertAlmostEqual(models['GA'].serial, 0.05)
+        self.assertEqual(models['GA'].samples, 12)
+        #serial runs are shared between architectures
+        self.assertEqual(models['SMP'].samples, 4)
+        self.assertEqual(fit([(200, 2, 'GA', 5.0)]), {})
+
+    def test_best_arch(self):
+        """The architecture that scales best, or the default"""
+        models = {'GA': Scaling(0.2), 'SMP': Scaling(0.05)}
+        self.assertEqual(best_arch(500, 4, models, 'GA'), 'SMP')
+        self.assertEqual(best_arch(500, 4, {}, 'MPI'), 'MPI')
+
+    def test_assign_busy(self):
+        """With more jobs than slots, every job runs serially"""
+        jobs = [(500, 'GA')] * 10
+        self.assertEqual(assign(jobs, 8), [(1, 'GA')] * 10)
+
+    def test_assign_spare(self):
+        """Spare slots go to the largest jobs while they are used well"""
+        jobs = [(1500, 'GA'), (100, 'GA')]
+        procs = assign(jobs, 16)
+        self.assertTrue(procs[0][0] > 4)
+        self.assertEqual(procs[1][0], 1)
+        self.assertTrue(Scaling().efficiency(1500, procs[0][0]) >=
+                        scaling.MIN_EFFICIENCY)
+        self.assertEqual(assign(jobs, 64, max_slots=4)[0], (4, 'GA'))
+        procs = assign(jobs, 16, {'SMP': Scaling(0.01)})
+        self.assertEqual(procs[0][1], 'SMP')
+        self.assertTrue(procs[0][0] >= 14)
+
+    def test_spans_nodes(self):
+        """Parallel environments spread over hosts or kept on one"""
+        output = ('pe_name            mpi\nslots              999\n'
+                  'allocation_rule    $fill_up\ncontrol_slaves     TRUE')
+        self.assertEqual(read_allocation_rule(output), '$fill_up')
+        self.assertEqual(read_allocation_rule(''), None)
+        scaling._rules.update({'mpi': '$fill_up', 'threaded': '$pe_slots',
+                               'nope': None})
+        try:
+            self.assertTrue(scaling.spans_nodes('mpi'))
+            self.assertFalse(scaling.spans_nodes('threaded'))
+            self.assertFalse(scaling.spans_nodes('nope'))
+        finally:
+            scaling._rules.clear()
+
+
+class TestJobScaling(unittest.TestCase):
+    """Tests reading the scaling history of finished jobs"""
+    def setUp(self):
+        os.mkdir('scaledir')
+        write_file(os.path.join('scaledir', 'control'), CONTROL.split('\n'))
+        write_file(os.path.join('scaledir', 'basis'), BASIS.split('\n'))
+        write_file(os.path.join('scaledir', 'timing.log'),
+                   TIMING.format('/scratch/job').split('\n'))
+        write_file(os.path.join('scaledir', 'submitscript.sge'), [
+            '#!/bin/bash', '#$ -pe threaded 4', 'export PARA_ARCH=GA'])
+
+    def tearDown(self):
+        shutil.rmtree('scaledir')
+
+    def test_read_submit_script(self):
+        """Slots and architecture"""
+        self.assertEqual(read_submit_script('scaledir'), (4, 'GA'))
+        self.assertEqual(read_submit_script('nodir'), (None, None))
+
+    def test_job_scaling(self):
+        """Basis functions, processors and mean cycle time"""
+        self.assertEqual(job_scaling('scaledir'), [[34, 4, 'GA', 13.5]])
+        self.assertEqual(job_scaling('scaledir', 2, 'SMP'),
+                         [[34, 2, 'SMP', 13.5]])
+        os.remove(os.path.join('scaledir', 'timing.log'))
+        self.assertEqual(job_scaling('scaledir'), [])
+
+    def test_history(self):
+        """Scaling rows are kept in the results database"""
+        db = ResultsDB(os.path.join('scaledir', 'results.db'))
+        db.record_results([{
+            'job': ['job', 'scaledir/job', 'tpss', 'def2-SVP', 'opt',
+                    'Opt Converged', None, 0.0],
+            'timing': [2, 40, 0], 'energies': [], 'frequencies': [],
+            'thermo': [], 'scaling': job_scaling('scaledir')}])
+        self.assertEqual(db.scaling_history(), [(34, 4, 'GA', 13.5)])
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
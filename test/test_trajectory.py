@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+from turbocontrol.trajectory import read_coord, read_gradient, frames
+from turbocontrol.trajectory import write_xyz_files, write_all, merge_final
+from turbocontrol.molreader import read_records
+from turbocontrol.turbogo_helpers import write_file, InputCheckError
+
+COORD = """$coord
+    0.00000000000000      0.00000000000000      0.22166592000000      o
+    0.00000000000000      1.43087788000000     -0.88666368000000      h
+    0.00000000000000     -1.43087788000000     -0.88666368000000      h f
+$user-defined bonds
+$end"""
+
+GRADIENT = """$grad          cartesian gradients
+  cycle =      1    SCF energy =      -76.3456789012   |dE/xyz| =  0.024588
+    0.00000000000000      0.00000000000000      0.12418313433234      o
+    0.00000000000000      1.49520217000000     -0.93666368000000      h
+    0.00000000000000     -1.49520217000000     -0.93666368000000      h
+  0.00000000000000D+00   0.00000000000000D+00   0.37834467046307D-02
+  0.00000000000000D+00   0.12345678901234D-01  -0.18917233523154D-02
+  0.00000000000000D+00  -0.12345678901234D-01  -0.18917233523154D-02
+  cycle =      2    SCF energy =      -76.3467890123   |dE/xyz| =  0.000012
+    0.00000000000000      0.00000000000000      0.22166592000000      o
+    0.00000000000000      1.43087788000000     -0.88666368000000      h
+    0.00000000000000     -1.43087788000000     -0.88666368000000      h
+  0.00000000000000D+00   0.00000000000000D+00   0.10000000000000D-05
+  0.00000000000000D+00   0.10000000000000D-05  -0.50000000000000D-06
+  0.00000000000000D+00  -0.10000000000000D-05  -0.50000000000000D-06
+$end"""
+
+
+class TestTrajectory(unittest.TestCase):
+    """Tests the coord and gradient readers"""
+    def setUp(self):
+        for d in ['trajdir1', 'trajdir2']:
+            os.mkdir(d)
+            write_file(os.path.join(d, 'coord'), COORD.split('\n'))
+        write_file(os.path.join('trajdir1', 'gradient'), GRADIENT.split('\n'))
+
+    def tearDown(self):
+        for d in ['trajdir1', 'trajdir2']:
+            shutil.rmtree(d)
+        if os.path.isfile('merged.xyz'):
+            os.remove('merged.xyz')
+
+    def test_read_coord(self):
+        """Read a coord file, frozen atoms and later groups included"""
+        geom = read_coord(os.path.join('trajdir1', 'coord'))
+        self.assertEqual(geom.symbols, ['O', 'H', 'H'])
+        self.assertEqual(geom.coords[1][1], 1.43087788)
+
+    def test_bad_coord(self):
+        """A file without $coord raises"""
+        write_file(os.path.join('trajdir2', 'coord'), ['$title', '$end'])
+        with self.assertRaises(InputCheckError):
+            read_coord(os.path.join('trajdir2', 'coord'))
+
+    def test_read_gradient(self):
+        """Stream the cycles of a gradient file"""
+        cycles = list(read_gradient(os.path.join('trajdir1', 'gradient')))
+        self.assertEqual([c[0] for c in cycles], [1, 2])
+        self.assertEqual([c[1] for c in cycles],
+                         [-76.3456789012, -76.3467890123])
+        self.assertEqual(cycles[0][2].coords[0][2], 0.12418313433234)
+        self.assertEqual(cycles[0][3].shape, (3, 3))
+        self.assertAlmostEqual(cycles[0][3][1][1], 0.012345678901234)
+
+    def test_frames(self):
+        """Frames are titled with cycle and energy"""
+        titles = [title for title, _ in frames('trajdir1')]
+        self.assertEqual(titles, ['cycle = 1  energy = -76.3456789012',
+                                  'cycle = 2  energy = -76.3467890123'])
+
+    def test_write_xyz_files(self):
+        """Write the trajectory and final geometry as t2x would"""
+        write_xyz_files('trajdir1')
+        records = list(read_records(os.path.join('trajdir1',
+                                                 'optimization.xyz')))
+        self.assertEqual(len(records), 2)
+        final = list(read_records(os.path.join('trajdir1',
+                                               'final_geometry.xyz')))
+        self.assertEqual(len(final), 1)
+        self.assertAlmostEqual(final[0][1].coords[1][1], 1.43087788)
+
+    def test_write_all(self):
+        """Write xyz files in bulk, in workers"""
+        self.assertEqual(write_all(['trajdir1', 'trajdir2', 'nodir'], 2),
+                         ['nodir'])
+        self.assertTrue(os.path.isfile(os.path.join('trajdir2',
+                                                    'final_geometry.xyz')))
+        self.assertFalse(os.path.isfile(os.path.join('trajdir2',
+                                                     'optimization.xyz')))
+
+    def test_merge_final(self):
+        """Merge final geometries into one file"""
+        self.assertEqual(merge_final(['trajdir1', 'trajdir2'], 'merged.xyz'),
+                         2)
+        records = list(read_records('merged.xyz'))
+        self.assertEqual([title for title, _ in records],
+                         ['trajdir1', 'trajdir2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,9 +3,13 @@
 
 import unittest
 import os
+import shutil
 from os import path
+from time import time
 from turbocontrol import *
-from turbocontrol.turbogo_helpers import write_file
+from turbocontrol.turbogo_helpers import write_file, read_clean_file
+from turbocontrol.freeh_op import FreehData
+from turbocontrol.geometry import Geometry
 from turbogo import Job
 
 
@@ -19,6 +23,38 @@ class TestJobset(unittest.TestCase):
         """Make sure the jobset works"""
         self.assertEqual(self.jobset.indir, 'indir')
 
+    def test_record_run(self):
+        """Queue wait and run are split at the startfile"""
+        os.mkdir('tracedir')
+        try:
+            jobset = Jobset('tracedir', 'infile', Job())
+            jobset.curstart = time() - 100
+            write_file(path.join('tracedir', 'startfile'), [''])
+            os.utime(path.join('tracedir', 'startfile'),
+                     (jobset.curstart + 40, jobset.curstart + 40))
+            stamps = [jobset.curstart + n for n in [41, 43, 70, 74]]
+            write_file(path.join('tracedir', 'timing.log'), [
+                'start stage-in {} 1 tracedir'.format(stamps[0]),
+                'end stage-in {} 1 0'.format(stamps[1]),
+                'start stage-out {} 1 tracedir'.format(stamps[2]),
+                'end stage-out {} 1 0'.format(stamps[3])])
+            record_run(jobset, 'opt')
+            self.assertEqual([t['phase'] for t in jobset.timings],
+                             ['queue', 'run', 'stage in', 'stage out'])
+            self.assertAlmostEqual(jobset.timings[3]['end'] -
+                                   jobset.timings[3]['start'], 4, places=2)
+            self.assertAlmostEqual(jobset.timings[0]['end'] -
+                                   jobset.timings[0]['start'], 40,
+                                   places=2)
+            self.assertEqual(jobset.timings[1]['stage'], 'opt')
+            os.remove(path.join('tracedir', 'startfile'))
+            jobset.curstart = time() - 10
+            record_run(jobset, 'numforce')
+            self.assertEqual([t['phase'] for t in jobset.timings[4:]],
+                             ['queue'])
+        finally:
+            shutil.rmtree('tracedir')
+
     def test_jobset_autoname(self):
         """Make sure the auto-name works"""
         name = os.path.join('indir', 'infile')
@@ -249,6 +285,183 @@ class TestJobChecker(unittest.TestCase):
         self.assertEqual(ensure_ts(self.jobset3), 'ts')
     
 
+class TestAssignNproc(unittest.TestCase):
+    """Tests choosing processors for a set of jobs"""
+    def setUp(self):
+        memplan._hosts = [(16, 64000.0), (8, 32000.0)]
+        self.jobs = list()
+        for name, atoms in [('big', 60), ('small', 3)]:
+            job = Job(name=name, jobtype='opt', ri=True, basis='def2-TZVP')
+            job.geometry = Geometry.from_angstrom(['C'] * atoms,
+                                                  [[0, 0, 0]] * atoms)
+            job.autoproc = True
+            self.jobs.append(Jobset(name, 'infile', job))
+
+    def tearDown(self):
+        memplan._hosts = None
+
+    def test_auto(self):
+        """Spare slots go to the large job, flagged for parallel runs"""
+        jobs = assign_nproc(self.jobs, slots=8)
+        self.assertTrue(jobs[0].job.nproc > 1)
+        self.assertEqual(jobs[1].job.nproc, 1)
+        self.assertEqual(jobs[0].job.nproc + jobs[1].job.nproc, 8)
+        self.assertIn('$parallel_parameters maxtask=10000',
+                      jobs[0].job.control_add)
+        self.assertEqual(jobs[1].job.control_add, [])
+
+    def test_clamp(self):
+        """Jobs asking for more than a node has are cut down"""
+        self.jobs[0].job.autoproc = False
+        self.jobs[0].job.nproc = 32
+        self.jobs[1].job.autoproc = False
+        jobs = assign_nproc(self.jobs)
+        self.assertEqual(jobs[0].job.nproc, 16)
+        self.assertEqual(jobs[1].job.nproc, 1)
+        #MPI environments spread over nodes
+        scaling._rules['mpi'] = '$round_robin'
+        try:
+            self.jobs[0].job.para_arch = 'MPI'
+            self.jobs[0].job.nproc = 32
+            jobs = assign_nproc(self.jobs)
+            self.assertEqual(jobs[0].job.nproc, 32)
+        finally:
+            scaling._rules.clear()
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Tests restarting optimizations from the files of their last run"""
+    def setUp(self):
+        os.mkdir('ckptdir')
+        self.job = Jobset('ckptdir', 'infile',
+                          Job(name='ckpt', jobtype='opt', iterations=5,
+                              rt=2))
+        self.job.curstart = time() - 3 * 3600
+
+    def tearDown(self):
+        shutil.rmtree('ckptdir')
+
+    def test_stopped(self):
+        """Stopped by the checkpoint, or killed near the walltime"""
+        self.assertFalse(walltime_stopped(self.job))
+        write_file(path.join('ckptdir', 'timing.log'),
+                   ['start job {} 100 /scratch/job'.format(
+                       self.job.curstart + 60)])
+        self.assertTrue(walltime_stopped(self.job))
+        self.job.job.rt = '168:00:00'
+        self.assertFalse(walltime_stopped(self.job))
+        write_file(path.join('ckptdir', 'WALLTIME'), ['signal walltime'])
+        self.assertTrue(walltime_stopped(self.job))
+        write_file(path.join('ckptdir', 'stop'), [''])
+        clear_checkpoint('ckptdir')
+        self.assertEqual(os.listdir('ckptdir'), ['timing.log'])
+
+    def test_cycles_used(self):
+        """Not continued once all its cycles have run"""
+        write_file(path.join('ckptdir', 'energy'), [
+            '$energy      SCF               SCFKIN            SCFPOT'] + [
+            '     {} -1508.4{}      1452.77     -2961.18'.format(n, n)
+            for n in range(1, 6)] + ['$end'])
+        self.assertEqual(continue_opt(self.job, 'was killed'), 'ocrashed')
+        self.assertEqual(self.job.status, 'Opt Not Converged')
+        self.assertEqual(self.job.continuations, 0)
+
+    def test_continued_twice(self):
+        """Each continuation runs what is left of the whole budget"""
+        job = Jobset('ckptdir', 'infile',
+                     Job(name='ckpt', jobtype='opt', iterations=100, rt=2))
+        job.curstart = time()
+        write_file(path.join('ckptdir', 'control'), ['$coord    file=coord',
+                                                     '$end'])
+        write_file(path.join('ckptdir', 'mos'), ['$scfmo', '$end'])
+        memplan._hosts = [(8, 32000.0)]
+        try:
+            for cycles, left in [(40, 60), (70, 30)]:
+                write_file(path.join('ckptdir', 'energy'), [
+                    '$energy      SCF               SCFKIN            SCFPOT'
+                    ] + ['     {} -1508.4      1452.77     -2961.18'.format(n)
+                         for n in range(1, cycles + 1)] + ['$end'])
+                #no queue here, the continuation is set up but not submitted
+                continue_opt(job, 'stopped at its walltime')
+                self.assertEqual(job.job.iterations, left)
+                self.assertEqual(job.status, 'Opt Continue Failed')
+            #screwer's restart starts a new optimization after those cycles
+            opt_cycles(job)
+            self.assertEqual((job.cycle_base, job.job.iterations), (70, 100))
+        finally:
+            memplan._hosts = None
+
+    def test_killed(self):
+        """Runs that never reached the end of the job script"""
+        self.job.job.rt = '168:00:00'
+        self.assertFalse(killed(self.job))
+        lines = ['start job {} 100 /scratch/job'.format(
+            self.job.curstart + 60)]
+        write_file(path.join('ckptdir', 'timing.log'), lines)
+        self.assertTrue(killed(self.job))
+        self.assertFalse(walltime_stopped(self.job))
+        write_file(path.join('ckptdir', 'timing.log'),
+                   lines + ['end job {} 100 1'.format(self.job.curstart + 90)])
+        self.assertFalse(killed(self.job))
+
+    def test_has_orbitals(self):
+        """control and the mos, or both of alpha and beta"""
+        write_file(path.join('ckptdir', 'control'), ['$end'])
+        self.assertFalse(has_orbitals('ckptdir'))
+        write_file(path.join('ckptdir', 'alpha'), ['$end'])
+        self.assertFalse(has_orbitals('ckptdir'))
+        write_file(path.join('ckptdir', 'beta'), ['$end'])
+        self.assertTrue(has_orbitals('ckptdir'))
+
+    def test_warm_restart(self):
+        """New coord, stale markers gone, control and mos kept"""
+        write_file(path.join('ckptdir', 'control'), [
+            '$coord    file=coord', '$scfmo   file=mos', '$newcoord',
+            '   -8.35953193391576     -0.99142962091868     -1.33326242865311'
+            '      c', '$end'])
+        write_file(path.join('ckptdir', 'mos'), ['$scfmo', '$end'])
+        write_file(path.join('ckptdir', 'GEO_OPT_CONVERGED'), [''])
+        self.job.jobtype = 'optfreq'
+        self.job.job.jobtype = 'numforce'
+        geometry = Geometry.from_angstrom(['C'], [[0.0, 0.0, 1.0]])
+        memplan._hosts = [(8, 32000.0)]
+        try:
+            #no queue here, the job is prepared but not submitted
+            self.assertEqual(warm_restart(self.job, geometry), None)
+        finally:
+            memplan._hosts = None
+        self.assertEqual(self.job.job.jobtype, 'optfreq')
+        self.assertEqual(self.job.job.geometry, geometry)
+        self.assertEqual(read_clean_file(path.join('ckptdir', 'coord')),
+                         [line.strip() for line in geometry.coord_lines()])
+        control = read_clean_file(path.join('ckptdir', 'control'))
+        self.assertEqual(control[:2], ['$coord    file=coord',
+                                       '$scfmo   file=mos'])
+        self.assertNotIn('$newcoord', control)
+        self.assertFalse(path.isfile(path.join('ckptdir',
+                                               'GEO_OPT_CONVERGED')))
+        self.assertTrue(path.isfile(path.join('ckptdir', 'submitscript.sge')))
+        self.assertEqual(os.getcwd(), TOPDIR)
+
+    def test_start_refine(self):
+        """The pre-optimization's files set aside, its geometry taken up"""
+        self.job.job.geometry = Geometry.from_angstrom(['C'], [[0, 0, 0]])
+        geometry = Geometry.from_angstrom(['C'], [[0.0, 0.0, 1.0]])
+        write_file(path.join('ckptdir', 'coord'), geometry.coord_lines())
+        write_file(path.join('ckptdir', 'mos'), ['$scfmo', '$end'])
+        write_file(path.join('ckptdir', 'infile'), ['% job input'])
+        #no define here, the refinement is set up but fails to submit
+        self.assertEqual(start_refine(self.job), 'ocrashed')
+        self.assertEqual(self.job.status, 'Opt Submit Failed')
+        self.assertAlmostEqual(self.job.job.geometry.coords[0][2],
+                               geometry.coords[0][2])
+        self.assertEqual(sorted(os.listdir(path.join('ckptdir', PREOPT_DIR))),
+                         ['coord', 'mos'])
+        self.assertTrue(path.isfile(path.join('ckptdir', 'infile')))
+        self.assertEqual(self.job.job.guess, None)
+        self.assertEqual(os.getcwd(), TOPDIR)
+
+
 class TestWriteStats(unittest.TestCase):
     """Test the writing of stats"""
     def setUp(self):
@@ -291,7 +504,9 @@ class TestWriteStats(unittest.TestCase):
         """Test for writing stats with energy file missing"""
         answer = ['Name           Directory      Opt Steps   Opt Time   Freq Time   Total Time  1st Frequency       Energy',
                   'testjob2     testdir2/testfile      ?       0:10:00     1:01:01     1:11:01        50.00             ?']
-        write_stats(self.jobset2)
+        results = ResultsDB(':memory:')
+        results.record([self.jobset2])
+        results.write_reports()
         stats = turbogo_helpers.read_clean_file('stats.txt')
         os.remove('stats.txt')
         self.assertEqual(stats, answer)
@@ -300,29 +515,44 @@ class TestWriteStats(unittest.TestCase):
         """Test for ok stats"""
         answer = ['Name           Directory      Opt Steps   Opt Time   Freq Time   Total Time  1st Frequency       Energy',
                   'testjob1     testdir1/testfile      4       0:10:00     1:01:01     1:11:01        50.00      -1508.473774955']
-        write_stats(self.jobset1)
+        results = ResultsDB(':memory:')
+        results.record([self.jobset1])
+        results.write_reports()
         stats = turbogo_helpers.read_clean_file('stats.txt')
         os.remove('stats.txt')
         self.assertEqual(stats, answer)
 
+    def test_rerecord(self):
+        """Recording a job again replaces its results"""
+        results = ResultsDB(':memory:')
+        results.record([self.jobset1, self.jobset2])
+        self.jobset1.firstfreq = 60.0
+        results.record([self.jobset1])
+        rows = results.stats()
+        self.assertEqual(len(rows), 2)
+        self.assertEqual([row['first_freq'] for row in rows], [50.0, 60.0])
+        self.assertEqual(rows[1]['energy'], -1508.473774955)
+        self.assertEqual(results.conn.execute(
+            "SELECT COUNT(*) FROM energies").fetchone()[0], 4)
+
 class TestWriteFreeh(unittest.TestCase):
     """Test the writing of freeh"""
     def setUp(self):
-        data1 = {'zpe': '481.3', 't': ['298.15'], 'p': ['0.1000000'],
-                 'qtrans': ['19.81'], 'qrot': ['15.66'], 'qvib': ['15.89'],
-                 'pot': ['353.99'], 'eng': ['530.06'], 'entr': ['0.59886'],
-                 'cv': ['0.2849985'], 'cp': ['0.2933128'], 'enth': ['532.54']}
-        data2 = {'zpe': '481.3', 't': ['298.15', '308.15', '318.15'],
-                 'p': ['0.1000000', '0.1000000', '0.1000000'],
-                 'qtrans': ['19.81', '20.81', '21.81'],
-                 'qrot': ['15.66', '16.66', '17.66'],
-                 'qvib': ['15.89', '16.89', '17.89'],
-                 'pot': ['353.99', '363.99', '373.99'],
-                 'eng': ['530.06', '540.06', '550.06'],
-                 'entr': ['0.59886', '0.60886', '0.61886'],
-                 'cv': ['0.2849985', '0.2949985', '0.3049985'],
-                 'cp': ['0.2933128', '0.3033128', '0.3133128'],
-                 'enth': ['532.54', '542.54', '552.54']}
+        data1 = FreehData(481.3, t=[298.15], p=[0.1], qtrans=[19.81],
+                          qrot=[15.66], qvib=[15.89], pot=[353.99],
+                          eng=[530.06], entr=[0.59886], cv=[0.2849985],
+                          cp=[0.2933128], enth=[532.54])
+        data2 = FreehData(481.3, t=[298.15, 308.15, 318.15],
+                          p=[0.1, 0.1, 0.1],
+                          qtrans=[19.81, 20.81, 21.81],
+                          qrot=[15.66, 16.66, 17.66],
+                          qvib=[15.89, 16.89, 17.89],
+                          pot=[353.99, 363.99, 373.99],
+                          eng=[530.06, 540.06, 550.06],
+                          entr=[0.59886, 0.60886, 0.61886],
+                          cv=[0.2849985, 0.2949985, 0.3049985],
+                          cp=[0.2933128, 0.3033128, 0.3133128],
+                          enth=[532.54, 542.54, 552.54])
         self.job1 = Job(data=data1, name='testjob1', indir='testdir1', infile = 'infile1')
         self.job2 = Job(data=data2, name='testjob2', indir='testdir2', infile = 'infile2')
         self.headerstring = ("{name:^16}{directory:^20}{zpe:^14}{t:^10}" \
@@ -356,7 +586,10 @@ class TestWriteFreeh(unittest.TestCase):
         """Test for writing stats with energy file missing"""
         answer = ['Name           Directory       ZPE (kJ/mol)  Temp (K)   p (MPa)   ln(qtrans)  ln(qrot)  Pot (kJ/mol)  Eng (kJ/mol)  Entropy (kJ/mol/K)  Cv (kJ/molK)  Cp (kJ/molK) Enthalpy (kJ/mol)',
                   'testjob1      testdir1/infile1      481.3       298.15   0.1000000    19.81      15.66       353.99        530.06          0.59886         0.2849985     0.2933128       532.54']
-        write_freeh(self.job1)
+        results = ResultsDB(':memory:')
+        results.record([self.job1])
+        results.write_reports()
+        os.remove('stats.txt')
         freeh = turbogo_helpers.read_clean_file('freeh.txt')
         os.remove('freeh.txt')
         self.assertEqual(freeh, answer)
@@ -367,7 +600,10 @@ class TestWriteFreeh(unittest.TestCase):
                   'testjob2      testdir2/infile2      481.3       298.15   0.1000000    19.81      15.66       353.99        530.06          0.59886         0.2849985     0.2933128       532.54',
                   '308.15  0.1000000    20.81      16.66       363.99        540.06          0.60886         0.2949985     0.3033128       542.54',
                   '318.15  0.1000000    21.81      17.66       373.99        550.06          0.61886         0.3049985     0.3133128       552.54']
-        write_freeh(self.job2)
+        results = ResultsDB(':memory:')
+        results.record([self.job2])
+        results.write_reports()
+        os.remove('stats.txt')
         freeh = turbogo_helpers.read_clean_file('freeh.txt')
         os.remove('freeh.txt')
         self.assertEqual(freeh, answer)
@@ -376,11 +612,24 @@ class TestWriteFreeh(unittest.TestCase):
         answer = ['Name           Directory       ZPE (kJ/mol)  Temp (K)   p (MPa)   ln(qtrans)  ln(qrot)  Pot (kJ/mol)  Eng (kJ/mol)  Entropy (kJ/mol/K)  Cv (kJ/molK)  Cp (kJ/molK) Enthalpy (kJ/mol)',
                   'testjob1      testdir1/infile1      481.3       298.15   0.1000000    19.81      15.66       353.99        530.06          0.59886         0.2849985     0.2933128       532.54']
         turbogo_helpers.write_file('freeh.txt', self.headerstring.split('\n'))
-        write_freeh(self.job1)
+        results = ResultsDB(':memory:')
+        results.record([self.job1])
+        results.write_reports()
+        os.remove('stats.txt')
         freeh = turbogo_helpers.read_clean_file('freeh.txt')
         os.remove('freeh.txt')
         self.assertEqual(freeh, answer)
-    
+
+    def test_query_thermo(self):
+        """Thermochemistry rows are selected by temperature and method"""
+        self.job2.functional = 'pbe0'
+        results = ResultsDB(':memory:')
+        results.record([self.job1, self.job2])
+        rows = results.thermo(t=308.15)
+        self.assertEqual([row['name'] for row in rows], ['testjob2'])
+        self.assertEqual(rows[0]['pot'], 363.99)
+        rows = results.thermo(t=298.15, functional='pbe0')
+        self.assertEqual([row['enth'] for row in rows], [532.54])
 
 
 class TestFindInputs(unittest.TestCase):
@@ -478,6 +727,101 @@ $ricore_slave 1
         for key in codeanswer:
             self.assertEqual(isinstance(codeanswer[key][1], Job), True)
 
+    def test_find_inputs_cached(self):
+        """Unchanged inputs are read from the cache on a rescan"""
+        cachefile = 'inputcache'
+        try:
+            cache = InputCache(cachefile)
+            first = find_inputs(cache)
+            self.assertEqual(cache.hits, 0)
+            self.assertEqual(cache.misses, 6)
+            cache = InputCache(cachefile)
+            second = find_inputs(cache)
+            self.assertEqual(cache.hits, 6)
+            self.assertEqual(cache.misses, 0)
+            self.assertEqual(sorted(first), sorted(second))
+            for key in second:
+                self.assertEqual(second[key][1].geometry,
+                                 first[key][1].geometry)
+                self.assertEqual(second[key][1].parsed, None)
+            job = first.values()[0]
+            self.assertEqual(len(job[1].parsed), 2)
+            jobset = Jobset('indir', job[0], job[1])
+            self.assertEqual([t['phase'] for t in jobset.timings], ['parse'])
+        finally:
+            os.remove(cachefile)
+
+    def test_find_inputs_pruned(self):
+        """Output dirs and dirs below a valid input aren't searched"""
+        os.mkdir(path.join('indir-good1', 'sub'))
+        os.mkdir(path.join('indir-nofile4', 'numforce'))
+        write_file(path.join('indir-good1', 'sub', 'input7.in'),
+                   self.infile.split('\n'))
+        write_file(path.join('indir-nofile4', 'numforce', 'input8.in'),
+                   self.infile.split('\n'))
+        try:
+            codeanswer = find_inputs()
+        finally:
+            shutil.rmtree(path.join('indir-good1', 'sub'))
+            shutil.rmtree(path.join('indir-nofile4', 'numforce'))
+        self.assertEqual(sorted(codeanswer),
+                         ['./indir-deep/deepdir', './indir-good1',
+                          './indir-good2', './indir-twofile5'])
+
+    def test_find_inputs_globs(self):
+        """Include and exclude globs select the inputs read"""
+        codeanswer = find_inputs(include=['*good*'])
+        self.assertEqual(sorted(codeanswer), ['./indir-good1', './indir-good2'])
+        codeanswer = find_inputs(exclude=['indir-good1', 'input6.in'])
+        self.assertEqual(sorted(codeanswer), ['./indir-good2',
+                                              './indir-twofile5'])
+
+    def test_find_inputs_parallel(self):
+        """Inputs parsed in worker processes"""
+        codeanswer = find_inputs(workers=2)
+        self.assertEqual(len(codeanswer), 4)
+        for key in codeanswer:
+            self.assertEqual(isinstance(codeanswer[key][1], Job), True)
+
+
+
+class TestSources(unittest.TestCase):
+    """Tests jobs read from --source files"""
+    def setUp(self):
+        os.makedirs(path.join('sourcedir', 'a'))
+        os.mkdir(path.join('sourcedir', 'b'))
+        write_file(path.join('sourcedir', 'template.in'),
+                   ['# Opt b3-lyp/def2-SVP ri', '', 'Screen', '', '0 1', ''])
+        record = ['2', '', 'C 0.0 0.0 0.0', 'O 0.0 0.0 1.2']
+        for source in ['a/conf.xyz', 'b/conf.xyz', 'other.xyz']:
+            write_file(path.join('sourcedir', source), record * 2)
+
+    def tearDown(self):
+        shutil.rmtree('sourcedir')
+
+    def test_source_names(self):
+        """Sources sharing a name are told apart by path and extension"""
+        self.assertEqual(source_names(['conf.xyz', 'other.sdf']),
+                         ['conf', 'other'])
+        self.assertEqual(source_names(['a/conf.xyz', 'b/conf.xyz',
+                                       'conf.sdf', 'conf.v2.xyz']),
+                         ['a-conf-xyz', 'b-conf-xyz', 'conf-sdf', 'conf-v2'])
+        self.assertEqual(source_names(['conf.xyz', 'conf.xyz']),
+                         ['conf-xyz', 'conf-xyz-2'])
+
+    def test_same_stem(self):
+        """Two sources of the same name get their own job dirs"""
+        os.chdir('sourcedir')
+        try:
+            jobs = list(source_jobsets('template.in', [
+                path.join('a', 'conf.xyz'), path.join('b', 'conf.xyz'),
+                'other.xyz']))
+        finally:
+            os.chdir(os.pardir)
+        self.assertEqual([job.indir for job in jobs], [
+            path.join(os.curdir, name, num)
+            for name in ['a-conf-xyz', 'b-conf-xyz', 'other']
+            for num in ['0001', '0002']])
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
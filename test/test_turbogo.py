@@ -3,7 +3,11 @@
 
 import unittest
 import os
+import sys
+import subprocess
+import shutil
 from turbogo import *
+from turbocontrol.geometry import ELEMENT_INDEX
 
 
 class TestJob(unittest.TestCase):
@@ -22,6 +26,26 @@ class TestJob(unittest.TestCase):
         job = Job(jobtype = 'freq')
         self.assertEqual(job.para_arch, 'SMP')
 
+    def test_preopt_job(self):
+        """A loose RI opt in the cheap basis, the job itself untouched"""
+        job = Job(jobtype='optfreq', basis='def2-TZVP', freqopts='numforce',
+                  preopt='def2-SV(P)')
+        job.control_add = ['$disp3']
+        pre = preopt_job(job)
+        self.assertEqual((pre.basis, pre.jobtype, pre.converge),
+                         ('def2-SV(P)', 'opt', 'loose'))
+        self.assertTrue(pre.ri and pre.marij)
+        self.assertEqual((pre.freqopts, pre.preopt), (None, None))
+        pre.control_add.append('$marij')
+        self.assertEqual((job.basis, job.jobtype, job.control_add),
+                         ('def2-TZVP', 'optfreq', ['$disp3']))
+        submit_script_prepare(pre, 'testpreoptscript')
+        try:
+            script = turbogo_helpers.read_clean_file('testpreoptscript')
+        finally:
+            os.remove('testpreoptscript')
+        self.assertIn('jobex -c 300 -ri -energy 5 -gcart 2 > opt.out', script)
+
 
 class TestSetup(unittest.TestCase):
     """Test the input file reading & parsing"""
@@ -62,12 +86,12 @@ $ricore_slave 1
         self.job.para_arch = 'GA'
         self.job.control_add = ['$ricore 0', '$ricore_slave 1']
         self.job.control_remove = ['$marij']
-        self.job.geometry = [
-            '-10.14896312689057 1.75782324146904 -0.2949862481115 c',
-            '-8.99358457406949 2.76561418392812 1.85268749294372 c',
-            '-6.82890329788933 1.622707823532 2.83855761235287 c',
-            '-5.82243516371775 -0.51249372509826 1.62856597451948 c',
-        ]
+        self.job.geometry = turbogo_helpers.check_geom([
+            'C -10.14896312689057 1.75782324146904 -0.2949862481115',
+            'C -8.99358457406949 2.76561418392812 1.85268749294372',
+            'C -6.82890329788933 1.622707823532 2.83855761235287',
+            'C -5.82243516371775 -0.51249372509826 1.62856597451948',
+        ])
 
     def tearDown(self):
         os.remove('testinfile.in')
@@ -77,24 +101,162 @@ $ricore_slave 1
         autojob = jobsetup('testinfile.in')
         self.assertEqual(autojob.name, self.job.name)
 
+    def test_job_setup_geometry(self):
+        """Make sure the geometry is read into the job"""
+        autojob = jobsetup('testinfile.in')
+        self.assertEqual(autojob.geometry, self.job.geometry)
+
+    def test_parse_lines(self):
+        """Parse from a list of lines, ending without a blank line"""
+        lines = self.infile.split('\n')[:13]
+        autojob = parse_input(lines)
+        self.assertEqual(autojob.geometry, self.job.geometry)
+        self.assertEqual(autojob.basis, 'TZVP')
+        self.assertEqual(autojob.control_remove, [])
+
+    def test_parse_no_route(self):
+        """Missing route card is a syntax error"""
+        with self.assertRaises(InputSyntaxError):
+            parse_input(['%nproc=2', '', 'title'])
+
     def test_check_file(self):
         """Check a job is returned"""
         self.assertEqual(isinstance(check_input_file('testinfile.in'), Job),
                          True)
 
 
+class TestMultiJob(unittest.TestCase):
+    """Test reading inputs holding more than one job"""
+
+    def setUp(self):
+        self.section = """%nproc=2
+# Opt b3-lyp/TZVP
+
+Conformer
+
+0 1
+C 0.0 0.0 0.0
+O 0.0 0.0 1.2
+--Geom--
+C 0.0 0.0 0.0
+O 0.0 0.0 1.3
+
+$disp
+"""
+        self.link1 = self.section + "--Link1--\n" + self.section.replace(
+            '--Geom--\nC 0.0 0.0 0.0\nO 0.0 0.0 1.3\n', '')
+
+    def test_multi_geometry(self):
+        """Each geometry of a block becomes a job"""
+        jobs = list(parse_jobs(self.section.split('\n')))
+        self.assertEqual([job.name for job in jobs],
+                         ['Conformer 1', 'Conformer 2'])
+        self.assertEqual(jobs[0].control_add, jobs[1].control_add)
+
+    def test_link1(self):
+        """Each --Link1-- section becomes a job"""
+        jobs = list(parse_jobs(self.link1.split('\n')))
+        self.assertEqual(len(jobs), 3)
+        self.assertEqual(jobs[2].name, 'Conformer')
+
+    def test_single_only(self):
+        """parse_input refuses multi-job inputs"""
+        with self.assertRaises(InputSyntaxError):
+            parse_input(self.section.split('\n'))
+
+    def test_fan_out(self):
+        """Multi-job inputs get numbered working dirs"""
+        jobs = list(parse_jobs(self.link1.split('\n')))
+        dirs = [d for d, _ in fan_out('top', 'confs.com', jobs)]
+        self.assertEqual(dirs, [os.path.join('top', 'confs', '0001'),
+                                os.path.join('top', 'confs', '0002'),
+                                os.path.join('top', 'confs', '0003')])
+
+    def test_fan_out_single(self):
+        """A lone job stays in its directory"""
+        jobs = list(parse_jobs(self.link1.split('--Link1--')[1].split('\n')))
+        self.assertEqual([d for d, _ in fan_out('top', 'confs.com', jobs)],
+                         ['top'])
+
+
+class TestCheck(unittest.TestCase):
+    """Test the validate-only mode"""
+
+    def setUp(self):
+        self.infile = 'checkinput.com'
+        turbogo_helpers.write_file(self.infile, [
+            '# Opt b3-lyp/TZVP', '', 'Check', '', '0 1', 'C 0.0 0.0 0.0',
+            'O 0.0 0.0 1.2', ''])
+
+    def tearDown(self):
+        os.remove(self.infile)
+
+    def test_check_good(self):
+        """Valid inputs pass the check"""
+        self.assertEqual(check_jobs(self.infile), True)
+
+    def test_check_bad(self):
+        """Invalid inputs fail the check"""
+        turbogo_helpers.write_file(self.infile, ['# opt', '', 'bad'])
+        self.assertEqual(check_jobs(self.infile), False)
+
+    def test_no_pexpect(self):
+        """Importing turbogo doesn't load pexpect"""
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        out = subprocess.check_output(
+            [sys.executable, '-c',
+             "import sys, turbogo; print 'pexpect' in sys.modules"], env=env)
+        self.assertEqual(out.strip(), 'False')
+
+
+class TestTemplate(unittest.TestCase):
+    """Test jobs set up from a template and a structure file"""
+
+    def setUp(self):
+        self.template = """%nproc=2
+# Opt b3-lyp/def2-SVP ri
+
+Screen
+
+0 1
+
+$disp
+"""
+        turbogo_helpers.write_file('testtemplate.in',
+                                   self.template.split('\n'))
+        turbogo_helpers.write_file('testsource.xyz', [
+            '2', 'first', 'C 0.0 0.0 0.0', 'O 0.0 0.0 1.2',
+            '2', '', 'C 0.0 0.0 0.0', 'O 0.0 0.0 1.3'])
+
+    def tearDown(self):
+        os.remove('testtemplate.in')
+        os.remove('testsource.xyz')
+
+    def test_read_template(self):
+        """Template parts are checked"""
+        parts = read_template('testtemplate.in')
+        self.assertEqual(parts['route']['jobtype'], 'opt')
+        self.assertEqual(parts['control_add'], ['$disp'])
+
+    def test_jobsetup_source(self):
+        """One job per record"""
+        jobs = list(jobsetup_source('testtemplate.in', 'testsource.xyz'))
+        self.assertEqual([job.name for job in jobs], ['first', 'Screen 2'])
+        self.assertEqual(len(jobs[1].geometry), 2)
+        self.assertEqual(jobs[0].nproc, 2)
+
+
 class TestWriteCoord(unittest.TestCase):
     """Test the coord writing"""
 
     def setUp(self):
-        self.coordlist = [
-            '-10.14896312689057 1.75782324146904 -0.2949862481115 c',
-            '-8.99358457406949 2.76561418392812 1.85268749294372 c',
-            '-6.82890329788933 1.622707823532 2.83855761235287 c',
-            '-5.82243516371775 -0.51249372509826 1.62856597451948 c',
-        ]
+        self.geometry = Geometry(
+            [ELEMENT_INDEX['C'], ELEMENT_INDEX['C'], ELEMENT_INDEX['H']],
+            [[-10.14896312689057, 1.75782324146904, -0.2949862481115],
+             [-8.99358457406949, 2.76561418392812, 1.85268749294372],
+             [-6.82890329788933, 1.622707823532, 2.83855761235287]])
         self.job = Job()
-        self.job.geometry = self.coordlist
+        self.job.geometry = self.geometry
         write_coord(self.job, 'testcoord')
 
     def tearDown(self):
@@ -105,14 +267,20 @@ class TestWriteCoord(unittest.TestCase):
         coordfile = turbogo_helpers.read_clean_file('testcoord')
         result = [
             '$coord',
-            '-10.14896312689057 1.75782324146904 -0.2949862481115 c',
-            '-8.99358457406949 2.76561418392812 1.85268749294372 c',
-            '-6.82890329788933 1.622707823532 2.83855761235287 c',
-            '-5.82243516371775 -0.51249372509826 1.62856597451948 c',
+            '-10.14896312689057      1.75782324146904     -0.29498624811150      c',
+            '-8.99358457406949      2.76561418392812      1.85268749294372      c',
+            '-6.82890329788933      1.62270782353200      2.83855761235287      h',
             '$end',
             ]
         self.assertEqual(coordfile, result)
 
+    def test_write_coord_twice(self):
+        """Writing the coord file leaves the job geometry untouched"""
+        write_coord(self.job, 'testcoord')
+        self.assertEqual(len(self.job.geometry), 3)
+        self.assertEqual(turbogo_helpers.read_clean_file('testcoord')[0],
+                         '$coord')
+
 
 class TestControlEdit(unittest.TestCase):
     """Test the multi-control edit cycles"""
@@ -171,6 +339,9 @@ class TestSubmitScriptPrep(unittest.TestCase):
         self.job4 = Job(iterations=300, jobtype='ts', para_arch='GA',
                         nproc=8, name='Test Job 4')
         submit_script_prepare(self.job4, 'testsubmitscript4')
+        self.timing = [line.strip() for line in TIMING_SETUP.split('\n')]
+        self.checkpoint = [line.strip() for line in
+                           CHECKPOINT.split('\n')[:-1]]
 
     def tearDown(self):
         os.remove('testsubmitscript1')
@@ -188,28 +359,47 @@ class TestSubmitScriptPrep(unittest.TestCase):
             '#$ -o test-job-1.stdout',
             '#$ -N tm.test-job-1',
             '#$ -l h_rt=168:00:00',
+            '#$ -l s_rt=167:00:00',
             '#$ -R y',
-            '#$ -pe threaded 8',
+            '#$ -pe mpi 8',
             '',
             'export PARA_ARCH=MPI',
             'export MPI_IC_ORDER="TCP"',
             'export PARNODES=7',
             "cat $PE_HOSTFILE | awk '{for(i=0;i<$2;i++) print $1}' > hosts_file",
             'export HOSTS_FILE=`readlink -f hosts_file`',
+            "export TM_NODES=`awk '{print $1}' $PE_HOSTFILE | sort -u | wc -l`",
             '',
             'source $TURBODIR/Config_turbo_env',
             '',
             'ulimit -s unlimited',
             '',
             'touch startfile',
-            '',
+            ''] + self.timing + self.checkpoint + [
+            'tm_stamp start job "$PWD"',
+            "( trap '' USR1",
             'jobex -c 300 -ri > opt.out',
-            't2x > optimization.xyz',
-            't2x -c > final_geometry.xyz',
+            ') &',
+            'tm_wait $!',
+            'tm_stamp end job $?',
+            XYZ_COMMAND.format(python=sys.executable).strip(),
             '']
         submitscript = turbogo_helpers.read_clean_file('testsubmitscript1')
         self.assertEqual(submitscript, result)
 
+    def test_submit_body(self):
+        """A bundle's worker gets the job's commands alone"""
+        script = submit_script_prepare(self.job1, 'testsubmitscript1',
+                                       body='testbody')
+        try:
+            body = turbogo_helpers.read_clean_file('testbody')
+        finally:
+            os.remove('testbody')
+        self.assertEqual(body[0], 'touch startfile')
+        self.assertIn('jobex -c 300 -ri > opt.out', body)
+        self.assertIn('touch startfile\n', script)
+        self.assertNotIn('source $TURBODIR/Config_turbo_env', body)
+
     def test_submit_numforce(self):
         """Test generation of the submit script"""
         result = [
@@ -221,7 +411,7 @@ class TestSubmitScriptPrep(unittest.TestCase):
             '#$ -N tm.test-job-2',
             '#$ -l h_rt=168:00:00',
             '#$ -R y',
-            '#$ -pe threaded 1',
+            '#$ -pe mpi 1',
             '',
             '',
             'source $TURBODIR/Config_turbo_env',
@@ -229,8 +419,10 @@ class TestSubmitScriptPrep(unittest.TestCase):
             'ulimit -s unlimited',
             '',
             'touch startfile',
-            '',
+            ''] + self.timing + [
+            'tm_stamp start job "$PWD"',
             'NumForce -central -ri > numforce.out',
+            'tm_stamp end job $?',
             '']
         submitscript = turbogo_helpers.read_clean_file('testsubmitscript2')
         self.assertEqual(submitscript, result)
@@ -245,6 +437,7 @@ class TestSubmitScriptPrep(unittest.TestCase):
             '#$ -o test-job-4.stdout',
             '#$ -N tm.test-job-4',
             '#$ -l h_rt=168:00:00',
+            '#$ -l s_rt=167:00:00',
             '#$ -R y',
             '#$ -pe threaded 8',
             '',
@@ -253,18 +446,23 @@ class TestSubmitScriptPrep(unittest.TestCase):
             'export PARNODES=8',
             "cat $PE_HOSTFILE | awk '{for(i=0;i<$2;i++) print $1}' > hosts_file",
             'export HOSTS_FILE=`readlink -f hosts_file`',
+            "export TM_NODES=`awk '{print $1}' $PE_HOSTFILE | sort -u | wc -l`",
             '',
             'source $TURBODIR/Config_turbo_env',
             '',
             'ulimit -s unlimited',
             '',
             'touch startfile',
-            '',
+            ''] + self.timing + self.checkpoint + [
+            'tm_stamp start job "$PWD"',
+            "( trap '' USR1",
             'dscf',
             'grad',
             'jobex -trans > ts.out',
-            't2x > optimization.xyz',
-            't2x -c > final_geometry.xyz',
+            ') &',
+            'tm_wait $!',
+            'tm_stamp end job $?',
+            XYZ_COMMAND.format(python=sys.executable).strip(),
             '']
         submitscript = turbogo_helpers.read_clean_file('testsubmitscript4')
         self.assertEqual(submitscript, result)
@@ -287,18 +485,118 @@ class TestSubmitScriptPrep(unittest.TestCase):
             'export PARNODES=8',
             "cat $PE_HOSTFILE | awk '{for(i=0;i<$2;i++) print $1}' > hosts_file",
             'export HOSTS_FILE=`readlink -f hosts_file`',
+            "export TM_NODES=`awk '{print $1}' $PE_HOSTFILE | sort -u | wc -l`",
             '',
             'source $TURBODIR/Config_turbo_env',
             '',
             'ulimit -s unlimited',
             '',
             'touch startfile',
-            '',
+            ''] + self.timing + [
+            'tm_stamp start job "$PWD"',
             'ridft > sp.out',
+            'tm_stamp end job $?',
             '']
         submitscript = turbogo_helpers.read_clean_file('testsubmitscript3')
         self.assertEqual(submitscript, result)
 
+    def test_submit_memory(self):
+        """Test the h_vmem request of a planned job"""
+        job = Job(ri=True, jobtype='sp', name='Test Job 6', memory=1408)
+        submit_script_prepare(job, 'testsubmitscript6')
+        submitscript = turbogo_helpers.read_clean_file('testsubmitscript6')
+        os.remove('testsubmitscript6')
+        self.assertEqual(submitscript[6:9], ['#$ -l h_rt=168:00:00',
+                                             '#$ -l h_vmem=1408M',
+                                             '#$ -R y'])
+
+    def test_submit_scratch(self):
+        """Test staging the job through node-local scratch"""
+        job = Job(ri=True, jobtype='sp', name='Test Job 5', scratch='$TMPDIR')
+        submit_script_prepare(job, 'testsubmitscript5')
+        submitscript = turbogo_helpers.read_clean_file('testsubmitscript5')
+        os.remove('testsubmitscript5')
+        staging = [line.strip() for line in
+                   STAGING.format(scratch='$TMPDIR').split('\n')]
+        self.assertEqual(submitscript[8:10], ['#$ -pe threaded 1',
+                                              '#$ -notify'])
+        start = submitscript.index('touch startfile') + 2
+        self.assertEqual(submitscript[start:start + len(self.timing)],
+                         self.timing)
+        start += len(self.timing)
+        self.assertEqual(submitscript[start:-4], staging[:-1])
+        self.assertEqual(staging[:2],
+                         ['export TM_SUBMITDIR=`pwd`',
+                          'export TM_SCRATCH=$TMPDIR/tm.${JOB_ID:-$$}'])
+        self.assertEqual(submitscript[-4:], ['tm_stamp start job "$PWD"',
+                                             'ridft > sp.out',
+                                             'tm_stamp end job $?', ''])
+
+    def test_submit_pe(self):
+        """Test the parallel environment of the site and of the job"""
+        job = Job(ri=True, jobtype='sp', para_arch='GA', nproc=32,
+                  name='Test Job 7')
+        os.environ['TURBOCONTROL_PE_GA'] = 'orte'
+        try:
+            submit_script_prepare(job, 'testsubmitscript7')
+            submitscript = turbogo_helpers.read_clean_file('testsubmitscript7')
+            self.assertEqual(submitscript[8], '#$ -pe orte 32')
+            job.pe = 'mpi-rr'
+            submit_script_prepare(job, 'testsubmitscript7')
+            submitscript = turbogo_helpers.read_clean_file('testsubmitscript7')
+            self.assertEqual(submitscript[8], '#$ -pe mpi-rr 32')
+        finally:
+            del os.environ['TURBOCONTROL_PE_GA']
+            os.remove('testsubmitscript7')
+
+    def test_soft_walltime(self):
+        """Test the walltime warning, a margin before the limit"""
+        self.assertEqual(soft_walltime('168:00:00'), '167:00:00')
+        self.assertEqual(soft_walltime('2:00:00'), '1:48:00')
+        self.assertEqual(soft_walltime('0:05:00'), '0:05:00')
+
+    def test_submit_distributed(self):
+        """Test the scripts of a NumForce split over queue jobs"""
+        job = Job(ri=True, jobtype='numforce', nproc=4, freqjobs=6,
+                  name='Test Job 8', scratch='$TMPDIR')
+        prep = submit_script_prepare(job, 'testsubmitscript8', 'prep')
+        pieces = submit_script_prepare(job, 'testsubmitscript8', 'pieces', '101')
+        assemble = submit_script_prepare(job, 'testsubmitscript8', hold='102')
+        os.remove('testsubmitscript8')
+        prep = prep.split('\n')
+        self.assertEqual(prep[8:10], ['#$ -pe threaded 1', ''])
+        self.assertEqual(prep[-3], 'NumForce -prep -central -ri > numforce_prep.out')
+        self.assertFalse('export TM_SCRATCH' in '\n'.join(prep))
+        pieces = pieces.split('\n')
+        self.assertEqual(pieces[8:11], ['#$ -pe threaded 1', '#$ -t 1-6',
+                                        '#$ -hold_jid 101'])
+        self.assertTrue(NUMFORCE_PIECES.format(
+            pieces=6, done=PIECE_DONE, scf='ridft', grad='rdgrad') in
+                        '\n'.join(pieces))
+        assemble = assemble.split('\n')
+        self.assertEqual(assemble[8:11], ['#$ -pe threaded 4', '#$ -notify',
+                                          '#$ -hold_jid 102'])
+        self.assertTrue('export TM_SCRATCH=$TMPDIR/tm.${JOB_ID:-$$}' in
+                        assemble)
+        self.assertEqual(assemble[-3],
+                         'NumForce -central -ri -mfile hosts_file > numforce.out')
+
+    def test_distributed_progress(self):
+        """Test counting the displacements finished by the pieces"""
+        self.assertEqual(distributed_progress('nodir'), (0, 0))
+        kraftwerk = os.path.join('nfdir', 'numforce', 'KraftWerk')
+        for name in ['dx1', 'dx2', 'dx3', 'tmp']:
+            os.makedirs(os.path.join(kraftwerk, name))
+            if name != 'tmp':
+                turbogo_helpers.write_file(
+                    os.path.join(kraftwerk, name, 'control'), ['$end'])
+        turbogo_helpers.write_file(
+            os.path.join(kraftwerk, 'dx2', PIECE_DONE), [''])
+        try:
+            self.assertEqual(distributed_progress('nfdir'), (1, 3))
+        finally:
+            shutil.rmtree('nfdir')
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -17,6 +17,30 @@ class TestSimpleFuncs(unittest.TestCase):
         os.remove('testfile1')
         os.remove('testfile2')
 
+    def test_read_energies(self):
+        """Test reading the energy file"""
+        write_file('testfile1', [
+            '$energy      SCF               SCFKIN            SCFPOT',
+            '     1 -1508.413363988      1452.770765492     -2961.184129480',
+            '     2 -1508.439522519      1452.185335264     -2960.624857784',
+            '$end'])
+        self.assertEqual(read_energies('testfile1'),
+                         [(1, -1508.413363988), (2, -1508.439522519)])
+
+    def test_read_spectrum(self):
+        """Test reading the vibrational spectrum of a control file"""
+        write_file('testfile1', [
+            '$title',
+            '$vibrational spectrum',
+            '#  mode     symmetry     wave number   IR intensity    selection rules',
+            '#                         cm**(-1)        km/mol         IR     RAMAN',
+            '     1                        0.00         0.00000         -       -',
+            '     7        a            -123.45         1.23000        YES     YES',
+            '     8        a             456.78        10.00000        YES     YES',
+            '$end'])
+        self.assertEqual(read_spectrum('testfile1'),
+                         [(7, -123.45), (8, 456.78)])
+
     def test_is_int_int(self):
         """Test the is_int function with a good int"""
         self.assertEqual(is_int(1), True)
@@ -146,7 +170,9 @@ class TestArgs(unittest.TestCase):
         self.maxcyclesarg = ['%maxcycles=300']
         self.autocontrolmodarg = ['%autocontrolmod']
         self.nocontrolmodarg = ['%nocontrolmod']
-        self.bad_nprocarg = ['%nproc=10']
+        self.bad_nprocarg = ['%nproc=0']
+        self.large_nprocarg = ['%nproc=16']
+        self.auto_nprocarg = ['%nproc=auto']
         self.bad_archarg = ['%arch=GAP']
         self.bad_maxcyclesarg = ['%maxcycles=-5']
         self.good_cosmo = ['%cosmo=DMF']
@@ -154,8 +180,16 @@ class TestArgs(unittest.TestCase):
         self.bad_cosmo = ['%cosmo=blarg']
         self.none_cosmo = ['%cosmo']
         self.number_cosmo = ['%cosmo=38.4']
+        self.slug_cosmo = ['%cosmo=1,1,1 Trichloroethane']
         self.bad_rt = ['%rt=numbers']
         self.good_rt = ['%rt=10']
+        self.scratch = ['%scratch']
+        self.scratch_dir = ['%scratch=/local/scratch']
+        self.bad_scratch = ['%scratch=/local; rm']
+        self.pe = ['%pe=mpi-rr']
+        self.freqjobs = ['%freqjobs=12']
+        self.bad_freqjobs = ['%freqjobs=some']
+        self.bad_pe = ['%pe=mpi rr']
         self.bad_controlmodarg = ['%autocontrolmod', '%nocontrolmod']
         self.unknownarg = ['%billy']
         self.ignorearg = ['%rwf=billy.rwf']
@@ -164,13 +198,15 @@ class TestArgs(unittest.TestCase):
     def test_nprocarg(self):
         """Test the collection of nprocs"""
         self.assertEqual(check_args(self.nprocarg), {'nproc': '8'})
+        self.assertEqual(check_args(self.large_nprocarg), {'nproc': '16'})
+        self.assertEqual(check_args(self.auto_nprocarg), {'nproc': 'auto'})
 
     def test_bad_nprocarg(self):
         """Test a bad nproc"""
         with self.assertRaises(InputCheckError) as cm:
             check_args(self.bad_nprocarg)
         the_exception = cm.exception
-        self.assertEqual(the_exception.msg, "Invalid value 10 for argument nproc.")
+        self.assertEqual(the_exception.msg, "Invalid value 0 for argument nproc.")
 
     def test_archarg(self):
         """Test getting an architecture"""
@@ -240,6 +276,10 @@ class TestArgs(unittest.TestCase):
         """Test a blank cosmo"""
         self.assertEqual(check_args(self.none_cosmo), {'cosmo': True})
 
+    def test_slug_cosmo(self):
+        """Test a solvent name matching by slug"""
+        self.assertEqual(check_args(self.slug_cosmo), {'cosmo': '7.3'})
+
     def test_number_cosmo(self):
         """Test an explicit number"""
         self.assertEqual(check_args(self.number_cosmo), {'cosmo': '38.4'})
@@ -251,6 +291,45 @@ class TestArgs(unittest.TestCase):
     def test_bad_rt(self):
         """Test a bad rt"""
         self.assertEqual(check_args(self.bad_rt), {'rt': 168})
+
+    def test_scratch(self):
+        """Test staging to $TMPDIR or a given directory"""
+        self.assertEqual(check_args(self.scratch), {'scratch': '$TMPDIR'})
+        self.assertEqual(check_args(self.scratch_dir),
+                         {'scratch': '/local/scratch'})
+
+    def test_bad_scratch(self):
+        """Test a scratch directory that can't go in the script"""
+        with self.assertRaises(InputCheckError) as cm:
+            check_args(self.bad_scratch)
+        self.assertEqual(cm.exception.msg,
+                         "Invalid value /local; rm for argument scratch.")
+
+    def test_pe(self):
+        """Test a parallel environment"""
+        self.assertEqual(check_args(self.pe), {'pe': 'mpi-rr'})
+        with self.assertRaises(InputCheckError) as cm:
+            check_args(self.bad_pe)
+        self.assertEqual(cm.exception.msg,
+                         "Invalid value mpi rr for argument pe.")
+
+    def test_freqjobs(self):
+        """Test splitting numforce over queue jobs"""
+        self.assertEqual(check_args(self.freqjobs), {'freqjobs': '12'})
+        with self.assertRaises(InputCheckError) as cm:
+            check_args(self.bad_freqjobs)
+        self.assertEqual(cm.exception.msg,
+                         "Invalid value some for argument freqjobs.")
+
+    def test_preopt(self):
+        """Test a pre-optimization basis, def2-SV(P) by default"""
+        self.assertEqual(check_args(['%preopt']), {'preopt': 'def2-SV(P)'})
+        self.assertEqual(check_args(['%preopt=def2svp']),
+                         {'preopt': 'def2-SVP'})
+        with self.assertRaises(InputCheckError) as cm:
+            check_args(['%preopt=sto-3g'])
+        self.assertEqual(cm.exception.msg,
+                         "Invalid value sto-3g for argument preopt.")
     
     
 
@@ -332,6 +411,25 @@ class TestRoute(unittest.TestCase):
         }
         self.assertEqual(check_route(self.lowercase), result)
 
+    def test_nohyphenroute(self):
+        """Test a basis given without hyphens"""
+        result = {
+            'jobtype': 'sp',
+            'basis': 'def2-TZVP'
+        }
+        self.assertEqual(check_route('# SP DEF2TZVP'), result)
+
+    def test_parenroute(self):
+        """Basis sets keep their parentheses, jobtypes lose them"""
+        result = {
+            'jobtype': 'opt',
+            'functional': 'tpss',
+            'basis': 'def2-SV(P)'
+        }
+        self.assertEqual(check_route('# opt tpss/def2-SV(P)'), result)
+        self.assertEqual(check_route('# opt freq(numforce)'),
+                         {'jobtype': 'optfreq', 'freqopts': 'numforce'})
+
 class TestChSpin(unittest.TestCase):
     """Test the chspin tester"""
 
@@ -385,11 +483,22 @@ class TestGeom(unittest.TestCase):
     def test_good_geom(self):
         """Test a good geometry"""
         #NOTE Turbomole uses bohr radius: x//0.52917720859 for geom locations
-        result=[
-            '1.88972613289 3.77945226577 -1.88972613289 C',
-            '3.77945226577 5.66917839866 1.88972613289 H'
-            ]
-        self.assertEqual(check_geom(self.good_geom), result)
+        geom = check_geom(self.good_geom)
+        self.assertEqual(geom.symbols, ['C', 'H'])
+        self.assertEqual(
+            [[round(x, 8) for x in row] for row in geom.coords.tolist()],
+            [[1.88972613, 3.77945227, -1.88972613],
+             [3.77945227, 5.6691784, 1.88972613]])
+
+    def test_short_geom(self):
+        """Test a geometry line missing a coordinate"""
+        with self.assertRaises(InputCheckError) as cm:
+            check_geom(['C 1.000 2.000'])
+        the_exception = cm.exception
+        self.assertEqual(
+            the_exception.msg,
+            "Input geometry should be in cartesian format 'element x y z'."
+            )
 
     def test_bad_element(self):
         """Test a non-existant element"""
@@ -476,9 +585,7 @@ class TestControlMods(unittest.TestCase):
         self.job.jobtype = 'opt'
         self.job.nproc = 4
         result = [
-            '$ricore 0',
             '$parallel_parameters maxtask=10000',
-            '$paroptions ga_memperproc 900000000000000 900000000000',
             '$ricore_slave 1',
             '$disp',
         ]
@@ -492,9 +599,7 @@ class TestControlMods(unittest.TestCase):
         self.job.nproc = 4
         result = [
             '$ricore_slave 1',
-            '$ricore 0',
             '$parallel_parameters maxtask=10000',
-            '$paroptions ga_memperproc 900000000000000 900000000000',
             '$disp',
         ]
         precontrol = ['$ricore_slave 1']
@@ -507,12 +612,9 @@ class TestControlMods(unittest.TestCase):
         self.job.nproc = 1
         self.job.jobtype = 'numforce'
         result = [
-            '$maxcor 2048',
             '$parallel_parameters maxtask=10000',
-            '$paroptions ga_memperproc 900000000000000 900000000000',
             '$ri',
             '$marij',
-            '$ricore 0',
             '$ricore_slave 1'
             ]
         self.assertEqual(auto_control_mod(list(), self.job), result)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import math
+import shutil
+from collections import namedtuple
+from turbocontrol import walltime
+from turbocontrol.walltime import Runtime, fit, predict, quantile
+from turbocontrol.walltime import job_stages, job_runtimes
+from turbocontrol.results import ResultsDB
+from turbocontrol.geometry import Geometry
+from turbogo import Job
+
+#what job_runtimes reads of a turbocontrol Jobset
+Finished = namedtuple('Finished', 'job jobtype freqopt otime ftime predicted')
+
+
+def seconds(nbf, atoms):
+    """Run times the fits should recover"""
+    return 0.001 * nbf ** 2 * atoms ** 0.5
+
+
+def history(stage='opt', functional='tpss', scale=1.0, predicted=None):
+    """History rows of one processor jobs of several sizes"""
+    rows = list()
+    for atoms in [5, 10, 20]:
+        for per_atom in [10, 15, 20]:
+            nbf = atoms * per_atom
+            rows.append((stage, atoms, nbf, functional, 1, 'GA',
+                         scale * seconds(nbf, atoms), predicted and
+                         scale * seconds(nbf, atoms) / predicted))
+    return rows
+
+
+class TestWalltime(unittest.TestCase):
+    """Tests predicting run times from history"""
+
+    def test_quantile(self):
+        """Interpolated between ranks"""
+        self.assertEqual(quantile([3, 1, 2], 0.5), 2)
+        self.assertAlmostEqual(quantile(range(11), 0.95), 9.5)
+        self.assertEqual(quantile([4.0], 0.95), 4.0)
+
+    def test_fit(self):
+        """Power law in basis functions and atoms, per stage"""
+        runtimes = fit(history() + history('numforce', scale=4.0)[:3])
+        self.assertEqual(sorted(runtimes), ['opt'])
+        model = runtimes['opt']
+        self.assertEqual(model.samples, 9)
+        self.assertAlmostEqual(model.coefficients[1], 2.0)
+        self.assertAlmostEqual(model.coefficients[2], 0.5)
+        self.assertAlmostEqual(model.seconds(300, 12), seconds(300, 12))
+        self.assertEqual(model.margin, walltime.MIN_MARGIN)
+
+    def test_functional(self):
+        """Functionals with enough history get their own offset"""
+        model = fit(history() + history(functional='b3-lyp', scale=3.0))['opt']
+        self.assertAlmostEqual(model.seconds(300, 12, 'b3-lyp') /
+                               model.seconds(300, 12, 'tpss'), 3.0)
+
+    def test_margin(self):
+        """The margin covers the errors of recorded predictions"""
+        model = fit(history(predicted=2.0))['opt']
+        self.assertAlmostEqual(model.margin, 2.0)
+        self.assertEqual(model.hours(3600 * 10), 20)
+        self.assertEqual(model.hours(60), walltime.MIN_HOURS)
+        self.assertEqual(model.hours(3600 * 1000), walltime.MAX_HOURS)
+
+    def test_predict(self):
+        """Stages with a model, on the job's processors"""
+        job = Job(name='pred', jobtype='optfreq', basis='def2-SVP',
+                  freqopts='numforce+freeh', nproc=4)
+        job.geometry = Geometry.from_angstrom(['C'] * 10, [[0, 0, 0]] * 10)
+        self.assertEqual(job_stages(job), ['opt', 'numforce'])
+        runtimes = {'opt': Runtime([math.log(2.0), 1.0, 0.0])}
+        predictions = predict(job, runtimes)
+        self.assertEqual(sorted(predictions), ['opt'])
+        nbf = walltime.memplan.estimate_functions(job.geometry, job.basis)
+        self.assertAlmostEqual(predictions['opt'][0], 2.0 * nbf /
+                               walltime.Scaling().speedup(nbf, 4))
+        self.assertEqual(predictions['opt'][1], walltime.MIN_HOURS)
+
+    def test_job_runtimes(self):
+        """A row for each timed stage, with its prediction"""
+        job = Job(name='done', jobtype='optfreq', basis='def2-SVP')
+        job.geometry = Geometry.from_angstrom(['C'] * 3, [[0, 0, 0]] * 3)
+        nbf = walltime.memplan.estimate_functions(job.geometry, job.basis)
+        rows = job_runtimes(Finished(job, 'optfreq', 'numforce', 1200.0, 0,
+                                     {'opt': (1000.0, 2)}))
+        self.assertEqual(rows, [['opt', 3, nbf, 1, 'GA', 1200.0, 1000.0]])
+        rows = job_runtimes(Finished(job, 'ts', 'numforce', 100.0, 50.0, {}))
+        self.assertEqual([row[0] for row in rows], ['ts', 'numforce'])
+
+    def test_preopt(self):
+        """The pre-optimization is its own stage, at the cheap basis"""
+        job = Job(name='pre', jobtype='opt', basis='def2-TZVP',
+                  preopt='def2-SV(P)')
+        job.geometry = Geometry.from_angstrom(['C'] * 10, [[0, 0, 0]] * 10)
+        self.assertEqual(job_stages(job), ['preopt', 'opt'])
+        model = Runtime([0.0, 1.0, 0.0])
+        predictions = predict(job, {'preopt': model, 'opt': model})
+        self.assertLess(predictions['preopt'][0], predictions['opt'][0])
+        done = namedtuple('Done', Finished._fields + ('ptime',))
+        rows = job_runtimes(done(job, 'opt', None, 1200.0, 0, {}, 300.0))
+        self.assertEqual([row[0] for row in rows], ['preopt', 'opt'])
+        self.assertEqual(rows[0][2], walltime.memplan.estimate_functions(
+            job.geometry, 'def2-SV(P)'))
+        self.assertLess(rows[0][2], rows[1][2])
+
+
+class TestRuntimeHistory(unittest.TestCase):
+    """Tests keeping run times in the results database"""
+    def setUp(self):
+        os.mkdir('walltimedir')
+
+    def tearDown(self):
+        shutil.rmtree('walltimedir')
+
+    def test_history(self):
+        """Run times come back with the job's functional"""
+        db = ResultsDB(os.path.join('walltimedir', 'results.db'))
+        db.record_results([{
+            'job': ['job', 'walltimedir/job', 'tpss', 'def2-SVP', 'opt',
+                    'Opt Converged', None, 0.0],
+            'timing': [2, 1200.0, 0], 'energies': [], 'frequencies': [],
+            'thermo': [], 'runtimes': [['opt', 3, 45, 1, 'GA', 1200.0,
+                                        1000.0]]}])
+        self.assertEqual(db.runtime_history(), [
+            ('opt', 3, 45, 'tpss', 1, 'GA', 1200.0, 1000.0)])
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Bundling of small jobs into one gridengine submission. Each job is prepared
+as usual (define, control edits, its own submit script) but not submitted;
+a bundle script then runs the submit scripts of many jobs in one allocation,
+one worker per slot, each worker taking the next job nobody has claimed.
+Every job keeps its directory, startfile, timing log and outputs, and is
+tracked as bundleid.n until the runner marks it finished.
+"""
+
+import logging
+import math
+import os
+import shutil
+
+import memplan
+import turbogo_helpers
+import walltime
+
+BUNDLE_DIR = 'bundles'
+BUNDLE_SCRIPT = 'bundlescript.sge'
+BUNDLE_LIST = 'bundle_jobs'
+#what a worker runs of each job: its commands, without the queue header and
+#environment setup of its submit script, which the runner does once
+BUNDLE_BODY = 'bundlejob.sh'
+#written in a job's directory by the worker that ran it
+BUNDLE_DONE = 'bundle_done'
+#made (atomically, mkdir) by the worker claiming a job
+BUNDLE_CLAIM = '.bundle_claim'
+#jobs this size or smaller (estimated basis functions) on one slot are small
+MAX_NBF = 300
+MAX_SLOTS = 8
+BUNDLE_JOBTYPES = ['opt', 'optfreq', 'sp']
+
+RUNNER = r"""#!/bin/bash
+#$ -cwd
+#$ -V
+#$ -j y
+#$ -o {name}.stdout
+#$ -N tm.{name}
+#$ -l h_rt={rt}{vmem}
+#$ -R y
+#$ -pe {pe} {slots}
+
+source $TURBODIR/Config_turbo_env
+
+ulimit -s unlimited
+
+tm_bundle_worker() {{
+    while IFS=$'\t' read -r dir out; do
+        mkdir "$dir/{claim}" 2>/dev/null || continue
+        (cd "$dir" && bash {script} > "$out" 2>&1)
+        echo $? > "$dir/{done}"
+    done < {jobs}
+}}
+for worker in `seq {slots}`; do
+    tm_bundle_worker &
+done
+wait
+"""
+
+
+def is_small(job):
+    """True if the turbogo job is small enough to be bundled"""
+    if job.jobtype not in BUNDLE_JOBTYPES or job.nproc != 1:
+        return False
+    if getattr(job, 'autoproc', False) or getattr(job, 'freqjobs', None):
+        return False
+    return memplan.estimate_functions(job.geometry, job.basis) <= MAX_NBF
+
+
+def _hours(rt):
+    """Hours of a h_rt value such as 168:00:00"""
+    try:
+        return int(str(rt).split(':')[0])
+    except ValueError:
+        return 0
+
+
+def member_hours(jobset):
+    """
+    Hours a bundled jobset is expected to run: the h_rt predicted for the
+    stage it runs (see turbocontrol.walltime), or else its h_rt.
+    """
+    predicted = getattr(jobset, 'predicted', None) or dict()
+    if getattr(jobset, 'stage', None) == 'preopt':
+        stage = 'preopt'
+    else:
+        stage = walltime.stage_of(jobset.job.jobtype)
+    if stage in predicted:
+        return predicted[stage][1]
+    return _hours(jobset.job.rt)
+
+
+def bundle_hours(hours, slots):
+    """
+    Walltime of a bundle of jobs of hours run on slots workers, each taking
+    the next job when it is free: the shortest of every worker running its
+    share of the longest jobs, and the longest a worker can be left with
+    (its share of the total and one more job). At most walltime.MAX_HOURS.
+    """
+    longest = max(hours) or 1
+    rounds = int(math.ceil(len(hours) / float(slots)))
+    shared = int(math.ceil(sum(hours) / float(slots) +
+                           longest * (slots - 1) / float(slots)))
+    return max(1, min(longest * rounds, shared, walltime.MAX_HOURS))
+
+
+def bundle_script(jobs, name, slots, hours=None):
+    """
+    The bundle script for turbogo jobs run on slots workers. hours are the
+    hours each job is expected to run, by default its h_rt (see
+    bundle_hours).
+    """
+    if hours is None:
+        hours = [_hours(job.rt) for job in jobs]
+    memory = max(job.memory or 0 for job in jobs)
+    vmem = ''
+    if memory:
+        vmem = '\n#$ -l h_vmem={}M'.format(memory)
+    #the workers are processes on one node, like an SMP job
+    return RUNNER.format(name=name, rt='{}:00:00'.format(
+                             bundle_hours(hours, slots)),
+                         vmem=vmem, pe=turbogo_helpers.parallel_environment(
+                             'SMP'), slots=slots, claim=BUNDLE_CLAIM,
+                         done=BUNDLE_DONE, jobs=BUNDLE_LIST,
+                         script=BUNDLE_BODY)
+
+
+def write_bundle(jobsets, topdir, number, slots=None):
+    """
+    Writes bundle number of jobsets (prepared in their indir, relative to
+    topdir) under topdir: its script and job list, clearing the markers of
+    any earlier run from the job directories. Slots default to the largest
+    node, at most MAX_SLOTS. Returns (bundle directory, script).
+    """
+    if not slots:
+        counts = [count for count, _memory in memplan.node_hosts()]
+        slots = min(MAX_SLOTS, max(counts or [MAX_SLOTS]))
+    slots = max(1, min(slots, len(jobsets)))
+    name = 'bundle-{:04d}'.format(number)
+    bundledir = os.path.join(topdir, BUNDLE_DIR, name)
+    turbogo_helpers.ensure_dir(bundledir)
+    lines = list()
+    for jobset in jobsets:
+        indir = os.path.abspath(os.path.join(topdir, jobset.indir))
+        if os.path.isdir(os.path.join(indir, BUNDLE_CLAIM)):
+            shutil.rmtree(os.path.join(indir, BUNDLE_CLAIM))
+        if os.path.isfile(os.path.join(indir, BUNDLE_DONE)):
+            os.remove(os.path.join(indir, BUNDLE_DONE))
+        lines.append('{}\t{}.stdout'.format(
+            indir, turbogo_helpers.slug(jobset.job.name)))
+    turbogo_helpers.write_file(os.path.join(bundledir, BUNDLE_LIST), lines)
+    script = bundle_script([jobset.job for jobset in jobsets], name, slots,
+                           [member_hours(jobset) for jobset in jobsets])
+    turbogo_helpers.write_file(os.path.join(bundledir, BUNDLE_SCRIPT),
+                               script.split('\n'))
+    logging.debug("Bundle {} of {} jobs on {} slots written.".format(
+        name, len(jobsets), slots))
+    return bundledir, script
+
+
+def member_id(bundleid, n):
+    """The id a job is tracked by while it runs in a bundle"""
+    return '{}.{}'.format(bundleid, n)
+
+
+def member_states(states, jobdict):
+    """
+    Adds the bundled jobs of jobdict ({id: jobset}) to queue states ({id:
+    state}, from qstat) while their bundle is in the queue and they haven't
+    been marked finished.
+    """
+    states = dict(states)
+    for jobid, job in jobdict.items():
+        if '.' not in str(jobid):
+            continue
+        bundleid = str(jobid).split('.')[0]
+        if bundleid in states and not os.path.isfile(
+                os.path.join(job.indir, BUNDLE_DONE)):
+            states[jobid] = states[bundleid]
+    return states
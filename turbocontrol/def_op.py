@@ -85,6 +85,7 @@ class Define():
         self.bparams['basis'] = job.basis
         self.eparams['charge'] = job.charge
         self.eparams['spin'] = job.spin
+        self.eparams['guess'] = getattr(job, 'guess', None)
 
         if job.ri:
             self.fparams['ri'] = True
@@ -193,6 +194,9 @@ class Define():
 
     def _electronic(self):
         """work in the MO & electronic configuration menu"""
+        if self.eparams.get('guess'):
+            self._use_guess()
+            return
         try:
 
             self.define.sendline('eht')
@@ -274,6 +278,31 @@ class Define():
         logging.debug('MO and Electronic information applied.')
 
 
+    def _use_guess(self):
+        """
+        Start from the MOs of another control file, projected onto this basis
+        (charge and occupation are taken from it), instead of an extended
+        Hueckel guess
+        """
+        try:
+            self.define.sendline('use {}'.format(self.eparams['guess']))
+            logging.debug('MOs projected from {}.'.format(
+                self.eparams['guess']))
+            out = self.define.expect([
+                'LEFT OVER FROM PREVIOUS CALCULATIONS',
+                'DO YOU REALLY WANT TO WRITE OUT NATURAL ORBITALS',
+                'GENERAL MENU'])
+            while out != 2:
+                self.define.sendline('')
+                out = self.define.expect([
+                    'LEFT OVER FROM PREVIOUS CALCULATIONS',
+                    'DO YOU REALLY WANT TO WRITE OUT NATURAL ORBITALS',
+                    'GENERAL MENU'])
+        except Exception as e:
+            raise DefineError('Error projecting MOs from {}. Error {}'.format(
+                self.eparams['guess'], e))
+        logging.debug('MO and Electronic information applied.')
+
     def _functional(self):
         """Work in the functional menu"""
         #dft
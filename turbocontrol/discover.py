@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Directory scanning for turbocontrol input discovery. Directories are listed
+with scandir where available (python 3.5+, or the scandir package), so file
+types come from the directory listing instead of a stat per entry. Turbomole
+output trees are pruned, and include/exclude globs select which files are
+candidate inputs.
+"""
+
+import os
+import stat
+from fnmatch import fnmatch
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+INPUT_EXTENSIONS = frozenset(['.in', '.gjf', '.com', '.inp', '.input'])
+
+#Directories written by Turbomole runs, never holding inputs
+PRUNE_DIRS = frozenset(['numforce', 'KraftWerk'])
+
+
+def list_dir(path):
+    """
+    Returns ([subdirs], [files]) of the names in path. Symlinked directories
+    are not listed as subdirs, as with os.walk.
+    """
+    dirs = list()
+    files = list()
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            elif entry.is_file():
+                files.append(entry.name)
+        return dirs, files
+    for name in os.listdir(path):
+        try:
+            mode = os.lstat(os.path.join(path, name)).st_mode
+        except OSError:
+            continue
+        if stat.S_ISDIR(mode):
+            dirs.append(name)
+        elif stat.S_ISREG(mode) or stat.S_ISLNK(mode):
+            files.append(name)
+    return dirs, files
+
+
+def matches(path, globs):
+    """True if path, or its last component, matches any of globs"""
+    path = os.path.normpath(path)
+    name = os.path.basename(path)
+    for glob in globs:
+        if fnmatch(path, glob) or fnmatch(name, glob):
+            return True
+    return False
+
+
+def scan_dir(path, include=None, exclude=None):
+    """
+    Returns ([subdirs], [candidates]) as paths under path. subdirs are the
+    directories still to search, candidates the files that may be inputs.
+    Turbomole output dirs, hidden dirs and anything matching an exclude glob
+    are skipped. If include globs are given, candidates must match one.
+    """
+    try:
+        dirs, files = list_dir(path)
+    except OSError:
+        return [], []
+    subdirs = list()
+    for d in sorted(dirs):
+        if d in PRUNE_DIRS or d.startswith('.'):
+            continue
+        d = os.path.join(path, d)
+        if exclude and matches(d, exclude):
+            continue
+        subdirs.append(d)
+    candidates = list()
+    for f in sorted(files):
+        if not os.path.splitext(f)[-1] in INPUT_EXTENSIONS:
+            continue
+        f = os.path.join(path, f)
+        if exclude and matches(f, exclude):
+            continue
+        if include and not matches(f, include):
+            continue
+        candidates.append(f)
+    return subdirs, candidates
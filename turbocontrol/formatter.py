@@ -1,18 +1,235 @@
 #!/usr/bin/env python
+"""
+Structure file conversion. The common conversions (xyz, sdf or mol in; mol,
+sdf, pdb or xyz out) are written here without any dependencies, with bonds
+assigned from covalent radii. Other formats go through openbabel if it is
+installed, reusing one OBConversion for a whole batch of files.
+"""
 
-import openbabel
 import argparse
+import logging
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+import molreader
+import turbogo_helpers
+
+#Covalent radii (Angstrom) for bond assignment, others use DEFAULT_RADIUS
+COVALENT_RADII = {'H': 0.31, 'B': 0.84, 'C': 0.76, 'N': 0.71, 'O': 0.66,
+                  'F': 0.57, 'Si': 1.11, 'P': 1.07, 'S': 1.05, 'Cl': 1.02,
+                  'Br': 1.20, 'I': 1.39, 'Li': 1.28, 'Na': 1.66, 'Mg': 1.41,
+                  'Al': 1.21, 'K': 2.03, 'Ca': 1.76, 'Fe': 1.32, 'Co': 1.26,
+                  'Ni': 1.24, 'Cu': 1.32, 'Zn': 1.22, 'Se': 1.20, 'Pd': 1.39,
+                  'Ag': 1.45, 'Sn': 1.39, 'Pt': 1.36, 'Au': 1.36}
+DEFAULT_RADIUS = 1.5
+BOND_TOLERANCE = 0.45
+#a cell and the half of its neighbours after it, so each pair of cells is
+#compared once
+CELL_NEIGHBOURS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                   for dz in (-1, 0, 1) if (dx, dy, dz) >= (0, 0, 0)]
+
+MOL_ATOM = ('{0:10.4f}{1:10.4f}{2:10.4f} {3:<3} 0  0  0  0  0  0  0  0  0  0'
+            '  0  0')
+MOL_BOND = '{0:3d}{1:3d}  1  0'
+PDB_ATOM = ('HETATM{0:5d} {1:<4} UNL     1    {2:8.3f}{3:8.3f}{4:8.3f}'
+            '  1.00  0.00          {5:>2}')
+
+
+def bonds(geom):
+    """
+    (i, j) atom index pairs closer than their covalent radii allow, i < j in
+    order. Atoms are binned into cells as wide as the longest bond, so only
+    atoms in the same or neighbouring cells are compared.
+    """
+    if len(geom) < 2:
+        return []
+    xyz = geom.angstrom()
+    radii = np.array([COVALENT_RADII.get(s, DEFAULT_RADIUS)
+                      for s in geom.symbols])
+    size = 2 * radii.max() + BOND_TOLERANCE
+    cells = dict()
+    for n, key in enumerate(map(tuple, np.floor(xyz / size).astype(int))):
+        cells.setdefault(key, list()).append(n)
+    cells = dict((key, np.array(atoms)) for key, atoms in cells.items())
+    pairs = list()
+    for (x, y, z), a in cells.items():
+        for dx, dy, dz in CELL_NEIGHBOURS:
+            b = cells.get((x + dx, y + dy, z + dz))
+            if b is None:
+                continue
+            dist = np.sqrt(((xyz[a][:, None, :] - xyz[b][None, :, :]) ** 2)
+                           .sum(axis=2))
+            limit = radii[a][:, None] + radii[b][None, :] + BOND_TOLERANCE
+            close = (dist < limit) & (dist > 0.1)
+            if (dx, dy, dz) == (0, 0, 0):
+                close = np.triu(close, 1)
+            i, j = np.nonzero(close)
+            pairs.extend(zip(a[i].tolist(), b[j].tolist()))
+    return sorted((min(i, j), max(i, j)) for i, j in pairs)
+
+
+def mol_lines(title, geom):
+    """V2000 molfile block (without the $$$$ terminator) as a list of lines"""
+    pairs = bonds(geom)
+    lines = [title, '  turbocontrol', '',
+             '{0:3d}{1:3d}  0  0  0  0  0  0  0  0999 V2000'.format(
+                 len(geom), len(pairs))]
+    lines.extend([MOL_ATOM.format(x, y, z, s) for (x, y, z), s in
+                  zip(geom.angstrom().tolist(), geom.symbols)])
+    lines.extend([MOL_BOND.format(i + 1, j + 1) for i, j in pairs])
+    lines.append('M  END')
+    return lines
+
+
+def pdb_lines(geom):
+    """PDB HETATM records for the geometry as a list of lines"""
+    lines = list()
+    counts = dict()
+    for n, ((x, y, z), s) in enumerate(zip(geom.angstrom().tolist(),
+                                           geom.symbols)):
+        counts[s] = counts.get(s, 0) + 1
+        name = '{}{}'.format(s, counts[s])[:4]
+        lines.append(PDB_ATOM.format(n + 1, name, x, y, z, s.upper()))
+    return lines
+
+
+def write_mol(records, outfile):
+    """Writes the first record as a molfile"""
+    for title, geom in records:
+        turbogo_helpers.write_file(outfile, mol_lines(title, geom))
+        return
+
+
+def write_sdf(records, outfile):
+    """Writes every record to an sdf file"""
+    lines = list()
+    for title, geom in records:
+        lines.extend(mol_lines(title, geom))
+        lines.append('$$$$')
+    turbogo_helpers.write_file(outfile, lines)
+
+
+def write_pdb(records, outfile):
+    """Writes the records to a pdb file, one MODEL each if more than one"""
+    records = list(records)
+    lines = list()
+    for n, (title, geom) in enumerate(records):
+        if title:
+            lines.append('COMPND    {}'.format(title))
+        if len(records) > 1:
+            lines.append('MODEL     {0:4d}'.format(n + 1))
+        lines.extend(pdb_lines(geom))
+        if len(records) > 1:
+            lines.append('ENDMDL')
+    lines.append('END')
+    turbogo_helpers.write_file(outfile, lines)
+
+
+def write_xyz(records, outfile):
+    """Writes the records as a multi-frame xyz file"""
+    lines = list()
+    for title, geom in records:
+        lines.extend(geom.xyz_lines(title))
+    turbogo_helpers.write_file(outfile, lines)
+
+
+WRITERS = {'mol': write_mol, 'sdf': write_sdf, 'sd': write_sdf,
+           'pdb': write_pdb, 'xyz': write_xyz}
+
+
+def native(intype, outtype):
+    """True if intype to outtype is converted without openbabel"""
+    return '.' + intype in molreader.READERS and outtype in WRITERS
+
+
+def native_convert(infile, outfile, intype='xyz', outtype='mol'):
+    """Converts infile to outfile with the built in readers and writers"""
+    try:
+        f = open(infile, 'r')
+    except (OSError, IOError) as e:
+        raise turbogo_helpers.FileAccessError(
+            "Error reading file {}.".format(infile), e)
+    with f:
+        WRITERS[outtype](molreader.READERS['.' + intype](f), outfile)
+
+
+class Converter(object):
+    """
+    Converts files, built in where possible and otherwise with one openbabel
+    OBConversion kept for every file converted.
+    """
+
+    def __init__(self):
+        self.conv = None
+
+    def obconversion(self):
+        """The shared OBConversion. Raises ImportError without openbabel."""
+        if self.conv is None:
+            import openbabel
+            self.conv = openbabel.OBConversion()
+        return self.conv
+
+    def convert(self, infile, outfile, intype='xyz', outtype='mol'):
+        """Converts infile from intype to outtype. Returns True on success."""
+        try:
+            if native(intype, outtype):
+                native_convert(infile, outfile, intype, outtype)
+                return True
+            conv = self.obconversion()
+            if not conv.SetInAndOutFormats(intype, outtype):
+                raise ValueError("openbabel can't convert {} to {}".format(
+                    intype, outtype))
+            conv.OpenInAndOutFiles(infile, outfile)
+            conv.Convert()
+            conv.CloseOutFile()
+        except ImportError:
+            logging.warning("openbabel is needed to convert {} to {}.".format(
+                intype, outtype))
+            return False
+        except Exception as e:
+            logging.warning("Error {} converting {}.".format(e, infile))
+            return False
+        return True
+
+
+#per process converter, for convert_filetype and pool workers
+_converter = Converter()
+
 
 def convert_filetype(infile, outfile, intype='xyz', outtype='mol'):
     """Converts infile from intype (default xyz) to outtype (default mol)"""
-    try:
-        conv = openbabel.OBConversion()
-        conv.OpenInAndOutFiles(infile, outfile)
-        conv.SetInAndOutFormats(intype, outtype)
-        conv.Convert()
-        conv.CloseOutFile()
-    except Exception as e:
-        print "Error {}.".format(e)
+    return _converter.convert(infile, outfile, intype, outtype)
+
+
+def _convert_one(args):
+    """Pool worker: (infile, success)"""
+    return args[0], _converter.convert(*args)
+
+
+def convert_files(infiles, outtype='mol', intype=None, workers=1):
+    """
+    Converts each of infiles to a file of the same name with the outtype
+    extension. intype defaults to each file's extension. Returns the list of
+    files that failed.
+    """
+    tasks = list()
+    for infile in infiles:
+        base, ext = os.path.splitext(infile)
+        tasks.append((infile, base + '.' + outtype,
+                      intype or ext.lstrip('.').lower(), outtype))
+    if workers > 1 and len(tasks) > 1:
+        pool = Pool(workers)
+        try:
+            done = list(pool.imap_unordered(_convert_one, tasks, chunksize=16))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        done = [_convert_one(task) for task in tasks]
+    return sorted(infile for infile, success in done if not success)
+
 
 def main():
     parser = argparse.ArgumentParser("Usage: %prog [options]")
@@ -20,21 +237,14 @@ def main():
                         help="Read input from input FILE")
     parser.add_argument('outfile',
                         help='Write output to output FILE')
-    parser.add_argument('-i', '--informat',
+    parser.add_argument('-i', '--informat', default='xyz',
                         help="Read input format from file. Default .xyz")
-    parser.add_argument('-o', '--outformat',
+    parser.add_argument('-o', '--outformat', default='mol',
                         help="Write output format to file. Default .mol")
     args = parser.parse_args()
-    if args.informat:
-        if args.outformat:
-            convert_filetype(args.infile, args.outfile, intype=args.informat,
-                             outtype=args.outformat)
-        else:
-            convert_filetype(args.infile, args.outfile, intype=args.informat)
-    elif args.outformat:
-        convert_filetype(args.infile, args.outfile, outtype=args.outformat)
-    else:
-        convert_filetype(args.infile, args.outfile)
+    if not convert_filetype(args.infile, args.outfile, intype=args.informat,
+                            outtype=args.outformat):
+        print "Error converting {}.".format(args.infile)
     exit()
 
 
@@ -6,9 +6,9 @@ This will work through freeh and get energies back, at standard or alternate
 pressures, tempearatures, or other modifiable environments.
 """
 
-import pexpect  # pragma: no cover
 import logging
 import os
+import numpy as np
 import turbogo_helpers
 
 TURBODIR=os.getenv('TURBODIR')
@@ -17,6 +17,9 @@ if TURBODIR:
 else:
     TURBOSCRIPT = ''
 
+FREEH_COLUMNS = turbogo_helpers.FREEH_COLUMNS
+
+
 class Error(Exception):
     """Base class for exceptions in this module."""
     pass
@@ -125,6 +128,7 @@ class Freeh():
         """
         Runs freeh
         """
+        import pexpect  # pragma: no cover
         try:
             self.freeh = pexpect.spawn("freeh")
         except Exception as e:
@@ -171,68 +175,134 @@ class Freeh():
         self.freeh.sendline('q')
 
 
-def proc_freeh(freehfile = ''):
-    """Process the freeh output file & return dict of params and data"""
-    if not freehfile:
-        freehfile = 'freeh'
+class FreehData(object):
+    """
+    Thermochemistry read from freeh output. zpe is in kJ/mol, the rest are
+    float64 arrays with one entry per (T, p) point of the freeh grid: t (K),
+    p (MPa), qtrans, qrot, qvib (ln q), pot (chemical potential), eng and enth
+    (kJ/mol), entr, cv and cp (kJ/mol/K). Values freeh didn't print are nan.
+    """
+    __slots__ = ('zpe',) + FREEH_COLUMNS
+
+    def __init__(self, zpe=np.nan, **columns):
+        self.zpe = zpe
+        npoints = len(columns.get('t', []))
+        for col in FREEH_COLUMNS:
+            value = columns.get(col)
+            if value is None:
+                value = np.full(npoints, np.nan)
+            setattr(self, col, np.asarray(value, dtype=np.float64))
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return len(self.t)
+
+
+def _table(lines, start):
+    """
+    Reads the numeric rows of a freeh table, skipping the header lines from
+    start up to the first row. Each line is split once. Returns (rows, next
+    line index), rows padded with nan to the widest row.
+    """
+    i = start
+    while i < len(lines):
+        fields = lines[i].split()
+        if fields and turbogo_helpers.is_float(fields[0]):
+            break
+        i += 1
+    rows = list()
+    while i < len(lines):
+        fields = lines[i].split()
+        if not fields:
+            break
+        try:
+            rows.append([float(f) for f in fields])
+        except ValueError:
+            break
+        i += 1
+    width = max([len(row) for row in rows] or [0])
+    table = np.full((len(rows), width), np.nan)
+    for n, row in enumerate(rows):
+        table[n, :len(row)] = row
+    return table, i
+
+
+def _column(table, n):
+    """Column n of table, nan if the table is narrower"""
+    if table.shape[1] > n:
+        return table[:, n]
+    return np.full(table.shape[0], np.nan)
+
+
+def read_freeh(freehfile='freeh'):
+    """
+    Reads freeh output. Returns (params, FreehData), params being the dict of
+    the pressure and temperature range strings, or (None, None) if the file
+    holds no freeh results. The Cv/Cp/enthalpy rows are matched to the first
+    table by (T, p), so missing rows or columns are left nan.
+    """
     fh = turbogo_helpers.read_clean_file(freehfile)
-    params = dict()
-    data = dict()
-    lstart = 0
-    for i in range(0, len(fh)):
+    lstart = None
+    for i in range(len(fh)):
         if 'your wishes are :' in fh[i]:
             lstart = i
-    if lstart == 0:
+    if lstart is None:
         logging.warn("Can't find freeh info in {}.".format(freehfile))
         return None, None
-    params['pstart'] = fh[lstart+3].strip().split()[1]
-    params['pend'] = fh[lstart+3].strip().split()[3]
-    params['nump'] = fh[lstart+3].strip().split()[5]
-    params['tstart'] = fh[lstart+5].strip().split()[1]
-    params['tend'] = fh[lstart+5].strip().split()[3]
-    params['numt'] = fh[lstart+5].strip().split()[5]
-
-    data['zpe'] = fh[lstart+9].strip().split()[1]
-    data['t'] = list()
-    data['p'] = list()
-    data['qtrans'] = list()
-    data['qrot'] = list()
-    data['qvib'] = list()
-    data['pot'] = list()
-    data['eng'] = list()
-    data['entr'] = list()
-    data['enth'] = list()
-    data['cv'] = list()
-    data['cp'] = list()
-
-    dataline = lstart + 14
-    line = fh[dataline]
-
-    while line.strip() != '':
-        data['t'].append(line.strip().split()[0])
-        data['p'].append(line.strip().split()[1])
-        data['qtrans'].append(line.strip().split()[2])
-        data['qrot'].append(line.strip().split()[3])
-        data['qvib'].append(line.strip().split()[4])
-        data['pot'].append(line.strip().split()[5])
-        data['eng'].append(line.strip().split()[6])
-        data['entr'].append(line.strip().split()[7])
-        dataline += 1
-        line = fh[dataline]
-
-    dataline += 3
-    line = fh[dataline]
-    while line.strip() != '':
-        data['cv'].append(line.strip().split()[2])
-        data['cp'].append(line.strip().split()[3])
-        try:
-            data['enth'].append(line.strip().split()[4])
-        except IndexError:
-            data['enth'].append('')
-        dataline += 1
-        line = fh[dataline]
 
-    return params, data
+    params = dict()
+    zpe = np.nan
+    first = second = None
+    i = lstart
+    while i < len(fh):
+        line = fh[i]
+        if line.startswith('pstart='):
+            fields = line.split()
+            params['pstart'], params['pend'], params['nump'] = fields[1:6:2]
+        elif line.startswith('tstart='):
+            fields = line.split()
+            params['tstart'], params['tend'], params['numt'] = fields[1:6:2]
+        elif line.startswith('zpe='):
+            zpe = float(line.split()[1])
+        elif 'chem.pot.' in line and first is None:
+            first, i = _table(fh, i + 1)
+            continue
+        elif 'enthalpy' in line and first is not None and second is None:
+            second, i = _table(fh, i + 1)
+            continue
+        i += 1
+
+    if first is None:
+        logging.warn("Can't find freeh data in {}.".format(freehfile))
+        return None, None
+    columns = dict(zip(FREEH_COLUMNS[:8],
+                       [_column(first, n) for n in range(8)]))
+    if second is not None:
+        if (second.shape[0] == first.shape[0] and
+                np.array_equal(second[:, :2], first[:, :2])):
+            index = np.arange(first.shape[0])
+        else:
+            #rows missing: match on (T, p)
+            points = dict(((t, p), n) for n, (t, p) in
+                          enumerate(second[:, :2].tolist()))
+            index = np.array([points.get((t, p), -1) for t, p in
+                              first[:, :2].tolist()], dtype=int)
+        for col, n in [('cv', 2), ('cp', 3), ('enth', 4)]:
+            values = np.append(_column(second, n), np.nan)
+            columns[col] = values[index]
+    return params, FreehData(zpe, **columns)
+
+
+def proc_freeh(freehfile = ''):
+    """Process the freeh output file & return dict of params and FreehData"""
+    if not freehfile:
+        freehfile = 'freeh'
+    return read_freeh(freehfile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Compact molecular geometry storage for turbogo jobs. Coordinates are held as a
+float64 (N,3) array in Bohr with a matching array of element indices, so jobs
+stay small when the controller holds thousands of them, and the $coord and
+xyz files are written without touching the stored data.
+"""
+
+import numpy as np
+
+BOHR = 0.52917720859
+
+ELEMENTS = ['Ac', 'Ag', 'Al', 'Am', 'Ar', 'As', 'At', 'Au', 'B', 'Ba', 'Be',
+            'Bh', 'Bi', 'Bk', 'Br', 'C', 'Ca', 'Cd', 'Ce', 'Cf', 'Cl', 'Cm',
+            'Cn', 'Co', 'Cr', 'Cs', 'Cu', 'Db', 'Ds', 'Dy', 'Er', 'Es', 'Eu',
+            'F', 'Fe', 'Fl', 'Fm', 'Fr', 'Ga', 'Gd', 'Ge', 'H', 'He', 'Hf',
+            'Hg', 'Ho', 'Hs', 'I', 'In', 'Ir', 'K', 'Kr', 'La', 'Li', 'Lr',
+            'Lu', 'Lv', 'Md', 'Mg', 'Mn', 'Mo', 'Mt', 'N', 'Na', 'Nb', 'Nd',
+            'Ne', 'Ni', 'No', 'Np', 'O', 'Os', 'P', 'Pa', 'Pb', 'Pd', 'Pm',
+            'Po', 'Pr', 'Pt', 'Pu', 'Ra', 'Rb', 'Re', 'Rf', 'Rg', 'Rh', 'Rn',
+            'Ru', 'S', 'Sb', 'Sc', 'Se', 'Sg', 'Si', 'Sm', 'Sn', 'Sr', 'Ta',
+            'Tb', 'Tc', 'Te', 'Th', 'Ti', 'Tl', 'Tm', 'U', 'Uuo', 'Uup', 'Uus',
+            'Uut', 'V', 'W', 'Xe', 'Y', 'Yb', 'Zn', 'Zr']
+
+#symbol -> index into ELEMENTS
+ELEMENT_INDEX = dict((e, i) for i, e in enumerate(ELEMENTS))
+
+COORD_FORMAT = '{0:20.14f}{1:22.14f}{2:22.14f}      {3}'
+XYZ_FORMAT = '{3:<3} {0:14.8f} {1:14.8f} {2:14.8f}'
+
+
+class Geometry(object):
+    """
+    Atoms of a molecule. coords is a read-only float64 (N,3) array in Bohr,
+    elements a uint8 array of indices into ELEMENTS.
+    """
+    __slots__ = ('coords', 'elements')
+
+    def __init__(self, elements=None, coords=None):
+        if elements is None:
+            elements = []
+        if coords is None:
+            coords = np.zeros((0, 3))
+        self.elements = np.array(elements, dtype=np.uint8)
+        self.coords = np.array(coords, dtype=np.float64).reshape(-1, 3)
+        if len(self.elements) != len(self.coords):
+            raise ValueError('{} elements given for {} coordinates.'.format(
+                len(self.elements), len(self.coords)))
+        self.elements.flags.writeable = False
+        self.coords.flags.writeable = False
+
+    @classmethod
+    def from_angstrom(cls, symbols, coords):
+        """Build a geometry from element symbols and coordinates in Angstrom"""
+        elements = [ELEMENT_INDEX[s] for s in symbols]
+        return cls(elements, np.asarray(coords, dtype=np.float64) / BOHR)
+
+    @classmethod
+    def from_coord_lines(cls, lines):
+        """Build a geometry from the rows of a Turbomole $coord block (Bohr,
+        x y z element), skipping $ lines"""
+        elements = list()
+        coords = list()
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 4 or fields[0].startswith('$'):
+                continue
+            elements.append(ELEMENT_INDEX[fields[3].capitalize()])
+            coords.append([float(f) for f in fields[:3]])
+        return cls(elements, coords)
+
+    def __getstate__(self):
+        return self.elements, self.coords
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __eq__(self, other):
+        if not isinstance(other, Geometry):
+            return NotImplemented
+        return (np.array_equal(self.elements, other.elements) and
+                np.array_equal(self.coords, other.coords))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    @property
+    def symbols(self):
+        """Element symbols, in atom order"""
+        return [ELEMENTS[i] for i in self.elements]
+
+    def angstrom(self):
+        """Returns a new (N,3) array of the coordinates in Angstrom"""
+        return self.coords * BOHR
+
+    def coord_lines(self):
+        """Returns the Turbomole $coord block (Bohr) as a list of lines"""
+        lines = ['$coord']
+        lines.extend(_format_rows(COORD_FORMAT, self.coords,
+                                  [s.lower() for s in self.symbols]))
+        lines.append('$end')
+        return lines
+
+    def xyz_lines(self, title=''):
+        """Returns the geometry in xyz format (Angstrom) as a list of lines"""
+        lines = [str(len(self)), title]
+        lines.extend(_format_rows(XYZ_FORMAT, self.angstrom(), self.symbols))
+        return lines
+
+
+def _format_rows(fmt, coords, symbols):
+    """Formats each coordinate row with its symbol"""
+    return [fmt.format(x, y, z, s)
+            for (x, y, z), s in zip(coords.tolist(), symbols)]
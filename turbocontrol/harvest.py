@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+"""
+Bulk harvester for completed job trees. Every job directory (one holding a
+control file) under the top directory is read with the same parsers used
+while watching jobs: energy, control spectrum, output file timings, freeh
+output and the cycle times used by the nproc policy. Directories are read
+by a pool of worker processes, and the results written as one table (csv,
+plus a numpy .npz of columns) and recorded in the results database.
+
+A manifest of directory fingerprints (size and mtime of the files read) is
+kept next to the tree, so harvesting again only reads directories that
+changed.
+"""
+
+import cPickle as pickle
+import csv
+import logging
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import discover
+import formatter
+import trajectory
+import turbogo_helpers
+from freeh_op import read_freeh
+from results import ResultsDB, RESULTS_DB, thermo_rows, job_directory
+from scaling import job_scaling
+
+MANIFEST = '.harvest_manifest'
+MANIFEST_VERSION = 2
+
+#files read from a job directory, and so fingerprinted
+OPT_OUTPUTS = ['opt.out', 'ts.out', 'sp.out']
+FREQ_OUTPUTS = ['numforce.out', 'aoforce.out']
+HARVEST_FILES = (['control', 'energy', 'startfile', 'GEO_OPT_CONVERGED',
+                  'freeh', os.path.join('numforce', 'control'),
+                  os.path.join('numforce', 'freeh'), 'timing.log',
+                  'submitscript.sge']
+                 + OPT_OUTPUTS + FREQ_OUTPUTS)
+
+#Turbomole output dirs, and the pre-optimizations of %preopt jobs, which
+#hold control files of their own
+PRUNE_DIRS = discover.PRUNE_DIRS | frozenset([turbogo_helpers.PREOPT_DIR])
+
+COLUMNS = ['directory', 'name', 'functional', 'basis', 'jobtype', 'status',
+           'opt_steps', 'energy', 'opt_time', 'freq_time', 'first_freq',
+           'n_imaginary', 'zpe', 't', 'p', 'pot', 'eng', 'entr', 'cv', 'cp',
+           'enth']
+TEXT_COLUMNS = ['directory', 'name', 'functional', 'basis', 'jobtype',
+                'status']
+
+
+def find_job_dirs(top):
+    """
+    Returns every directory under top holding a control file. Turbomole output,
+    pre-optimization and hidden dirs are pruned.
+    """
+    jobdirs = list()
+    level = [top]
+    while level:
+        nextlevel = list()
+        for d in level:
+            try:
+                dirs, files = discover.list_dir(d)
+            except OSError:
+                continue
+            if 'control' in files:
+                jobdirs.append(d)
+            for sub in sorted(dirs):
+                if not sub in PRUNE_DIRS and not sub.startswith('.'):
+                    nextlevel.append(os.path.join(d, sub))
+        level = nextlevel
+    return sorted(jobdirs)
+
+
+def fingerprint(indir):
+    """(file, size, mtime) of each harvested file present in indir"""
+    prints = list()
+    for f in HARVEST_FILES:
+        try:
+            st = os.stat(os.path.join(indir, f))
+        except OSError:
+            continue
+        prints.append((f, st.st_size, st.st_mtime))
+    return tuple(prints)
+
+
+def _first(indir, names):
+    """The first of names present in indir, or None"""
+    for name in names:
+        if os.path.isfile(os.path.join(indir, name)):
+            return name
+    return None
+
+
+def job_input(indir):
+    """
+    The name of the input file the job in indir was run from: the input in
+    indir, or for a numbered job dir (top/stem/0001) of a multi-job input or
+    --source file, the file named stem in top. None if it can't be found.
+    """
+    infiles = discover.scan_dir(indir)[1]
+    if infiles:
+        return os.path.basename(infiles[0])
+    parent = os.path.dirname(os.path.normpath(indir))
+    if not os.path.basename(os.path.normpath(indir)).isdigit() or not parent:
+        return None
+    stem = os.path.basename(parent)
+    try:
+        files = discover.list_dir(os.path.dirname(parent) or os.curdir)[1]
+    except OSError:
+        return None
+    for f in sorted(files):
+        if os.path.splitext(f)[0] == stem:
+            return f
+    return None
+
+
+def harvest_dir(indir):
+    """
+    Reads the results of the job in indir. Returns a dict of rows for each
+    results database table, as results.job_results does.
+    """
+    title, functional, basis = turbogo_helpers.read_method(
+        os.path.join(indir, 'control'))
+    directory = job_directory(indir, job_input(indir))
+
+    try:
+        energies = turbogo_helpers.read_energies(os.path.join(indir, 'energy'))
+    except turbogo_helpers.FileAccessError:
+        energies = list()
+
+    if os.path.isdir(os.path.join(indir, 'numforce')):
+        freqdir = os.path.join(indir, 'numforce')
+    else:
+        freqdir = indir
+    try:
+        spectrum = turbogo_helpers.read_spectrum(
+            os.path.join(freqdir, 'control'))
+    except turbogo_helpers.FileAccessError:
+        spectrum = list()
+
+    optout = _first(indir, OPT_OUTPUTS)
+    freqout = _first(indir, FREQ_OUTPUTS)
+    opttime = freqtime = 0
+    if optout and os.path.isfile(os.path.join(indir, 'startfile')):
+        opttime = turbogo_helpers.get_calc_time(indir, optout) or 0
+    if freqout and os.path.isfile(os.path.join(indir, 'startfile')):
+        freqtime = turbogo_helpers.get_calc_time(indir, freqout) or 0
+    jobtype = None
+    if optout:
+        jobtype = optout.split('.')[0]
+        if freqout and jobtype == 'opt':
+            jobtype = 'optfreq'
+    elif freqout:
+        jobtype = freqout.split('.')[0]
+
+    if os.path.isfile(os.path.join(indir, 'GEO_OPT_CONVERGED')):
+        status = 'Opt Converged'
+    elif optout == 'opt.out' or optout == 'ts.out':
+        status = 'Opt Not Converged'
+    else:
+        status = 'Harvested'
+
+    data = None
+    freehfile = os.path.join(freqdir, 'freeh')
+    if os.path.isfile(freehfile):
+        try:
+            _params, data = read_freeh(freehfile)
+        except Exception as e:
+            logging.warning("Error {} reading {}.".format(e, freehfile))
+
+    return {
+        'job': [title or os.path.basename(os.path.abspath(indir)), directory,
+                functional, basis, jobtype, status,
+                spectrum[0][1] if spectrum else None, time.time()],
+        'timing': [energies[-1][0] if energies else None, opttime, freqtime],
+        'energies': energies,
+        'frequencies': spectrum,
+        'thermo': thermo_rows(data),
+        'scaling': job_scaling(indir),
+        }
+
+
+def _harvest_one(indir):
+    """Pool worker: (indir, result or None, error)"""
+    try:
+        return indir, harvest_dir(indir), None
+    except Exception as e:
+        return indir, None, str(e) or repr(e)
+
+
+def table_row(result):
+    """Flattens a harvested result into a row of COLUMNS"""
+    name = result['job'][0]
+    directory = result['job'][1]
+    functional, basis, jobtype, status, first_freq = result['job'][2:7]
+    opt_steps, opt_time, freq_time = result['timing']
+    energy = result['energies'][-1][1] if result['energies'] else None
+    n_imaginary = len([f for _m, f in result['frequencies'] if f < 0])
+    thermo = result['thermo'][0] if result['thermo'] else [None] * 12
+    return ([directory, name, functional, basis, jobtype, status, opt_steps,
+             energy, opt_time, freq_time, first_freq, n_imaginary] +
+            [thermo[0], thermo[1], thermo[2]] + list(thermo[6:12]))
+
+
+def load_manifest(filename):
+    """{dir: (fingerprint, result)} from an earlier harvest, or empty"""
+    try:
+        with open(filename, 'rb') as f:
+            version, manifest = pickle.load(f)
+    except (IOError, OSError):
+        return dict()
+    except Exception as e:
+        logging.warning("Harvest manifest {} unreadable ({}). Rebuilding."
+                        .format(filename, e))
+        return dict()
+    if version != MANIFEST_VERSION:
+        return dict()
+    return manifest
+
+
+def save_manifest(filename, manifest):
+    """Writes the manifest"""
+    tmpfile = filename + '.tmp'
+    try:
+        with open(tmpfile, 'wb') as f:
+            pickle.dump((MANIFEST_VERSION, manifest), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfile, filename)
+    except (IOError, OSError) as e:
+        logging.warning("Error {} writing harvest manifest.".format(e))
+
+
+def write_csv(filename, rows):
+    """Writes the table as csv"""
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(['' if v is None else v for v in row])
+
+
+def write_columns(filename, rows):
+    """Writes the table as a numpy .npz of one array per column"""
+    columns = dict()
+    for i, col in enumerate(COLUMNS):
+        values = [row[i] for row in rows]
+        if col in TEXT_COLUMNS:
+            columns[col] = np.array(['' if v is None else v for v in values],
+                                    dtype=str)
+        else:
+            columns[col] = np.array([np.nan if v is None else v
+                                     for v in values], dtype=np.float64)
+    np.savez(filename, **columns)
+
+
+def _stale(indir, target, sources):
+    """
+    True if target in indir is missing or older than any of the sources
+    present. False if none of the sources are present.
+    """
+    mtimes = list()
+    for f in sources:
+        try:
+            mtimes.append(os.stat(os.path.join(indir, f)).st_mtime)
+        except OSError:
+            pass
+    if not mtimes:
+        return False
+    try:
+        return os.stat(os.path.join(indir, target)).st_mtime < max(mtimes)
+    except OSError:
+        return True
+
+
+def convert_geometries(jobdirs, outtype, workers=1):
+    """
+    Converts the final geometry of each of jobdirs to outtype, where the
+    converted file is missing or older. Returns the number converted.
+    """
+    target = os.path.splitext(trajectory.FINAL_XYZ)[0] + '.' + outtype
+    infiles = [os.path.join(d, trajectory.FINAL_XYZ) for d in jobdirs
+               if _stale(d, target, [trajectory.FINAL_XYZ])]
+    failed = formatter.convert_files(infiles, outtype, workers=workers)
+    for infile in failed:
+        logging.warning("Couldn't convert {} to {}.".format(infile, outtype))
+    return len(infiles) - len(failed)
+
+
+def harvest(top=os.curdir, workers=1, output='harvest', rescan=False,
+            database=RESULTS_DB, convert=None, xyz=False, merge=None):
+    """
+    Harvests every job directory under top. Writes output.csv and output.npz,
+    and records changed directories in the database (None to skip). With xyz,
+    the trajectory and final geometry xyz files are written where missing or
+    out of date. If convert is a format, final geometries are converted to it,
+    and merge is a file to write all the final geometries to. Returns the
+    table rows.
+    """
+    manifestfile = os.path.join(top, MANIFEST)
+    manifest = dict() if rescan else load_manifest(manifestfile)
+    jobdirs = find_job_dirs(top)
+
+    prints = dict()
+    changed = list()
+    for d in jobdirs:
+        prints[d] = fingerprint(d)
+        if d not in manifest or manifest[d][0] != prints[d]:
+            changed.append(d)
+    logging.info("{} job directories found, {} to read.".format(
+        len(jobdirs), len(changed)))
+
+    if workers > 1 and len(changed) > 1:
+        pool = Pool(workers)
+        try:
+            harvested = list(pool.imap_unordered(_harvest_one, changed,
+                                                 chunksize=16))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        harvested = [_harvest_one(d) for d in changed]
+
+    fresh = list()
+    for d, result, error in harvested:
+        if error:
+            logging.warning("Error {} harvesting {}.".format(error, d))
+            manifest.pop(d, None)
+            continue
+        manifest[d] = (prints[d], result)
+        fresh.append(result)
+    for d in list(manifest):
+        if d not in prints:
+            del manifest[d]
+    save_manifest(manifestfile, manifest)
+
+    if database and fresh:
+        db = ResultsDB(os.path.join(top, database))
+        db.record_results(fresh)
+        db.close()
+
+    if xyz:
+        written = [d for d in jobdirs if _stale(d, trajectory.FINAL_XYZ,
+                                                ['coord', 'gradient'])]
+        failed = trajectory.write_all(written, workers)
+        logging.info("xyz files written for {} jobs.".format(
+            len(written) - len(failed)))
+    if merge:
+        merged = trajectory.merge_final(
+            [d for d in jobdirs if os.path.isfile(os.path.join(d, 'coord'))],
+            merge, workers)
+        logging.info("{} final geometries written to {}.".format(
+            merged, merge))
+    if convert:
+        converted = convert_geometries(jobdirs, convert, workers)
+        logging.info("{} final geometries converted to {}.".format(
+            converted, convert))
+
+    rows = [table_row(manifest[d][1]) for d in jobdirs if d in manifest]
+    write_csv(output + '.csv', rows)
+    write_columns(output + '.npz', rows)
+    logging.info("{} jobs harvested to {}.csv and {}.npz.".format(
+        len(rows), output, output))
+    return rows
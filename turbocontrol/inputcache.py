@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Discovery cache for turbocontrol. Keeps the result of checking each input file
+(the parsed jobs, or the validation error) keyed on its path, and reuses it on
+later scans while the file's size and content hash are unchanged. An
+unchanged mtime is trusted without re-reading the file.
+"""
+
+import cPickle as pickle
+import hashlib
+import logging
+import os
+
+CACHEFILE = '.turbocontrol_cache'
+#bumped whenever the parsed Job changes
+CACHE_VERSION = 7
+
+
+def file_digest(path):
+    """sha1 hex digest of the file contents"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class InputCache(object):
+    """
+    Cache of input file check results, persisted to filename. Entries map a
+    path to (mtime, size, digest, result).
+    """
+
+    def __init__(self, filename=CACHEFILE):
+        self.filename = filename
+        self.entries = dict()
+        self.changed = False
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        """Reads the cache file. A missing, stale or unreadable cache is
+        started fresh."""
+        try:
+            with open(self.filename, 'rb') as f:
+                version, entries = pickle.load(f)
+        except (IOError, OSError):
+            logging.debug('No input cache at {}.'.format(self.filename))
+            return
+        except Exception as e:
+            logging.warning('Input cache {} unreadable ({}). Rebuilding.'
+                            .format(self.filename, e))
+            return
+        if version != CACHE_VERSION:
+            logging.info('Input cache {} is from another version. Rebuilding.'
+                         .format(self.filename))
+            return
+        self.entries = entries
+        logging.debug('{} cached inputs loaded from {}.'.format(
+            len(entries), self.filename))
+
+    def lookup(self, path):
+        """
+        Returns (result, stamp). result is the cached result, or None if path
+        isn't cached or changed. stamp identifies the file as it is now, and
+        is passed to store with the new result on a miss.
+        """
+        st = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None:
+            mtime, size, digest, result = entry
+            if size == st.st_size:
+                if mtime == st.st_mtime:
+                    self.hits += 1
+                    return result, entry[:3]
+                newdigest = file_digest(path)
+                if newdigest == digest:
+                    #touched but not changed
+                    self.entries[path] = (st.st_mtime, size, digest, result)
+                    self.changed = True
+                    self.hits += 1
+                    return result, (st.st_mtime, size, digest)
+                self.misses += 1
+                return None, (st.st_mtime, st.st_size, newdigest)
+        self.misses += 1
+        return None, (st.st_mtime, st.st_size, file_digest(path))
+
+    def store(self, path, stamp, result):
+        """Caches result for path as it was when stamp was taken"""
+        self.entries[path] = tuple(stamp) + (result,)
+        self.changed = True
+
+    def prune(self, paths):
+        """Drops entries for files no longer in paths"""
+        paths = set(paths)
+        for path in list(self.entries):
+            if path not in paths:
+                del self.entries[path]
+                self.changed = True
+
+    def save(self):
+        """Writes the cache file, if anything changed"""
+        if not self.changed:
+            return
+        tmpfile = self.filename + '.tmp'
+        try:
+            with open(tmpfile, 'wb') as f:
+                pickle.dump((CACHE_VERSION, self.entries), f,
+                            pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpfile, self.filename)
+        except (IOError, OSError) as e:
+            logging.warning('Error {} writing input cache {}.'.format(
+                e, self.filename))
+        else:
+            self.changed = False
+            logging.debug('Input cache written with {} entries.'.format(
+                len(self.entries)))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Reads the in-job timing log written by turbogo submit scripts (timing.log),
+where each run of ridft/dscf, rdgrad/grad, statpt/relax, aoforce and the
+whole job is stamped at start and end. Runs are grouped into jobex cycles
+(an SCF, its gradient and the geometry step), NumForce displacements (runs in
+subdirectories), staging to and from node-local scratch and everything else,
+and summarized per job.
+"""
+
+import logging
+import os
+
+import turbogo_helpers
+
+TIMING_FILE = 'timing.log'
+SUMMARY_FILE = 'timing_summary.txt'
+
+#program -> stage of a jobex cycle
+STAGES = {'ridft': 'scf', 'dscf': 'scf', 'rdgrad': 'gradient',
+          'grad': 'gradient', 'statpt': 'relax', 'relax': 'relax',
+          'aoforce': 'aoforce', 'escf': 'escf', 'egrad': 'gradient'}
+CYCLE_STAGES = ['scf', 'gradient', 'relax']
+#copies to and from node-local scratch, see turbogo STAGING
+STAGING = {'stage-in': 'stage in', 'stage-out': 'stage out'}
+
+CYCLE_HEADER = '{:>6}{:>12}{:>12}{:>12}{:>12}{:>12}'
+CYCLE_LINE = '{:>6}{:>12.1f}{:>12.1f}{:>12.1f}{:>12.1f}{:>12.1f}'
+
+
+class Run(object):
+    """One timed program run: start and end are unix times, end None if the
+    run hadn't finished (or was killed)"""
+    __slots__ = ('program', 'start', 'end', 'status', 'directory')
+
+    def __init__(self, program, start, end=None, status=None, directory=''):
+        self.program = program
+        self.start = start
+        self.end = end
+        self.status = status
+        self.directory = directory
+
+    @property
+    def seconds(self):
+        if self.end is None:
+            return 0.0
+        return self.end - self.start
+
+
+def read_timing(filename=TIMING_FILE):
+    """
+    Returns the list of Runs in a timing log, in start order. Start and end
+    lines are paired on program and process id. Lines that can't be read are
+    skipped.
+    """
+    try:
+        lines = turbogo_helpers.read_clean_file(filename)
+    except turbogo_helpers.FileAccessError:
+        return []
+    runs = list()
+    open_runs = dict()
+    for line in lines:
+        fields = line.split(None, 4)
+        if len(fields) < 4 or not turbogo_helpers.is_float(fields[2]):
+            continue
+        event, program, stamp, pid = fields[:4]
+        rest = fields[4] if len(fields) > 4 else ''
+        if event == 'start':
+            run = Run(program, float(stamp), directory=rest)
+            open_runs[(program, pid)] = run
+            runs.append(run)
+        elif event == 'end':
+            run = open_runs.pop((program, pid), None)
+            if run is None:
+                continue
+            run.end = float(stamp)
+            if turbogo_helpers.is_int(rest):
+                run.status = int(rest)
+    return runs
+
+
+def profile(runs, jobdir=None):
+    """
+    Splits runs into a profile dict:
+        jobs: Runs of the whole job script, one per submission
+        cycles: per jobex cycle dicts of start, seconds, and scf, gradient,
+                relax and other (time in the cycle outside of those) seconds
+        displacements: (count, seconds) of runs in subdirectories (NumForce)
+        stages: {stage: seconds} of the other runs in jobdir (aoforce...)
+                and of staging to and from node-local scratch
+    Runs in jobdir (default, where each job script ran) make up cycles, a new
+    one starting at each SCF.
+    """
+    result = {'jobs': list(), 'cycles': list(), 'displacements': (0, 0.0),
+              'stages': dict()}
+    follow = jobdir is None
+    if follow:
+        first = [run for run in runs if run.program == 'job'] or runs
+        if first:
+            jobdir = first[0].directory
+    cycle = None
+    count, seconds = 0, 0.0
+    for run in runs:
+        if run.program == 'job':
+            result['jobs'].append(run)
+            if follow:
+                #a staged job runs in its own scratch directory
+                jobdir = run.directory
+            continue
+        if run.program in STAGING:
+            stage = STAGING[run.program]
+            result['stages'][stage] = (result['stages'].get(stage, 0.0) +
+                                       run.seconds)
+            continue
+        stage = STAGES.get(run.program, run.program)
+        if run.directory != jobdir:
+            if stage == 'scf':
+                count += 1
+            seconds += run.seconds
+            continue
+        if stage == 'scf':
+            cycle = {'start': run.start, 'end': run.end or run.start,
+                     'scf': 0.0, 'gradient': 0.0, 'relax': 0.0}
+            result['cycles'].append(cycle)
+        if cycle is not None and stage in CYCLE_STAGES:
+            cycle[stage] += run.seconds
+            cycle['end'] = max(cycle['end'], run.end or run.start)
+        else:
+            result['stages'][stage] = (result['stages'].get(stage, 0.0) +
+                                       run.seconds)
+    result['displacements'] = (count, seconds)
+    for n, cycle in enumerate(result['cycles']):
+        if n + 1 < len(result['cycles']):
+            #the gap to the next SCF (jobex bookkeeping, file system) counts
+            cycle['end'] = result['cycles'][n + 1]['start']
+        cycle['seconds'] = cycle['end'] - cycle['start']
+        cycle['other'] = max(0.0, cycle['seconds'] - cycle['scf'] -
+                             cycle['gradient'] - cycle['relax'])
+    return result
+
+
+def read_profile(jobdir=os.curdir):
+    """The profile of the timing log in jobdir"""
+    return profile(read_timing(os.path.join(jobdir, TIMING_FILE)))
+
+
+def cycle_means(prof):
+    """Mean seconds per cycle of each of seconds, scf, gradient, relax and
+    other, or None without cycles"""
+    cycles = prof['cycles']
+    if not cycles:
+        return None
+    return dict((key, sum(c[key] for c in cycles) / len(cycles))
+                for key in ['seconds', 'scf', 'gradient', 'relax', 'other'])
+
+
+def wall_time(runs, since=0):
+    """Seconds from the start of the first job script started at or after
+    since to the end of the last, 0.0 if none has finished"""
+    jobs = [run for run in runs if run.program == 'job' and run.start >= since]
+    ends = [run.end for run in jobs if run.end is not None]
+    if not ends:
+        return 0.0
+    return max(ends) - min(run.start for run in jobs)
+
+
+def status_line(prof):
+    """A one line summary of a profile for the status report"""
+    parts = list()
+    means = cycle_means(prof)
+    if means:
+        parts.append("{} cycles, {:.0f}s/cycle (scf {:.0f}s, grad {:.0f}s, "
+                     "relax {:.0f}s, other {:.0f}s)".format(
+                         len(prof['cycles']), means['seconds'], means['scf'],
+                         means['gradient'], means['relax'], means['other']))
+    count, seconds = prof['displacements']
+    if count:
+        parts.append("{} displacements, {:.0f}s each".format(
+            count, seconds / count))
+    for stage, seconds in sorted(prof['stages'].items()):
+        parts.append("{} {:.0f}s".format(stage, seconds))
+    return '; '.join(parts)
+
+
+def summary_lines(prof, name=''):
+    """The timing summary of a profile, as a list of lines"""
+    lines = ['Timing summary {}'.format(name).rstrip()]
+    for job in prof['jobs']:
+        if job.end is None:
+            lines.append('Job started {}, not finished'.format(job.start))
+        else:
+            lines.append('Job wall time {} (exit status {})'.format(
+                turbogo_helpers.time_readable(int(job.seconds)), job.status))
+    if prof['cycles']:
+        lines.append('')
+        lines.append(CYCLE_HEADER.format('cycle', 'total (s)', 'scf (s)',
+                                         'grad (s)', 'relax (s)', 'other (s)'))
+        for n, cycle in enumerate(prof['cycles'], 1):
+            lines.append(CYCLE_LINE.format(n, cycle['seconds'], cycle['scf'],
+                                           cycle['gradient'], cycle['relax'],
+                                           cycle['other']))
+        means = cycle_means(prof)
+        lines.append(CYCLE_LINE.format('mean', means['seconds'], means['scf'],
+                                       means['gradient'], means['relax'],
+                                       means['other']))
+    count, seconds = prof['displacements']
+    if count:
+        lines.append('')
+        lines.append('{} NumForce displacements in {:.1f}s ({:.1f}s each)'
+                     .format(count, seconds, seconds / count))
+    for stage, seconds in sorted(prof['stages'].items()):
+        lines.append('{} {:.1f}s'.format(stage, seconds))
+    return lines
+
+
+def write_summary(jobdir=os.curdir, name=''):
+    """Writes the timing summary file of the job in jobdir. Returns the
+    profile, or None if there is no timing log."""
+    prof = read_profile(jobdir)
+    if not (prof['jobs'] or prof['cycles'] or prof['stages'] or
+            prof['displacements'][0]):
+        return None
+    try:
+        turbogo_helpers.write_file(os.path.join(jobdir, SUMMARY_FILE),
+                                   summary_lines(prof, name))
+    except turbogo_helpers.FileAccessError as e:
+        logging.warning("Error writing timing summary for {}: {}".format(
+            jobdir, e))
+    return prof
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Per-phase timing trace for turbocontrol jobs. Each job keeps a list of timed
+phases (parse, define, cosmoprep, control edit, qsub, queue wait, run, post
+processing and resubmits) as dicts, and the trace writer appends them to a
+JSON lines file as they complete, one phase per line.
+"""
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+TRACE_FILE = 'trace.jsonl'
+
+
+def record(timings, name, start, end=None, **detail):
+    """
+    Appends a phase to timings (a list, or None to not record). end defaults
+    to now. Extra keywords are kept with the phase.
+    """
+    if timings is None:
+        return
+    if end is None:
+        end = time.time()
+    entry = {'phase': name, 'start': start, 'end': end}
+    entry.update(detail)
+    timings.append(entry)
+
+
+@contextmanager
+def phase(timings, name, **detail):
+    """Records the time spent in the with block as phase name"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(timings, name, start, **detail)
+
+
+class TraceWriter(object):
+    """
+    Appends the phases of jobs to a JSON lines trace. Each line holds the job
+    name, dir and queue id with one phase's start, end and seconds. Phases
+    already written are remembered per job, so write can be called after every
+    poll.
+    """
+
+    def __init__(self, filename=TRACE_FILE):
+        self.filename = filename
+        self.written = dict()
+
+    def lines(self, job):
+        """JSON lines for the phases of job not yet written"""
+        timings = getattr(job, 'timings', None) or []
+        done = self.written.get(id(job), 0)
+        lines = list()
+        for entry in timings[done:]:
+            event = {'job': job.name, 'dir': job.indir,
+                     'jobid': getattr(job, 'jobid', None),
+                     'seconds': round(entry['end'] - entry['start'], 3)}
+            event.update(entry)
+            lines.append(json.dumps(event, sort_keys=True))
+        self.written[id(job)] = len(timings)
+        return lines
+
+    def write(self, jobs):
+        """Appends the new phases of jobs to the trace file"""
+        lines = list()
+        for job in jobs:
+            lines.extend(self.lines(job))
+        if not lines:
+            return
+        try:
+            with open(self.filename, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+        except (IOError, OSError) as e:
+            logging.warning("Error {} writing trace {}.".format(
+                e, self.filename))
+
+
+def read_trace(filename=TRACE_FILE):
+    """Yields the events of a trace file"""
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def phase_totals(events):
+    """{phase: (count, total seconds)} over trace events or timings"""
+    totals = dict()
+    for event in events:
+        count, seconds = totals.get(event['phase'], (0, 0.0))
+        totals[event['phase']] = (count + 1,
+                                  seconds + event['end'] - event['start'])
+    return totals
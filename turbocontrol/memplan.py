@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+"""
+Memory planner for Turbomole jobs. The basis and auxiliary basis functions
+of a job are counted from the basis files define wrote, and the memory each
+process needs is estimated: the SCF and gradient matrices, the RI integrals
+kept in core ($ricore) and the second derivative work of aoforce ($maxcor).
+The plan is fitted to the memory of the queue's nodes (from qhost, or the
+TURBOCONTROL_NODE_MEMORY environment variable) and gives the control
+keywords to write and the h_vmem to request for each slot.
+"""
+
+import logging
+import math
+import os
+from subprocess import Popen, PIPE
+
+import turbogo_helpers
+from geometry import ELEMENTS
+
+NODE_MEMORY_VAR = 'TURBOCONTROL_NODE_MEMORY'
+DEFAULT_NODE_MB = 16384
+#share of a node's memory jobs may plan on, the rest is left to the system
+NODE_FRACTION = 0.9
+#program, grids and small arrays of every process
+BASE_MB = 250
+#nbf x nbf matrices (fock, density, overlap, mos...) held in the SCF
+MATRIX_COPIES = 12
+#Turbomole's defaults, for keywords that aren't planned
+DEFAULT_MAXCOR = 500
+DEFAULT_RICORE = 200
+#least global array memory of a process of a parallel job
+MIN_GA_MB = 100
+VMEM_MARGIN_MB = 256
+
+MB = 1024.0 * 1024.0
+SHELL_FUNCTIONS = {'s': 1, 'p': 3, 'd': 5, 'f': 7, 'g': 9, 'h': 11, 'i': 13}
+MEMORY_UNITS = {'K': 1.0 / 1024, 'M': 1.0, 'G': 1024.0, 'T': 1024.0 * 1024}
+MEMORY_KEYWORDS = ['$ricore', '$maxcor', '$paroptions']
+#functions per H/He, Li-Ne and heavier atom, for sizing jobs before define
+BASIS_FUNCTIONS = {'def2-sv(p)': (2, 14, 18), 'def2-svp': (5, 14, 18),
+                   'def2-tzvp': (6, 31, 37), 'def2-tzvpp': (14, 31, 37),
+                   'def2-qzvp': (30, 57, 66), 'def2-qzvpp': (30, 57, 66)}
+DEFAULT_BASIS = 'def2-tzvp'
+LIGHT_ELEMENTS = ['H', 'He']
+FIRST_ROW = ['Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne']
+
+
+def _atom_count(atoms):
+    """Number of atoms in an $atoms list such as 1-4,7"""
+    count = 0
+    for part in atoms.split(','):
+        ends = part.split('-')
+        if len(ends) <= 2 and all(turbogo_helpers.is_int(e) for e in ends):
+            count += int(ends[-1]) - int(ends[0]) + 1
+    return count
+
+
+def read_atoms(filename='control'):
+    """
+    Returns a dict of the number of atoms, basis and jbas (lower case names
+    such as 'c def2-tzvp', None if not given) for each group of the $atoms
+    block of a control file.
+    """
+    groups = list()
+    block = None
+    for line in turbogo_helpers.read_clean_file(filename):
+        if line.startswith('$'):
+            block = line.split()[0]
+            continue
+        if block != '$atoms':
+            continue
+        line = line.rstrip('\\').strip()
+        if '=' in line:
+            key, value = [s.strip() for s in line.split('=', 1)]
+            if groups and key in ('basis', 'jbas'):
+                groups[-1][key] = ' '.join(value.lower().split())
+        elif len(line.split()) > 1:
+            groups.append({'atoms': _atom_count(line.split()[1]),
+                           'basis': None, 'jbas': None})
+    return groups
+
+
+def read_basis(filename='basis'):
+    """
+    Returns {name: number of functions} for every basis set of a Turbomole
+    basis (or auxbasis) file, counting spherical functions.
+    """
+    counts = dict()
+    name = None
+    inbasis = False
+    after_star = False
+    for line in turbogo_helpers.read_clean_file(filename):
+        fields = line.split()
+        if not fields or line.startswith('#'):
+            continue
+        if line.startswith('$'):
+            inbasis = fields[0] in ('$basis', '$jbas')
+            continue
+        if not inbasis:
+            continue
+        if fields[0] == '*':
+            after_star = True
+            continue
+        if after_star and not turbogo_helpers.is_float(fields[0]):
+            name = ' '.join(fields[:2]).lower()
+            counts[name] = 0
+        elif (name is not None and len(fields) == 2 and
+              turbogo_helpers.is_int(fields[0]) and
+              fields[1].lower() in SHELL_FUNCTIONS):
+            counts[name] += SHELL_FUNCTIONS[fields[1].lower()]
+        after_star = False
+    return counts
+
+
+def count_functions(dirname=os.curdir):
+    """
+    Returns (atoms, basis functions, auxiliary basis functions) of the job
+    in dirname, with 0 auxiliary functions if there is no auxbasis file.
+    """
+    groups = read_atoms(os.path.join(dirname, 'control'))
+    basis = read_basis(os.path.join(dirname, 'basis'))
+    if os.path.isfile(os.path.join(dirname, 'auxbasis')):
+        aux = read_basis(os.path.join(dirname, 'auxbasis'))
+    else:
+        aux = dict()
+    natoms = nbf = naux = 0
+    for group in groups:
+        if group['basis'] not in basis:
+            raise turbogo_helpers.InputCheckError(
+                group['basis'], "Basis set {} not found in {}.".format(
+                    group['basis'], dirname))
+        natoms += group['atoms']
+        nbf += group['atoms'] * basis[group['basis']]
+        naux += group['atoms'] * aux.get(group['jbas'], 0)
+    if not nbf:
+        raise turbogo_helpers.InputCheckError(
+            dirname, "No basis functions found in {}.".format(dirname))
+    return natoms, nbf, naux
+
+
+def estimate_functions(geometry, basis):
+    """
+    Estimated basis functions of geometry in basis (before define has run),
+    from the functions per atom of hydrogen, first row and heavier atoms.
+    """
+    per_atom = BASIS_FUNCTIONS.get(basis.lower(),
+                                   BASIS_FUNCTIONS[DEFAULT_BASIS])
+    nbf = 0
+    for element in geometry.elements.tolist():
+        symbol = ELEMENTS[element]
+        if symbol in LIGHT_ELEMENTS:
+            nbf += per_atom[0]
+        elif symbol in FIRST_ROW:
+            nbf += per_atom[1]
+        else:
+            nbf += per_atom[2]
+    return nbf
+
+
+def parse_memory(value):
+    """MB of a memory size such as 62.8G, 512M or 2048 (MB), None if bad"""
+    value = value.strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    unit = 'M'
+    if value and value[-1] in MEMORY_UNITS:
+        unit = value[-1]
+        value = value[:-1]
+    if not turbogo_helpers.is_float(value) or float(value) <= 0:
+        return None
+    return float(value) * MEMORY_UNITS[unit]
+
+
+def read_qhost(output):
+    """[(slots, memory MB)] of the execution hosts in qhost output"""
+    hosts = list()
+    header = None
+    for line in output.split('\n'):
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'HOSTNAME':
+            header = fields
+            continue
+        if header is None or len(fields) != len(header):
+            continue
+        host = dict(zip(header, fields))
+        memory = parse_memory(host.get('MEMTOT', '-'))
+        if memory and turbogo_helpers.is_int(host.get('NCPU', '-')):
+            hosts.append((int(host['NCPU']), memory))
+    return hosts
+
+
+#qhost is asked once per process
+_hosts = None
+
+
+def node_hosts():
+    """(slots, memory MB) of every host gridengine reports"""
+    global _hosts
+    if _hosts is None:
+        try:
+            output = Popen(['qhost'], stdout=PIPE,
+                           stderr=PIPE).communicate()[0]
+        except OSError as e:
+            logging.debug("qhost not available: {}".format(e))
+            output = ''
+        _hosts = read_qhost(output)
+    return _hosts
+
+
+def node_memory(nproc=1):
+    """
+    MB of memory of a node for a job of nproc slots: TURBOCONTROL_NODE_MEMORY
+    if it's set, or the smallest host with enough slots in qhost, or
+    DEFAULT_NODE_MB.
+    """
+    configured = os.getenv(NODE_MEMORY_VAR)
+    if configured:
+        memory = parse_memory(configured)
+        if memory:
+            return memory
+        logging.warning("Invalid value of '{}' for {}.".format(
+            configured, NODE_MEMORY_VAR))
+    sizes = [memory for slots, memory in node_hosts() if slots >= nproc]
+    if sizes:
+        return min(sizes)
+    return DEFAULT_NODE_MB
+
+
+class MemoryPlan(object):
+    """
+    Memory plan of a job run as processes processes on nproc slots of a node.
+    ricore and maxcor are the planned keyword values in MB (None if not
+    used by the job), ga the global array bytes of each process of a
+    parallel job, and process the MB each process needs.
+    """
+
+    def __init__(self, nbf, naux=0, natoms=0, processes=1, nproc=1,
+                 jobtype='opt', ri=False, node_mb=DEFAULT_NODE_MB):
+        self.processes = max(processes, 1)
+        self.nproc = max(nproc, 1)
+        self.budget = node_mb * NODE_FRACTION / self.processes
+        self.base = BASE_MB + MATRIX_COPIES * nbf ** 2 * 8 / MB
+        free = max(0.0, self.budget - self.base)
+        self.ri = ri
+        self.ricore = None
+        self.maxcor = None
+        self.ga = None
+        ga = 0
+        if self.processes > 1:
+            #each process' share of the distributed matrices
+            ga = max(MIN_GA_MB, min(MATRIX_COPIES * nbf ** 2 * 8 / MB,
+                                    free - DEFAULT_MAXCOR))
+            self.ga = int(ga * MB)
+        if ri and naux:
+            #all of the three index integrals, or as much as fits beside the
+            #global arrays and the default (or smallest planned) $maxcor
+            full = naux * nbf * (nbf + 1) / 2 * 8 / MB
+            self.ricore = int(min(math.ceil(full),
+                                  max(0.0, free - ga - DEFAULT_MAXCOR)))
+        if jobtype == 'aoforce' or jobtype == 'numforce':
+            #perturbed densities and fock matrices of every coordinate, in
+            #what the global arrays and RI integrals leave
+            need = 2 * 3 * natoms * nbf ** 2 * 8 / MB
+            self.maxcor = int(max(DEFAULT_MAXCOR,
+                                  min(need, free - ga - (self.ricore or 0))))
+
+    @property
+    def process(self):
+        """MB needed by each process"""
+        ricore = self.ricore
+        if ricore is None and self.ri:
+            ricore = DEFAULT_RICORE
+        return (self.base + (ricore or 0) + (self.maxcor or DEFAULT_MAXCOR) +
+                (self.ga or 0) / MB)
+
+    def vmem(self):
+        """h_vmem in MB to request for each slot"""
+        return int(math.ceil((self.process + VMEM_MARGIN_MB) *
+                             self.processes / self.nproc))
+
+    def control_lines(self, given=()):
+        """Control lines for the planned keywords, except those in given"""
+        lines = list()
+        if self.ricore is not None and not '$ricore' in given:
+            lines.append('$ricore {}'.format(self.ricore))
+        if self.maxcor is not None and not '$maxcor' in given:
+            lines.append('$maxcor {}'.format(self.maxcor))
+        if self.ga is not None and not '$paroptions' in given:
+            lines.append('$paroptions ga_memperproc {0} {0}'.format(self.ga))
+        return lines
+
+
+def given_keywords(control_add):
+    """{keyword: MB value or None} of memory keywords in control_add"""
+    given = dict()
+    for line in control_add:
+        fields = line.split()
+        if fields and fields[0] in MEMORY_KEYWORDS:
+            value = None
+            if len(fields) > 1 and turbogo_helpers.is_int(fields[1]):
+                value = int(fields[1])
+            given[fields[0]] = value
+    return given
+
+
+def plan_job(job, dirname=os.curdir, node_mb=None):
+    """
+    The MemoryPlan of job from the control and basis files in dirname, or
+    None if they can't be read. $ricore and $maxcor given in the job's
+    control additions are planned as given.
+    """
+    try:
+        natoms, nbf, naux = count_functions(dirname)
+    except (turbogo_helpers.FileAccessError,
+            turbogo_helpers.InputCheckError) as e:
+        logging.warning("Memory not planned for {}: {}".format(
+            job.name, getattr(e, 'msg', None) or getattr(e, 'badfile', e)))
+        return None
+    #SMP programs (and aoforce) are one process, NumForce runs one per slot
+    if (job.para_arch == 'SMP' or job.jobtype == 'aoforce') and \
+            job.jobtype != 'numforce':
+        processes = 1
+    else:
+        processes = job.nproc
+    if node_mb is None:
+        node_mb = node_memory(job.nproc)
+    plan = MemoryPlan(nbf, naux, natoms, processes, job.nproc, job.jobtype,
+                      bool(job.ri) or job.jobtype == 'numforce', node_mb)
+    given = given_keywords(job.control_add)
+    if given.get('$ricore') is not None:
+        plan.ricore = given['$ricore']
+    if given.get('$maxcor') is not None:
+        plan.maxcor = given['$maxcor']
+    if plan.process > plan.budget:
+        logging.warning("Job {} needs {:.0f} MB per process, more than the "
+                        "{:.0f} MB available.".format(job.name, plan.process,
+                                                      plan.budget))
+    logging.debug("Memory plan for {}: {} basis functions, {} auxiliary, "
+                  "{:.0f} MB per process.".format(job.name, nbf, naux,
+                                                  plan.process))
+    return plan
+
+
+def apply_plan(job, dirname=os.curdir):
+    """
+    Plans the memory of job in dirname. Sets job.memory to the h_vmem (MB)
+    to request per slot, and returns the control lines for the memory
+    keywords not already in the job's control additions.
+    """
+    plan = plan_job(job, dirname)
+    if plan is None:
+        return []
+    job.memory = plan.vmem()
+    return plan.control_lines(given_keywords(job.control_add))
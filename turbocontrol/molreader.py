@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Streaming readers for multi-record structure files (xyz and sdf/mol), as
+written by conformer generators. Records are yielded one at a time as
+(title, Geometry) pairs, so whole ensembles never sit in memory.
+"""
+
+import logging
+import os
+import numpy as np
+import turbogo_helpers
+from geometry import Geometry, ELEMENT_INDEX, BOHR
+
+
+def read_records(filename):
+    """
+    Yields (title, Geometry) for every record of an xyz or sdf file, picking
+    the reader from the file extension.
+    """
+    ext = os.path.splitext(filename)[-1].lower()
+    if not ext in READERS:
+        raise turbogo_helpers.InputCheckError(
+            filename, "Unknown structure file type '{}'.".format(ext))
+    try:
+        f = open(filename, 'r')
+    except (OSError, IOError) as e:
+        raise turbogo_helpers.FileAccessError(
+            "Error reading file {}.".format(filename), e)
+    with f:
+        for record in READERS[ext](f):
+            yield record
+
+
+def read_xyz(stream):
+    """
+    Yields (title, Geometry) for each frame of a multi-frame xyz file. Each
+    frame is an atom count line, a comment (used as title) and one
+    'element x y z' line per atom. Extra columns are ignored.
+    """
+    lines = iter(stream)
+    for line in lines:
+        if not line.strip():
+            continue
+        if not turbogo_helpers.is_positive_int(line.strip()):
+            raise turbogo_helpers.InputCheckError(
+                line, "Expected the atom count of an xyz frame.")
+        natoms = int(line)
+        title = next(lines, '').strip()
+        symbols = list()
+        coords = list()
+        for _ in range(natoms):
+            inline = next(lines, '').split()
+            if len(inline) < 4:
+                raise turbogo_helpers.InputCheckError(
+                    inline, "Truncated xyz frame '{}'.".format(title))
+            symbols.append(inline[0])
+            coords.append(inline[1:4])
+        yield title, _geometry(symbols, coords)
+
+
+def read_sdf(stream):
+    """
+    Yields (title, Geometry) for each record of a V2000 sdf (or mol) file. The
+    first header line is used as the title, bonds and properties are skipped.
+    """
+    lines = iter(stream)
+    for line in lines:
+        title = line.strip()
+        next(lines, '')
+        next(lines, '')
+        counts = next(lines, None)
+        if counts is None:
+            #trailing blank lines at the end of the file
+            return
+        if 'V3000' in counts:
+            raise turbogo_helpers.InputCheckError(
+                counts, "V3000 sdf records are not supported.")
+        try:
+            natoms = int(counts[0:3])
+        except ValueError:
+            raise turbogo_helpers.InputCheckError(
+                counts, "Bad sdf counts line in record '{}'.".format(title))
+        symbols = list()
+        coords = list()
+        for _ in range(natoms):
+            inline = next(lines, '').split()
+            if len(inline) < 4:
+                raise turbogo_helpers.InputCheckError(
+                    inline, "Truncated sdf record '{}'.".format(title))
+            symbols.append(inline[3])
+            coords.append(inline[0:3])
+        #skip bonds, properties and data items to the record end
+        for line in lines:
+            if line.startswith('$$$$'):
+                break
+        yield title, _geometry(symbols, coords)
+
+
+def _geometry(symbols, coords):
+    """Checks symbols and Angstrom coordinates, returning a Geometry"""
+    elements = list()
+    for symbol in symbols:
+        try:
+            elements.append(ELEMENT_INDEX[symbol.capitalize()])
+        except KeyError:
+            logging.warning('Bad element: {}'.format(symbol))
+            raise turbogo_helpers.InputCheckError(symbol,
+                                                  "Input element unknown.")
+    try:
+        coords = np.array(coords, dtype=np.float64).reshape(-1, 3)
+    except ValueError:
+        raise turbogo_helpers.InputCheckError(
+            coords,
+            "Input geometry should be in cartesian format 'element x y z'.")
+    return Geometry(elements, coords / BOHR)
+
+
+READERS = {'.xyz': read_xyz, '.sdf': read_sdf, '.sd': read_sdf,
+           '.mol': read_sdf}
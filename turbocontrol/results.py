@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+"""
+Results database for turbocontrol. Completed jobs are recorded in an sqlite
+file with tables for the jobs, their timings, SCF energies, vibrational
+frequencies, freeh thermochemistry grids, the cycle time for their size
+and processors (for the nproc policy) and the run time of each stage with
+the time predicted for it (for walltime prediction). The stats.txt and
+freeh.txt reports are generated from the database on demand.
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import time
+import turbogo_helpers
+from scaling import job_scaling
+from walltime import job_runtimes
+
+RESULTS_DB = 'results.db'
+STATS_FILE = 'stats.txt'
+FREEH_FILE = 'freeh.txt'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    directory TEXT UNIQUE,
+    functional TEXT,
+    basis TEXT,
+    jobtype TEXT,
+    status TEXT,
+    first_freq REAL,
+    recorded REAL
+);
+CREATE TABLE IF NOT EXISTS timings (
+    job_id INTEGER PRIMARY KEY REFERENCES jobs(id),
+    opt_steps INTEGER,
+    opt_time REAL,
+    freq_time REAL
+);
+CREATE TABLE IF NOT EXISTS energies (
+    job_id INTEGER REFERENCES jobs(id),
+    cycle INTEGER,
+    energy REAL,
+    PRIMARY KEY (job_id, cycle)
+);
+CREATE TABLE IF NOT EXISTS frequencies (
+    job_id INTEGER REFERENCES jobs(id),
+    mode INTEGER,
+    frequency REAL,
+    PRIMARY KEY (job_id, mode)
+);
+CREATE TABLE IF NOT EXISTS thermo (
+    job_id INTEGER REFERENCES jobs(id),
+    zpe REAL,
+    t REAL,
+    p REAL,
+    qtrans REAL,
+    qrot REAL,
+    qvib REAL,
+    pot REAL,
+    eng REAL,
+    entr REAL,
+    cv REAL,
+    cp REAL,
+    enth REAL
+);
+CREATE TABLE IF NOT EXISTS scaling (
+    job_id INTEGER REFERENCES jobs(id),
+    nbf INTEGER,
+    nproc INTEGER,
+    para_arch TEXT,
+    cycle_time REAL
+);
+CREATE TABLE IF NOT EXISTS runtimes (
+    job_id INTEGER REFERENCES jobs(id),
+    stage TEXT,
+    atoms INTEGER,
+    nbf INTEGER,
+    nproc INTEGER,
+    para_arch TEXT,
+    seconds REAL,
+    predicted REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_method ON jobs (functional, basis);
+CREATE INDEX IF NOT EXISTS thermo_job ON thermo (job_id);
+CREATE INDEX IF NOT EXISTS thermo_t ON thermo (t, p);
+"""
+
+CHILD_TABLES = ['timings', 'energies', 'frequencies', 'thermo', 'scaling',
+                'runtimes']
+THERMO_COLUMNS = list(turbogo_helpers.FREEH_COLUMNS)
+
+STATS_HEADER = ("{name:^16}{directory:^20}{optsteps:^10}{opttime:^12}"
+                "{freqtime:^12}{tottime:^12}{firstfreq:^16}{energy:^16}")
+STATS_LINE = ("{name:^16.16}{directory:^20.20}{optsteps:^10.10}"
+              "{opttime:^12.12}{freqtime:^12.12}{tottime:^12.12}"
+              "{firstfreq:^16.16}{energy:^16.16}")
+FREEH_LINE = ("{name:^16}{directory:^20}{zpe:^14}{t:^10}"
+              "{p:^11}{qtrans:^12}{qrot:^10}"
+              "{pot:^14}{eng:^14}{entr:^20}{cv:^14}{cp:^14}{enth:^14}")
+FREEH_NEXT = ("{name:^16}{directory:^20}{zpe:^14}{t:^8}"
+              "{p:^11}{qtrans:^12}{qrot:^10}"
+              "{pot:^14}{eng:^14}{entr:^20}{cv:^14}{cp:^14}{enth:^14}")
+#number formats of the freeh output, for the report
+FREEH_FORMATS = {'zpe': '{:.1f}', 't': '{:.2f}', 'p': '{:.7f}',
+                 'qtrans': '{:.2f}', 'qrot': '{:.2f}', 'qvib': '{:.2f}',
+                 'pot': '{:.2f}', 'eng': '{:.2f}', 'entr': '{:.5f}',
+                 'cv': '{:.7f}', 'cp': '{:.7f}', 'enth': '{:.2f}'}
+
+
+def _to_float(value):
+    """float of value, or None if it isn't a number (or is nan)"""
+    if value is not None and turbogo_helpers.is_float(value):
+        value = float(value)
+        if not math.isnan(value):
+            return value
+    return None
+
+
+def _fmt(fmt, value):
+    """Formats a number, or returns '' for missing values"""
+    if value is None:
+        return ''
+    return fmt.format(value)
+
+
+def thermo_rows(data):
+    """Rows of the thermo table (without job_id) from a FreehData"""
+    rows = list()
+    if data is not None:
+        zpe = _to_float(data.zpe)
+        for values in zip(*[getattr(data, col) for col in THERMO_COLUMNS]):
+            rows.append([zpe] + [_to_float(v) for v in values])
+    return rows
+
+
+def job_directory(indir, infile=None):
+    """
+    The key of a job in the jobs table: its input file in its directory (or
+    the directory, if the input isn't known), built the same way whether the
+    job is recorded while watching it or harvested later.
+    """
+    if infile:
+        return os.path.join(indir, infile)
+    return indir
+
+
+def job_results(job):
+    """
+    Collects the results of a completed job (a turbocontrol Jobset, or a
+    turbogo Job) from the job and its directory. Returns a dict of the rows
+    for each table.
+    """
+    inner = getattr(job, 'job', job)
+    directory = job_directory(job.indir, job.infile)
+    try:
+        energies = turbogo_helpers.read_energies(
+            os.path.join(job.indir, 'energy'))
+    except turbogo_helpers.FileAccessError as e:
+        logging.warning("Error reading energy file for stats: {}".format(e))
+        energies = list()
+    if getattr(job, 'freqopt', None) == 'numforce':
+        controlfile = os.path.join(job.indir, 'numforce', 'control')
+    else:
+        controlfile = os.path.join(job.indir, 'control')
+    try:
+        spectrum = turbogo_helpers.read_spectrum(controlfile)
+    except turbogo_helpers.FileAccessError:
+        spectrum = list()
+
+    thermo = thermo_rows(getattr(job, 'data', None) or
+                         getattr(inner, 'data', None))
+    scaling = job_scaling(job.indir, getattr(inner, 'nproc', None),
+                          getattr(inner, 'para_arch', None))
+
+    return {
+        'job': [job.name, directory, getattr(inner, 'functional', None),
+                getattr(inner, 'basis', None), getattr(job, 'jobtype', None)
+                or getattr(inner, 'jobtype', None), getattr(job, 'status', None),
+                _to_float(getattr(job, 'firstfreq', None)), time.time()],
+        'timing': [energies[-1][0] if energies else None, job.otime,
+                   job.ftime],
+        'energies': energies,
+        'frequencies': spectrum,
+        'thermo': thermo,
+        'scaling': scaling,
+        'runtimes': job_runtimes(job),
+        }
+
+
+class ResultsDB(object):
+    """
+    sqlite results store. Jobs are written with record(), in one transaction
+    per batch.
+    """
+
+    def __init__(self, filename=RESULTS_DB):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, jobs):
+        """
+        Records the results of the completed jobs. A job recorded again (by
+        directory) replaces its earlier results.
+        """
+        results = [job_results(job) for job in jobs]
+        self.record_results(results)
+        logging.debug("{} job results recorded.".format(len(results)))
+
+    def record_results(self, results):
+        """Writes rows collected by job_results, in one transaction"""
+        with self.conn:
+            cur = self.conn.cursor()
+            for result in results:
+                old = cur.execute("SELECT id FROM jobs WHERE directory = ?",
+                                  (result['job'][1],)).fetchone()
+                if old is not None:
+                    for table in CHILD_TABLES:
+                        cur.execute("DELETE FROM {} WHERE job_id = ?".format(
+                            table), (old[0],))
+                    cur.execute("DELETE FROM jobs WHERE id = ?", (old[0],))
+                cur.execute(
+                    "INSERT INTO jobs (name, directory, functional, basis, "
+                    "jobtype, status, first_freq, recorded) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", result['job'])
+                job_id = cur.lastrowid
+                cur.execute("INSERT INTO timings VALUES (?, ?, ?, ?)",
+                            [job_id] + list(result['timing']))
+                cur.executemany("INSERT INTO energies VALUES (?, ?, ?)",
+                                [(job_id,) + tuple(row)
+                                 for row in result['energies']])
+                cur.executemany("INSERT INTO frequencies VALUES (?, ?, ?)",
+                                [(job_id,) + tuple(row)
+                                 for row in result['frequencies']])
+                cur.executemany(
+                    "INSERT INTO thermo VALUES ({})".format(
+                        ', '.join(['?'] * (len(THERMO_COLUMNS) + 2))),
+                    [[job_id] + list(row) for row in result['thermo']])
+                cur.executemany("INSERT INTO scaling VALUES (?, ?, ?, ?, ?)",
+                                [[job_id] + list(row)
+                                 for row in result.get('scaling', [])])
+                cur.executemany(
+                    "INSERT INTO runtimes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [[job_id] + list(row)
+                     for row in result.get('runtimes', [])])
+
+    def scaling_history(self):
+        """(nbf, nproc, para_arch, cycle time) of every timed job"""
+        return [tuple(row) for row in self.conn.execute(
+            "SELECT nbf, nproc, para_arch, cycle_time FROM scaling")]
+
+    def runtime_history(self):
+        """(stage, atoms, nbf, functional, nproc, para_arch, seconds,
+        predicted seconds) of every timed stage, oldest first"""
+        return [tuple(row) for row in self.conn.execute(
+            "SELECT r.stage, r.atoms, r.nbf, j.functional, r.nproc, "
+            "r.para_arch, r.seconds, r.predicted FROM runtimes r "
+            "JOIN jobs j ON r.job_id = j.id ORDER BY j.recorded, r.rowid")]
+
+    def stats(self):
+        """Rows of job name, directory, timings, first frequency and energy"""
+        return self.conn.execute(
+            "SELECT j.name, j.directory, j.first_freq, t.opt_steps, "
+            "t.opt_time, t.freq_time, e.energy FROM jobs j "
+            "LEFT JOIN timings t ON t.job_id = j.id "
+            "LEFT JOIN energies e ON e.job_id = j.id "
+            "AND e.cycle = t.opt_steps ORDER BY j.id").fetchall()
+
+    def thermo(self, t=None, p=None, functional=None, basis=None):
+        """
+        Thermochemistry rows joined with their job's name, directory,
+        functional and basis. Filters on temperature and pressure (to 0.01),
+        functional and basis when given.
+        """
+        query = ("SELECT j.name, j.directory, j.functional, j.basis, th.* "
+                 "FROM thermo th JOIN jobs j ON th.job_id = j.id")
+        where = list()
+        params = list()
+        if t is not None:
+            where.append("th.t BETWEEN ? AND ?")
+            params.extend([t - 0.005, t + 0.005])
+        if p is not None:
+            where.append("th.p BETWEEN ? AND ?")
+            params.extend([p - 0.005, p + 0.005])
+        if functional is not None:
+            where.append("j.functional = ?")
+            params.append(functional)
+        if basis is not None:
+            where.append("j.basis = ?")
+            params.append(basis)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY j.id, th.rowid"
+        return self.conn.execute(query, params).fetchall()
+
+    def stats_lines(self):
+        """The stats report, as a list of lines"""
+        lines = [STATS_HEADER.format(
+            name='Name', directory='Directory', optsteps='Opt Steps',
+            opttime='Opt Time', freqtime='Freq Time', tottime='Total Time',
+            firstfreq='1st Frequency', energy='Energy')]
+        for row in self.stats():
+            otime = row['opt_time'] or 0
+            ftime = row['freq_time'] or 0
+            lines.append(STATS_LINE.format(
+                name=row['name'],
+                directory=row['directory'],
+                optsteps=('?' if row['opt_steps'] is None
+                          else str(row['opt_steps'])),
+                opttime=turbogo_helpers.time_readable(otime),
+                freqtime=turbogo_helpers.time_readable(ftime),
+                tottime=turbogo_helpers.time_readable(otime + ftime),
+                firstfreq=_fmt('{:.2f}', row['first_freq']) or '?',
+                energy=('?' if row['energy'] is None
+                        else repr(row['energy'])),
+                ))
+        return lines
+
+    def freeh_lines(self):
+        """The freeh report, as a list of lines"""
+        lines = [FREEH_LINE.format(
+            name='Name', directory='Directory', zpe='ZPE (kJ/mol)',
+            t='Temp (K)', p='p (MPa)', qtrans='ln(qtrans)', qrot='ln(qrot)',
+            pot='Pot (kJ/mol)', eng='Eng (kJ/mol)',
+            entr='Entropy (kJ/mol/K)', cv='Cv (kJ/molK)', cp='Cp (kJ/molK)',
+            enth='Enthalpy (kJ/mol)')]
+        last = None
+        for row in self.thermo():
+            values = dict((col, _fmt(FREEH_FORMATS[col], row[col]))
+                          for col in FREEH_FORMATS)
+            if row['job_id'] == last:
+                #don't rewrite name/zpe for each line
+                values.update(name='', directory='', zpe='')
+                lines.append(FREEH_NEXT.format(**values))
+            else:
+                values.update(name=row['name'], directory=row['directory'])
+                lines.append(FREEH_LINE.format(**values))
+            last = row['job_id']
+        return lines
+
+    def write_reports(self, statsfile=STATS_FILE, freehfile=FREEH_FILE):
+        """Writes the stats and (if there are any) freeh reports"""
+        try:
+            turbogo_helpers.write_file(statsfile, self.stats_lines())
+            if self.conn.execute("SELECT 1 FROM thermo LIMIT 1").fetchone():
+                turbogo_helpers.write_file(freehfile, self.freeh_lines())
+        except turbogo_helpers.FileAccessError as e:
+            logging.warning("Error writing reports: {}".format(e))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Processor count and parallel architecture policy for sets of jobs. The time
+of an optimization cycle is modelled from the job's size (basis functions,
+cost growing as nbf**3) and Amdahl's law, with the serial fraction of each
+parallel architecture fitted to the cycle times of earlier jobs in the
+results database. Larger jobs have a smaller serial fraction.
+
+Slots are handed out for the throughput of the whole set rather than the
+speed of any one job: every job gets one slot, and the slots left in the
+budget go one at a time to the job that would finish last, for as long as
+the extra slot is used at MIN_EFFICIENCY or better.
+"""
+
+import heapq
+import logging
+import math
+import os
+import re
+from subprocess import Popen, PIPE
+
+import jobtiming
+import memplan
+import turbogo_helpers
+
+ARCHS = ['SMP', 'GA', 'MPI']
+#serial fraction at REF_NBF basis functions, before there is any history
+DEFAULT_SERIAL = 0.1
+REF_NBF = 500.0
+COST_EXPONENT = 3.0
+MIN_EFFICIENCY = 0.6
+#fits need this many cycle times, over at least two processor counts
+MIN_SAMPLES = 3
+SERIAL_GRID = [0.005 * n for n in range(1, 161)]
+MAX_SERIAL = 0.95
+
+SUBMIT_SCRIPT = 'submitscript.sge'
+SLOTS_LINE = re.compile(r'^#\$ -pe \S+ (\d+)')
+ARCH_LINE = re.compile(r'^export PARA_ARCH=(\S+)')
+#parallel environments with this allocation rule keep all slots on one host
+SINGLE_HOST_RULE = '$pe_slots'
+
+
+class Scaling(object):
+    """Amdahl's law model of one architecture"""
+
+    def __init__(self, serial=DEFAULT_SERIAL, samples=0):
+        self.serial = serial
+        self.samples = samples
+
+    def serial_fraction(self, nbf):
+        """Serial fraction of a job of nbf basis functions"""
+        return min(MAX_SERIAL, self.serial * REF_NBF / max(nbf, 1))
+
+    def speedup(self, nbf, nproc):
+        """Speedup on nproc processors over one"""
+        s = self.serial_fraction(nbf)
+        return 1.0 / (s + (1.0 - s) / nproc)
+
+    def efficiency(self, nbf, nproc):
+        """Share of nproc processors put to use"""
+        return self.speedup(nbf, nproc) / nproc
+
+    def cost(self, nbf, nproc=1):
+        """Relative time of a cycle on nproc processors"""
+        return (nbf / REF_NBF) ** COST_EXPONENT / self.speedup(nbf, nproc)
+
+
+def fit(history):
+    """
+    Returns {arch: Scaling} fitted to history rows of (nbf, nproc,
+    para_arch, seconds per cycle), for the architectures with enough rows.
+    Serial runs count for every architecture.
+    """
+    serial_rows = list()
+    rows = dict()
+    for nbf, nproc, arch, seconds in history:
+        if not (nbf and nproc and seconds and seconds > 0):
+            continue
+        if nproc == 1:
+            serial_rows.append((nbf, nproc, seconds))
+        elif arch in ARCHS:
+            rows.setdefault(arch, list()).append((nbf, nproc, seconds))
+    models = dict()
+    for arch, samples in rows.items():
+        samples = samples + serial_rows
+        if (len(samples) < MIN_SAMPLES or
+                len(set(nproc for _nbf, nproc, _s in samples)) < 2):
+            continue
+        best = None
+        for serial in SERIAL_GRID:
+            model = Scaling(serial)
+            #log of the time the model leaves to the unknown machine speed
+            logs = [math.log(seconds / model.cost(nbf, nproc))
+                    for nbf, nproc, seconds in samples]
+            mean = sum(logs) / len(logs)
+            residual = sum((l - mean) ** 2 for l in logs)
+            if best is None or residual < best[0]:
+                best = (residual, serial)
+        models[arch] = Scaling(best[1], len(samples))
+        logging.debug("{} scaling fitted to {} jobs: serial fraction {:.3f} "
+                      "at {:.0f} basis functions.".format(
+                          arch, len(samples), best[1], REF_NBF))
+    return models
+
+
+def best_arch(nbf, nproc, models, default):
+    """The architecture with the best speedup on nproc, default on ties"""
+    arch = default
+    speedup = models.get(default, Scaling()).speedup(nbf, nproc)
+    for other in ARCHS:
+        if other in models and models[other].speedup(nbf, nproc) > speedup:
+            arch = other
+            speedup = models[other].speedup(nbf, nproc)
+    return arch
+
+
+def assign(jobs, slots, models=None, max_slots=None,
+           min_efficiency=MIN_EFFICIENCY):
+    """
+    Chooses processors for jobs, a list of (basis functions, default
+    architecture), sharing slots concurrent slots with no job over max_slots.
+    Returns a list of (nproc, architecture).
+    """
+    models = models or dict()
+    procs = [1] * len(jobs)
+    archs = [default for _nbf, default in jobs]
+
+    def model(i):
+        return models.get(archs[i], Scaling())
+
+    heap = [(-model(i).cost(nbf), i) for i, (nbf, _d) in enumerate(jobs)]
+    heapq.heapify(heap)
+    spare = slots - len(jobs)
+    while spare > 0 and heap:
+        _cost, i = heapq.heappop(heap)
+        nbf, default = jobs[i]
+        nproc = procs[i] + 1
+        if max_slots and nproc > max_slots:
+            continue
+        arch = best_arch(nbf, nproc, models, default)
+        scaling = models.get(arch, Scaling())
+        if scaling.efficiency(nbf, nproc) < min_efficiency:
+            continue
+        procs[i] = nproc
+        archs[i] = arch
+        spare -= 1
+        heapq.heappush(heap, (-scaling.cost(nbf, nproc), i))
+    return zip(procs, archs)
+
+
+def read_allocation_rule(output):
+    """The allocation_rule of qconf -sp output, None if it has none"""
+    for line in output.split('\n'):
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == 'allocation_rule':
+            return fields[1]
+    return None
+
+
+_rules = dict()
+
+
+def spans_nodes(pe):
+    """
+    True if gridengine may spread the slots of parallel environment pe over
+    several hosts. Unknown environments are taken to hold to one host.
+    """
+    if pe not in _rules:
+        try:
+            output = Popen(['qconf', '-sp', pe], stdout=PIPE,
+                           stderr=PIPE).communicate()[0]
+        except OSError as e:
+            logging.debug("qconf not available: {}".format(e))
+            output = ''
+        _rules[pe] = read_allocation_rule(output)
+    rule = _rules[pe]
+    return rule is not None and rule != SINGLE_HOST_RULE
+
+
+def read_submit_script(jobdir):
+    """(slots, para_arch) from the submit script in jobdir, None if absent"""
+    slots = arch = None
+    try:
+        lines = turbogo_helpers.read_clean_file(
+            os.path.join(jobdir, SUBMIT_SCRIPT))
+    except turbogo_helpers.FileAccessError:
+        return None, None
+    for line in lines:
+        match = SLOTS_LINE.match(line)
+        if match:
+            slots = int(match.group(1))
+            continue
+        match = ARCH_LINE.match(line)
+        if match:
+            arch = match.group(1)
+    return slots, arch
+
+
+def job_scaling(jobdir, nproc=None, para_arch=None):
+    """
+    The scaling history rows, [[nbf, nproc, para_arch, seconds per cycle]],
+    of the finished job in jobdir: none if it has no timed cycles. nproc and
+    para_arch are read from the submit script if not given.
+    """
+    means = jobtiming.cycle_means(jobtiming.read_profile(jobdir))
+    if not means or means['seconds'] <= 0:
+        return []
+    if nproc is None:
+        nproc, para_arch = read_submit_script(jobdir)
+        if nproc is None:
+            return []
+    try:
+        nbf = memplan.count_functions(jobdir)[1]
+    except (turbogo_helpers.FileAccessError,
+            turbogo_helpers.InputCheckError):
+        return []
+    return [[nbf, nproc, para_arch, means['seconds']]]
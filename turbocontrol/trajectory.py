@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Native readers for the Turbomole coord file and the gradient history of an
+optimization, in place of running t2x on every job. Optimization frames are
+streamed as (cycle, energy, Geometry, gradient) and written as multi-frame
+xyz, and the final geometries of many jobs can be written or merged into one
+file in a single pass.
+"""
+
+import logging
+import os
+import re
+from multiprocessing import Pool
+
+import numpy as np
+
+import turbogo_helpers
+from geometry import Geometry, ELEMENT_INDEX
+
+OPTIMIZATION_XYZ = 'optimization.xyz'
+FINAL_XYZ = 'final_geometry.xyz'
+
+CYCLE = re.compile(r'cycle\s*=\s*(\d+)(?:.*?energy\s*=\s*(\S+))?')
+
+
+def _geometry(symbols, coords):
+    """Geometry from Turbomole (lower case) symbols and Bohr coordinates"""
+    try:
+        elements = [ELEMENT_INDEX[s.capitalize()] for s in symbols]
+    except KeyError as e:
+        raise turbogo_helpers.InputCheckError(
+            e.args[0], "Unknown element in coordinates.")
+    return Geometry(elements, np.array(coords, dtype=np.float64))
+
+
+def _coord_line(fields):
+    """(symbol, [x, y, z]) of a coord line's fields, or None if it isn't one"""
+    if len(fields) < 4 or turbogo_helpers.is_float(fields[3]):
+        return None
+    return fields[3], fields[0:3]
+
+
+def read_coord(filename='coord'):
+    """Returns the Geometry of the $coord group of a Turbomole coord file"""
+    lines = turbogo_helpers.read_clean_file(filename)
+    symbols = list()
+    coords = list()
+    incoord = False
+    for line in lines:
+        if line.startswith('$'):
+            if incoord:
+                break
+            incoord = line.startswith('$coord')
+            continue
+        if incoord:
+            atom = _coord_line(line.split())
+            if atom is None:
+                continue
+            symbols.append(atom[0])
+            coords.append(atom[1])
+    if not symbols:
+        raise turbogo_helpers.InputCheckError(
+            filename, "No $coord group found.")
+    return _geometry(symbols, coords)
+
+
+def read_gradient(filename='gradient'):
+    """
+    Yields (cycle, energy, Geometry, gradient) for every cycle of a Turbomole
+    gradient file. energy is None if the cycle line has none, gradient is an
+    (N,3) array in Hartree/Bohr.
+    """
+    try:
+        f = open(filename, 'r')
+    except (OSError, IOError) as e:
+        raise turbogo_helpers.FileAccessError(
+            "Error reading file {}.".format(filename), e)
+    with f:
+        cycle = None
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0].startswith('$'):
+                if cycle is not None:
+                    yield _frame(cycle, symbols, coords, grads)
+                    cycle = None
+                continue
+            match = 'cycle' in line and CYCLE.search(line)
+            if match:
+                if cycle is not None:
+                    yield _frame(cycle, symbols, coords, grads)
+                energy = match.group(2)
+                cycle = (int(match.group(1)),
+                         float(energy.replace('D', 'E')) if energy else None)
+                symbols = list()
+                coords = list()
+                grads = list()
+                continue
+            if cycle is None:
+                continue
+            atom = _coord_line(fields)
+            if atom is not None:
+                symbols.append(atom[0])
+                coords.append(atom[1])
+            else:
+                #Fortran D exponents
+                grads.append(line.replace('D', 'E').split()[0:3])
+        if cycle is not None:
+            yield _frame(cycle, symbols, coords, grads)
+
+
+def _frame(cycle, symbols, coords, grads):
+    """(cycle, energy, Geometry, gradient) from a gradient file cycle"""
+    if len(grads) != len(coords):
+        raise turbogo_helpers.InputCheckError(
+            cycle[0], "Gradient cycle {} has {} gradients for {} atoms."
+            .format(cycle[0], len(grads), len(coords)))
+    gradient = np.array(grads, dtype=np.float64).reshape(-1, 3)
+    return cycle[0], cycle[1], _geometry(symbols, coords), gradient
+
+
+def frames(jobdir=os.curdir):
+    """
+    Yields (title, Geometry) for each optimization cycle of the job in
+    jobdir, as for a multi-frame xyz file.
+    """
+    for cycle, energy, geom, _grad in read_gradient(
+            os.path.join(jobdir, 'gradient')):
+        if energy is None:
+            yield 'cycle = {}'.format(cycle), geom
+        else:
+            yield 'cycle = {}  energy = {!r}'.format(cycle, energy), geom
+
+
+def xyz_lines(records):
+    """Multi-frame xyz lines for (title, Geometry) records"""
+    lines = list()
+    for title, geom in records:
+        lines.extend(geom.xyz_lines(title))
+    return lines
+
+
+def write_xyz_files(jobdir=os.curdir):
+    """
+    Writes optimization.xyz (if there is a gradient history) and
+    final_geometry.xyz for the job in jobdir, as t2x and t2x -c would.
+    """
+    final = read_coord(os.path.join(jobdir, 'coord'))
+    turbogo_helpers.write_file(os.path.join(jobdir, FINAL_XYZ),
+                               final.xyz_lines())
+    if os.path.isfile(os.path.join(jobdir, 'gradient')):
+        turbogo_helpers.write_file(os.path.join(jobdir, OPTIMIZATION_XYZ),
+                                   xyz_lines(frames(jobdir)))
+
+
+def _write_one(jobdir):
+    """Pool worker: (jobdir, error)"""
+    try:
+        write_xyz_files(jobdir)
+    except Exception as e:
+        return jobdir, str(e) or repr(e)
+    return jobdir, None
+
+
+def _final_one(jobdir):
+    """Pool worker: (jobdir, Geometry or None, error)"""
+    try:
+        return jobdir, read_coord(os.path.join(jobdir, 'coord')), None
+    except Exception as e:
+        return jobdir, None, str(e) or repr(e)
+
+
+def _map(func, jobdirs, workers):
+    """func over jobdirs, in a pool of workers if more than one"""
+    if workers > 1 and len(jobdirs) > 1:
+        pool = Pool(workers)
+        try:
+            return pool.map(func, jobdirs, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+    return [func(d) for d in jobdirs]
+
+
+def write_all(jobdirs, workers=1):
+    """Writes the xyz files of every job in jobdirs. Returns failed dirs."""
+    failed = list()
+    for jobdir, error in _map(_write_one, list(jobdirs), workers):
+        if error:
+            logging.warning("Error {} writing xyz files for {}.".format(
+                error, jobdir))
+            failed.append(jobdir)
+    return failed
+
+
+def merge_final(jobdirs, outfile, workers=1):
+    """
+    Writes the final geometry of every job in jobdirs to one multi-frame xyz
+    file, titled with the job directory. Returns the number written.
+    """
+    records = list()
+    for jobdir, geom, error in _map(_final_one, list(jobdirs), workers):
+        if error:
+            logging.warning("Error {} reading coord for {}.".format(
+                error, jobdir))
+            continue
+        records.append((jobdir, geom))
+    turbogo_helpers.write_file(outfile, xyz_lines(records))
+    return len(records)
@@ -9,8 +9,11 @@ import unicodedata
 import os
 import sys
 import time
+import numpy as np
 from subprocess import Popen, PIPE
 
+from geometry import Geometry, ELEMENTS, ELEMENT_INDEX, BOHR
+
 
 """
 -------------------------------------------------------------------------------
@@ -27,21 +30,9 @@ MAN_TURBOSYS = 'em64t-unknown-linux-gnu'
 """
 
 
-ELEMENTS = ['Ac', 'Ag', 'Al', 'Am', 'Ar', 'As', 'At', 'Au', 'B', 'Ba', 'Be',
-            'Bh', 'Bi', 'Bk', 'Br', 'C', 'Ca', 'Cd', 'Ce', 'Cf', 'Cl', 'Cm',
-            'Cn', 'Co', 'Cr', 'Cs', 'Cu', 'Db', 'Ds', 'Dy', 'Er', 'Es', 'Eu',
-            'F', 'Fe', 'Fl', 'Fm', 'Fr', 'Ga', 'Gd', 'Ge', 'H', 'He', 'Hf',
-            'Hg', 'Ho', 'Hs', 'I', 'In', 'Ir', 'K', 'Kr', 'La', 'Li', 'Lr',
-            'Lu', 'Lv', 'Md', 'Mg', 'Mn', 'Mo', 'Mt', 'N', 'Na', 'Nb', 'Nd',
-            'Ne', 'Ni', 'No', 'Np', 'O', 'Os', 'P', 'Pa', 'Pb', 'Pd', 'Pm',
-            'Po', 'Pr', 'Pt', 'Pu', 'Ra', 'Rb', 'Re', 'Rf', 'Rg', 'Rh', 'Rn',
-            'Ru', 'S', 'Sb', 'Sc', 'Se', 'Sg', 'Si', 'Sm', 'Sn', 'Sr', 'Ta',
-            'Tb', 'Tc', 'Te', 'Th', 'Ti', 'Tl', 'Tm', 'U', 'Uuo', 'Uup', 'Uus',
-            'Uut', 'V', 'W', 'Xe', 'Y', 'Yb', 'Zn', 'Zr']
-
 ARGLIST = ['nproc', 'nprocessors', 'nprocshared', 'arch', 'architecture',
            'para_arch', 'maxcycles', 'nocontrolmod', 'autocontrolmod', 'rt',
-           'cosmo']
+           'cosmo', 'scratch', 'pe', 'freqjobs', 'preopt']
 DISCARDARGLIST = ['nosave', 'rwf', 'chk', 'mem']
 ROUTELIST = ['opt', 'freq', 'ts', 'td', 'prep', 'sp']
 FREQOPTS = ['aoforce', 'numforce']
@@ -52,6 +43,18 @@ FUNCTIONALS = ['b3lyp', 'b3-lyp', 'blyp', 'b-lyp', 'pbe', 'b97d', 'b97-d',
                'tpss', 'pbe0', 'tpssh', 'bp', 'b-p', 'lhf', 's-vwn', 'svwn',
                'vwn']
 PARA_ARCH = ['MPI', 'GA', 'SMP']
+#gridengine parallel environment of each para_arch. Set a site's own with
+#TURBOCONTROL_PE_<ARCH> (e.g. TURBOCONTROL_PE_MPI=orte), or per job with %pe
+PARALLEL_ENVIRONMENTS = {'SMP': 'threaded', 'GA': 'threaded', 'MPI': 'mpi'}
+PE_VAR = 'TURBOCONTROL_PE_{}'
+#columns of freeh's thermochemistry table, kept here so the results database
+#can read them without loading freeh_op
+FREEH_COLUMNS = ('t', 'p', 'qtrans', 'qrot', 'qvib', 'pot', 'eng', 'entr',
+                 'cv', 'cp', 'enth')
+#basis of the pre-optimization of a bare %preopt
+PREOPT_BASIS = 'def2-SV(P)'
+#subdirectory of a job holding the files of its pre-optimization
+PREOPT_DIR = 'preopt'
 BASIS = ['SV', 'SVP', 'SV(P)', 'def-SVP', 'def2-SVP', 'def-SV(P)', 'def2-SV(P)',
          'DZ', 'DZP', 'TZ', 'TZP', 'TZV', 'TZVP', 'def-TZVP', 'def2-TZVP',
          'TZVPP', 'def-TZVPP', 'def2-TZVPP', 'TZVPPP', 'QZV', 'def-QZV',
@@ -61,6 +64,27 @@ BASIS = ['SV', 'SVP', 'SV(P)', 'def-SVP', 'def2-SVP', 'def-SV(P)', 'def2-SV(P)',
          '10s6p2d-dun', '6-31G*', '6-311G', '6-311G*', '6-311G**',
          '6-311++G**']
 
+
+def _build_route_table():
+    """
+    Precompute the route keyword lookup used by check_route. Keys are the lower
+    case tokens (basis sets also without hyphens), values are (kind, name).
+    Earlier kinds take precedence, as in the original keyword checks.
+    """
+    table = dict()
+    for kind, items in (('jobtype', ROUTELIST), ('option', ROUTEOPTS),
+                        ('freqopts', FREQOPTS), ('functional', FUNCTIONALS)):
+        for item in items:
+            table.setdefault(item.lower(), (kind, item.lower()))
+    for base in BASIS:
+        table.setdefault(base.lower(), ('basis', base))
+        table.setdefault(base.lower().replace('-', ''), ('basis', base))
+    for item in DISCARDROUTEOPTS:
+        table.setdefault(item.lower(), ('discard', item))
+    return table
+
+ROUTE_TABLE = _build_route_table()
+
 class Error(Exception):
     """Base class for exceptions in this module."""
     pass
@@ -191,20 +215,11 @@ def check_args(iargs):
 
             elif (arg[0] == 'nproc' or arg[0] == 'nprocessors' or
                   arg[0] == 'nprocshared'):
-                if is_positive_int(arg[1]):
-                    if int(arg[1]) < 9:
-                        args[arg[0].lower()] = arg[1]
-                    else:
-                        logging.warning("Invalid value of '{}' for {}.".format(
-                            arg[1],
-                            arg[0]
-                            )
-                        )
-                        raise InputCheckError(
-                            line,
-                            'Invalid value {} for argument {}.'
-                            .format(arg[1], arg[0])
-                            )
+                #the node's slot count is checked when the job is submitted
+                if is_positive_int(arg[1]) and int(arg[1]) > 0:
+                    args[arg[0].lower()] = arg[1]
+                elif arg[1].lower() == 'auto':
+                    args[arg[0].lower()] = 'auto'
                 else:
                     logging.warning("Invalid value of '{}' for {}.".format(
                         arg[1],
@@ -219,17 +234,13 @@ def check_args(iargs):
 
             elif arg[0] == 'cosmo':
                 if len(arg) > 1:
-                    if arg[1].lower() in DIELECTRICS:
-                        args['cosmo'] = DIELECTRICS[arg[1].lower()][2]
-                        logging.debug("cosmo set to {}".format(args['cosmo']))
-                    elif arg[1] == '' or arg[1] == 'None':
+                    if arg[1] == '' or arg[1] == 'None':
                         args['cosmo'] = ''
                     elif is_positive_float(arg[1]):
                         args['cosmo'] = arg[1]
                         logging.debug("cosmo set to {}".format(args['cosmo']))
-                    elif slug(arg[1]) in (slug(key) for key in DIELECTRICS):
-                        #slugs match. good enough.
-                        args['cosmo'] = (DIELECTRICS[key][2] for key in DIELECTRICS if slug(key) == slug[arg[1]])
+                    elif find_solvent(arg[1]) is not None:
+                        args['cosmo'] = find_solvent(arg[1])[1]
                         logging.debug("cosmo set to {}".format(args['cosmo']))
                     else:
                         logging.warning("Solvent not found. Ignoring Cosmo")
@@ -266,6 +277,73 @@ def check_args(iargs):
                         arg[1],
                         arg[0]
                         ))
+
+            elif arg[0] == 'scratch':
+                #bare %scratch stages to the node's $TMPDIR
+                if len(arg) == 1 or arg[1] == '':
+                    args['scratch'] = '$TMPDIR'
+                elif (len(arg[1].split()) == 1 and
+                      not set(arg[1]) & set('"\'`;')):
+                    args['scratch'] = arg[1]
+                else:
+                    logging.warning("Invalid value of '{}' for {}.".format(
+                        arg[1],
+                        arg[0]
+                        ))
+                    raise InputCheckError(
+                        line,
+                        'Invalid value {} for argument scratch.'
+                        .format(arg[1])
+                        )
+
+            elif arg[0] == 'freqjobs':
+                #numforce displacements are split over this many queue jobs
+                if len(arg) > 1 and is_positive_int(arg[1]) and int(arg[1]) > 0:
+                    args['freqjobs'] = arg[1]
+                else:
+                    value = arg[1] if len(arg) > 1 else ''
+                    logging.warning("Invalid value of '{}' for {}.".format(
+                        value,
+                        arg[0]
+                        ))
+                    raise InputCheckError(
+                        line,
+                        'Invalid value {} for argument freqjobs.'
+                        .format(value)
+                        )
+
+            elif arg[0] == 'preopt':
+                #bare %preopt pre-optimizes in PREOPT_BASIS
+                if len(arg) == 1 or arg[1] == '':
+                    args['preopt'] = PREOPT_BASIS
+                elif ROUTE_TABLE.get(arg[1].lower(),
+                                     (None, None))[0] == 'basis':
+                    args['preopt'] = ROUTE_TABLE[arg[1].lower()][1]
+                else:
+                    logging.warning("Invalid value of '{}' for {}.".format(
+                        arg[1],
+                        arg[0]
+                        ))
+                    raise InputCheckError(
+                        line,
+                        'Invalid value {} for argument preopt.'
+                        .format(arg[1])
+                        )
+
+            elif arg[0] == 'pe':
+                if len(arg) > 1 and re.match(r'^[\w.-]+$', arg[1]):
+                    args['pe'] = arg[1]
+                else:
+                    value = arg[1] if len(arg) > 1 else ''
+                    logging.warning("Invalid value of '{}' for {}.".format(
+                        value,
+                        arg[0]
+                        ))
+                    raise InputCheckError(
+                        line,
+                        'Invalid value {} for argument pe.'
+                        .format(value)
+                        )
         elif arg[0].lower() not in DISCARDARGLIST:
             logging.warning("Invalid arg: {}.".format(arg[0]))
             raise InputCheckError(line, 'Invalid argument {}.'.format(arg[0]))
@@ -278,22 +356,27 @@ def check_route(route):
     of the results
     """
     route_opts = dict()
-    route = route.replace('(', ' ').replace(')', '')
-    route = route.replace('/', ' ')
-    inroute = route.split()
+    inroute = list()
+    for item in route.replace('/', ' ').split():
+        if ROUTE_TABLE.get(item.lower(), (None, None))[0] == 'basis':
+            #basis sets such as def2-SV(P) keep their parentheses
+            inroute.append(item)
+        else:
+            inroute.extend(item.replace('(', ' ').replace(')', '').split())
     inroute = inroute[1:]
     for item in inroute:
-        if item.lower() in ROUTELIST:
+        kind, name = ROUTE_TABLE.get(item.lower(), (None, None))
+        if kind == 'jobtype':
             if not 'jobtype' in route_opts:
-                route_opts['jobtype'] = item.lower()
+                route_opts['jobtype'] = name
             else:
-                if item.lower() == 'opt' and route_opts['jobtype'] == 'freq':
+                if name == 'opt' and route_opts['jobtype'] == 'freq':
                     route_opts['jobtype'] = 'optfreq'
-                elif item.lower() == 'freq' and route_opts['jobtype'] == 'opt':
+                elif name == 'freq' and route_opts['jobtype'] == 'opt':
                     route_opts['jobtype'] = 'optfreq'
-                elif item.lower() == 'ts' and route_opts['jobtype'] == 'freq':
+                elif name == 'ts' and route_opts['jobtype'] == 'freq':
                     route_opts['jobtype'] = 'ts'
-                elif item.lower() == 'freq' and route_opts['jobtype'] == 'ts':
+                elif name == 'freq' and route_opts['jobtype'] == 'ts':
                     route_opts['jobtype'] = 'ts'
                 else:
                     logging.warning("Jobtype '{}' and '{}' called".format(
@@ -303,30 +386,28 @@ def check_route(route):
                     raise InputCheckError(
                         route,
                         "More than one jobtype in route. Remove duplicates."
-                        .format(route_opts['jobtype'], item)
                         )
 
-        elif item.lower() in ROUTEOPTS:
-            if not item.lower() in route_opts:
-                route_opts[item.lower()] = True
+        elif kind == 'option':
+            if not name in route_opts:
+                route_opts[name] = True
             else:
                 raise InputCheckError(
                     route,
                     "More than one option '{}' called in route. Remove duplicates."
-                    .format(route_opts[item.lower()])
+                    .format(route_opts[name])
                     )
 
-        elif item.lower() in FREQOPTS:
+        elif kind == 'freqopts':
             if not 'freqopts' in route_opts:
-                route_opts['freqopts'] = item.lower()
+                route_opts['freqopts'] = name
             else:
                 raise InputCheckError(
                     route,
                     "More than one frequency option called in route. Remove duplicates."
-                    .format(route_opts[item.lower()])
                     )
 
-        elif item.lower() in FUNCTIONALS:
+        elif kind == 'functional':
             if not 'functional' in route_opts:
                 route_opts['functional'] = item
             else:
@@ -339,12 +420,11 @@ def check_route(route):
                 raise InputCheckError(
                     route,
                     "More than one functional in route. Remove duplicates."
-                    .format(route_opts['functional'], item)
                     )
 
-        elif item in BASIS:
+        elif kind == 'basis':
             if not 'basis' in route_opts:
-                route_opts['basis'] = item
+                route_opts['basis'] = name
             else:
                 logging.warning("Basis '{}' and '{}' called".format(
                     item,
@@ -352,38 +432,16 @@ def check_route(route):
                     ))
                 raise InputCheckError(
                     route,
-                    "More than one basis in route. Remove Duplicates.".format(
-                        route_opts['basis'],
-                        item
-                        )
-                    )
-        elif item.lower() not in DISCARDROUTEOPTS:
-            lowered = False
-            for base in BASIS:
-                if (item.lower() == base.lower() or
-                    item.lower() == base.lower().replace('-','')):
-                    if not 'basis' in route_opts:
-                        route_opts['basis'] = base
-                        lowered = True
-                    else:
-                        logging.warning("Basis '{}' and '{}' called".format(
-                            item,
-                            route_opts['basis']
-                            ))
-                        raise InputCheckError(
-                            route,
-                            "More than one basis in route. Remove Duplicates.".format(
-                                route_opts['basis'],
-                                item
-                                )
-                            )
-            if not lowered:
-                logging.warning("Unknown item '{}' in route".format(item))
-                raise InputCheckError(
-                    route,
-                    "Syntax error. Unknown keyword '{}' in route.".format(item)
+                    "More than one basis in route. Remove Duplicates."
                     )
 
+        elif kind != 'discard':
+            logging.warning("Unknown item '{}' in route".format(item))
+            raise InputCheckError(
+                route,
+                "Syntax error. Unknown keyword '{}' in route.".format(item)
+                )
+
     return route_opts
 
 def check_chspin(chspin):
@@ -429,49 +487,30 @@ def check_chspin(chspin):
 def check_geom(geom):
     """
     Checks that the geometry is in 'atom xyz' format and the atom requested is
-    real. Returns in 'xyz atom' to prepare to write coord file.
+    real. Returns a Geometry (in Bohr) to prepare to write coord file.
     """
-    coord_geom = list()
+    elements = list()
+    coords = list()
     for line in geom:
-        newline = ''
         inline = line.split()
         if len(inline) > 4:
             raise InputCheckError(line, """Input Geometry should be in
                                    cartesian coordinates as 'element x y z'.""")
-        if is_float(inline[1]):
-            newline += str(float(inline[1])/0.52917720859)
-            newline += ' '
-        else:
-            logging.warning('Bad Geometry line: {}'.format(line))
-            raise InputCheckError(
-                line,
-                "Input geometry should be in cartesian format 'element x y z'."
-                )
-        if is_float(inline[2]):
-            newline += str(float(inline[2])/0.52917720859)
-            newline += ' '
-        else:
-            logging.warning('Bad Geometry line: {}'.format(line))
-            raise InputCheckError(
-                line,
-                "Input geometry should be in cartesian format 'element x y z'."
-                )
-        if is_float(inline[3]):
-            newline += str(float(inline[3])/0.52917720859)
-            newline += ' '
-        else:
+        try:
+            coords.append([float(inline[1]), float(inline[2]),
+                           float(inline[3])])
+        except (ValueError, IndexError):
             logging.warning('Bad Geometry line: {}'.format(line))
             raise InputCheckError(
                 line,
                 "Input geometry should be in cartesian format 'element x y z'."
                 )
-        if inline[0] in ELEMENTS:
-            newline += inline[0]
-        else:
+        try:
+            elements.append(ELEMENT_INDEX[inline[0]])
+        except KeyError:
             logging.warning('Bad element line: {}'.format(line))
             raise InputCheckError(line, "Input element unknown.")
-        coord_geom.append(newline)
-    return coord_geom
+    return Geometry(elements, np.array(coords).reshape(-1, 3) / BOHR)
 
 
 def remove_control(lines, filename='control'):
@@ -561,46 +600,27 @@ def add_or_modify_control(lines, filename='control'):
 
 
 def auto_control_mod(control_add, job):
-    """Make sure all the proper flags are passed to control for the jobtype"""
+    """
+    Make sure all the proper flags are passed to control for the jobtype.
+    Memory keywords are left to the memory planner, once define has run.
+    """
     args = list()
     for line in control_add:
         args.append(line.split(' ', 1)[0])
     #lots of parallelization or ri- and marij- flags to be added
     if job.jobtype == 'opt' or job.jobtype == 'optfreq':
-        if job.ri:
-            if not '$ricore' in args:
-                control_add.append('$ricore 0')
         if job.nproc > 1:
-            if not '$parallel_parameters' in args:
-                control_add.append('$parallel_parameters maxtask=10000')
-            if not '$paroptions' in args:
-                control_add.append(
-                    '$paroptions ga_memperproc 900000000000000 900000000000'
-                    )
-            if job.ri:
-                if not '$ricore_slave' in args:
-                    control_add.append('$ricore_slave 1')
-
-    #flag for aoforce job AND numforce
-    if job.jobtype == 'aoforce' or job.jobtype == 'numforce':
-        if not '$rpacor' in args and not '$maxcor' in args:
-            control_add.append('$maxcor 2048')
+            parallel_control_mod(control_add, job)
 
     #numforce works better with ri and marij. Make sure they're included
     #if possible
     if job.jobtype == 'numforce':
         if not '$parallel_parameters' in args:
             control_add.append('$parallel_parameters maxtask=10000')
-        if not '$paroptions' in args:
-            control_add.append(
-                '$paroptions ga_memperproc 900000000000000 900000000000'
-                )
         if not '$ri' in args:
             control_add.append('$ri')
         if not '$marij' in args:
             control_add.append('$marij')
-        if not '$ricore' in args:
-            control_add.append('$ricore 0')
         if not '$ricore_slave' in args:
             control_add.append('$ricore_slave 1')
 
@@ -613,6 +633,19 @@ def auto_control_mod(control_add, job):
     return control_add
 
 
+def parallel_control_mod(control_add, job):
+    """
+    Adds the flags a parallel opt job needs to control_add, if they aren't
+    there already. Used again when a job's nproc is chosen after setup.
+    """
+    args = [line.split(' ', 1)[0] for line in control_add]
+    if not '$parallel_parameters' in args:
+        control_add.append('$parallel_parameters maxtask=10000')
+    if job.ri and not '$ricore_slave' in args:
+        control_add.append('$ricore_slave 1')
+    return control_add
+
+
 def slug(s):
     """
     Slugify a string.
@@ -662,6 +695,17 @@ def write_file(filename, lines):
     return lines
 
 
+def ensure_dir(path):
+    """Creates the directory path (and parents) if it doesn't exist yet"""
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            raise FileAccessError("Error creating directory {}.".format(path),
+                                  e)
+        logging.debug('Directory {} created'.format(path))
+
+
 def check_files_exist(filelist):
     """Checks for the existance of file(s)"""
 
@@ -682,6 +726,17 @@ def get_all_active_jobs():
     return activejobs[:-1]
 
 
+def get_job_states():
+    """Returns {jobnumber: state} for every job in a qstat"""
+    states = dict()
+    qstats = Popen('qstat', stdout=PIPE).communicate()[0].split('\n')[2:]
+    for stat in qstats:
+        fields = stat.split()
+        if len(fields) > 4:
+            states[fields[0]] = fields[4]
+    return states
+
+
 def list_str(inlist):
     """Parses a list to a string with '\n' joining for logging purposes"""
     return '\n'.join(inlist)
@@ -712,6 +767,17 @@ def check_env():
         return None
 
 
+def parallel_environment(para_arch, pe=None):
+    """
+    The gridengine parallel environment to request for a job of para_arch:
+    pe if given, else the site's TURBOCONTROL_PE_<ARCH>, else the default.
+    """
+    if pe:
+        return pe
+    return os.getenv(PE_VAR.format(para_arch),
+                     PARALLEL_ENVIRONMENTS.get(para_arch, 'threaded'))
+
+
 def get_calc_time(jobdir, jobfile):
     """Gets the job optimization time by filetime comparisons in the supplied
     job directory"""
@@ -731,11 +797,85 @@ def get_calc_time(jobdir, jobfile):
         return False
 
 
+def read_energies(filename):
+    """
+    Reads the $energy block of a Turbomole energy file. Returns a list of
+    (cycle, SCF energy) tuples.
+    """
+    energies = list()
+    for line in read_clean_file(filename):
+        if line.startswith('$'):
+            continue
+        fields = line.split()
+        if len(fields) > 1 and is_int(fields[0]) and is_float(fields[1]):
+            energies.append((int(fields[0]), float(fields[1])))
+    return energies
+
+
+def read_spectrum(filename='control'):
+    """
+    Reads the $vibrational spectrum block of a control file. Returns a list of
+    (mode, wave number) tuples, leaving out the zero frequency modes.
+    """
+    spectrum = list()
+    inblock = False
+    for line in read_clean_file(filename):
+        if line.startswith('$vibrational spectrum'):
+            inblock = True
+            continue
+        if not inblock or line.startswith('#'):
+            continue
+        if line.startswith('$'):
+            break
+        fields = line.split()
+        if not fields or not is_int(fields[0]):
+            continue
+        for field in fields[1:]:
+            if is_float(field):
+                if float(field) != 0.0:
+                    spectrum.append((int(fields[0]), float(field)))
+                break
+    return spectrum
+
+
+def read_method(filename='control'):
+    """
+    Reads the title, functional and (first) basis set from a control file.
+    Returns a (title, functional, basis) tuple, with None for any not found.
+    """
+    title = functional = basis = None
+    block = None
+    for line in read_clean_file(filename):
+        if line.startswith('$'):
+            block = line.split()[0]
+            if block == '$title' and len(line.split()) > 1:
+                title = line.split(None, 1)[1]
+            continue
+        if block == '$title' and title is None and line:
+            title = line
+        elif block == '$dft' and line.startswith('functional'):
+            functional = line.split()[-1]
+        elif block == '$atoms' and basis is None and line.startswith('basis'):
+            basis = line.split()[-1]
+    return title, functional, basis
+
+
+def data_file(filename):
+    """
+    Returns the path to a data file shipped with turbocontrol. Looks in the
+    package dir, then beside the running script (older installs).
+    """
+    for d in [os.path.dirname(os.path.abspath(__file__)),
+              os.path.dirname(os.path.realpath(sys.argv[0]))]:
+        if os.path.isfile(os.path.join(d, filename)):
+            return os.path.join(d, filename)
+    return filename
+
+
 def get_dielectrics(inputfile):
     """Converts dielectric info from input file to python dict"""
     try:
-        with open(os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])),
-                               inputfile), 'r') as f:
+        with open(data_file(inputfile), 'r') as f:
             data = f.readlines()
     except Exception as e:
         raise FileAccessError("Error reading file {}.".format(inputfile), e)
@@ -747,5 +887,37 @@ def get_dielectrics(inputfile):
             dielectrics[e[0].lower()] =[e[1],e[2],e[3],e[4],e[5],e[6]]
     return dielectrics
 
-DIELECTRICS = get_dielectrics('dielectricsolvents.csv')
+
+SOLVENT_FILE = 'dielectricsolvents.csv'
+#filled on first use by dielectrics() and find_solvent()
+_DIELECTRICS = None
+_SOLVENT_SLUGS = None
+
+
+def dielectrics():
+    """Returns the solvent table {name: data}, reading it on first use"""
+    global _DIELECTRICS
+    if _DIELECTRICS is None:
+        _DIELECTRICS = get_dielectrics(SOLVENT_FILE)
+    return _DIELECTRICS
+
+
+def find_solvent(name):
+    """
+    Returns the solvent table entry for name, matched case insensitively or,
+    failing that, by slug. None if the solvent isn't known.
+    """
+    global _SOLVENT_SLUGS
+    table = dielectrics()
+    if name.lower() in table:
+        return table[name.lower()]
+    if _SOLVENT_SLUGS is None:
+        _SOLVENT_SLUGS = dict()
+        for key in table:
+            if slug(key):
+                _SOLVENT_SLUGS.setdefault(slug(key), key)
+    key = _SOLVENT_SLUGS.get(slug(name))
+    if key is None:
+        return None
+    return table[key]
 
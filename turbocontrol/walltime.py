@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Walltime (h_rt) prediction from the run times of earlier jobs. Jobs asking
+for the full default walltime can't be backfilled into the gaps gridengine
+leaves before large jobs start, so they wait longer in the queue.
+
+The run time of each stage (opt, ts, sp, numforce, aoforce, and the cheap
+level of %preopt jobs) is fitted to the results database as a power law in
+the job's basis functions and atoms, on one processor by the scaling model,
+with an offset for each functional with enough history. h_rt is the
+prediction times a safety margin: the QUANTILE of the errors of recent
+predictions. The prediction made for each job is recorded with its run time,
+so the margin tightens as the model gets better.
+"""
+
+import logging
+import math
+
+import memplan
+from scaling import Scaling
+
+STAGES = ['preopt', 'opt', 'ts', 'sp', 'numforce', 'aoforce']
+#fits need this many run times, of at least two sizes
+MIN_SAMPLES = 5
+QUANTILE = 0.95
+#the margin comes from the errors of this many recent predictions
+RECENT = 50
+MIN_MARGIN = 1.2
+MIN_HOURS = 1
+MAX_HOURS = 168
+
+
+def stage_of(jobtype):
+    """The stage whose run time a turbogo jobtype is predicted by"""
+    return {'optfreq': 'opt', 'freq': 'numforce'}.get(jobtype, jobtype)
+
+
+def quantile(values, q):
+    """The q quantile of values, interpolated between ranks"""
+    values = sorted(values)
+    rank = q * (len(values) - 1)
+    low = int(math.floor(rank))
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def _solve(matrix, vector):
+    """Solution x of matrix x = vector, None if the matrix is singular"""
+    n = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-9:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(n):
+            if r != col:
+                factor = rows[r][col] / rows[col][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[i][n] / rows[i][i] for i in range(n)]
+
+
+def least_squares(xs, ys):
+    """Coefficients of the least squares fit of ys to the rows xs"""
+    width = len(xs[0])
+    matrix = [[sum(x[i] * x[j] for x in xs) for j in range(width)]
+              for i in range(width)]
+    vector = [sum(x[i] * y for x, y in zip(xs, ys)) for i in range(width)]
+    return _solve(matrix, vector)
+
+
+class Runtime(object):
+    """Run time model of one stage"""
+
+    def __init__(self, coefficients, offsets=None, margin=MIN_MARGIN,
+                 samples=0):
+        #log seconds = c + a log(nbf) [+ b log(atoms)], on one processor
+        self.coefficients = coefficients
+        self.offsets = offsets or dict()
+        self.margin = margin
+        self.samples = samples
+
+    def seconds(self, nbf, atoms, functional=None, nproc=1, scaling=None):
+        """Predicted run time in seconds"""
+        x = [1.0, math.log(max(nbf, 1)), math.log(max(atoms, 1))]
+        log = sum(c * v for c, v in zip(self.coefficients, x))
+        log += self.offsets.get(functional, 0.0)
+        speedup = (scaling or Scaling()).speedup(nbf, nproc)
+        return math.exp(log) / speedup
+
+    def hours(self, seconds):
+        """h_rt in whole hours for a predicted run time, with the margin"""
+        hours = int(math.ceil(seconds * self.margin / 3600.0))
+        return max(MIN_HOURS, min(MAX_HOURS, hours))
+
+
+def fit(history, models=None):
+    """
+    Returns {stage: Runtime} fitted to history rows of (stage, atoms, nbf,
+    functional, nproc, para_arch, seconds, predicted seconds or None), oldest
+    first, for the stages with enough rows. Run times are taken back to one
+    processor with models ({arch: Scaling}, from scaling.fit).
+    """
+    models = models or dict()
+    rows = dict()
+    for stage, atoms, nbf, functional, nproc, arch, seconds, predicted in \
+            history:
+        if not (atoms and nbf and seconds and seconds > 0):
+            continue
+        serial = seconds * models.get(arch, Scaling()).speedup(
+            nbf, nproc or 1)
+        rows.setdefault(stage, list()).append(
+            (atoms, nbf, functional, seconds, serial, predicted))
+    runtimes = dict()
+    for stage, samples in rows.items():
+        if (len(samples) < MIN_SAMPLES or
+                len(set(nbf for _a, nbf, _f, _s, _t, _p in samples)) < 2):
+            continue
+        xs = [[1.0, math.log(nbf), math.log(atoms)]
+              for atoms, nbf, _f, _s, _t, _p in samples]
+        ys = [math.log(serial) for _a, _n, _f, _s, serial, _p in samples]
+        coefficients = least_squares(xs, ys)
+        if coefficients is None:
+            #every job the same make up, atoms add nothing to the size
+            coefficients = least_squares([x[:2] for x in xs], ys)
+        if coefficients is None:
+            continue
+        model = Runtime(coefficients)
+        residuals = dict()
+        for (atoms, nbf, functional, _s, serial, _p), y in zip(samples, ys):
+            residuals.setdefault(functional, list()).append(
+                y - math.log(model.seconds(nbf, atoms)))
+        for functional, values in residuals.items():
+            if len(values) >= MIN_SAMPLES:
+                model.offsets[functional] = sum(values) / len(values)
+        #errors of the predictions made when jobs were submitted, or of the
+        #fit itself until there are enough of those
+        errors = [math.log(seconds / predicted)
+                  for _a, _n, _f, seconds, _t, predicted in samples
+                  if predicted and predicted > 0][-RECENT:]
+        if len(errors) < MIN_SAMPLES:
+            errors = [y - math.log(model.seconds(nbf, atoms, functional))
+                      for (atoms, nbf, functional, _s, _t, _p), y in
+                      zip(samples, ys)]
+        model.margin = max(MIN_MARGIN, math.exp(quantile(errors, QUANTILE)))
+        model.samples = len(samples)
+        runtimes[stage] = model
+        logging.debug("{} run times fitted to {} jobs: margin {:.2f}.".format(
+            stage, len(samples), model.margin))
+    return runtimes
+
+
+def job_stages(job):
+    """The stages a turbogo job runs: its pre-optimization, the job itself,
+    then its frequency calculation"""
+    stages = [stage_of(job.jobtype)]
+    if getattr(job, 'preopt', None):
+        stages.insert(0, 'preopt')
+    freqopt = None
+    if job.freqopts:
+        freqopt = job.freqopts.split('+')[0]
+    elif job.jobtype == 'ts':
+        freqopt = 'numforce'
+    if freqopt and freqopt not in stages:
+        stages.append(freqopt)
+    return [stage for stage in stages if stage in STAGES]
+
+
+def predict(job, runtimes, models=None):
+    """
+    {stage: (predicted seconds, h_rt hours)} of the stages of turbogo job
+    that have a fitted model in runtimes.
+    """
+    models = models or dict()
+    predictions = dict()
+    for stage in job_stages(job):
+        if stage not in runtimes:
+            continue
+        model = runtimes[stage]
+        nbf = memplan.estimate_functions(job.geometry, job.preopt
+                                         if stage == 'preopt' else job.basis)
+        seconds = model.seconds(nbf, len(job.geometry), job.functional,
+                                job.nproc, models.get(job.para_arch))
+        predictions[stage] = (seconds, model.hours(seconds))
+    return predictions
+
+
+def job_runtimes(job):
+    """
+    The run time rows, [[stage, atoms, nbf, nproc, para_arch, seconds,
+    predicted seconds]], of a completed turbocontrol Jobset: one each for its
+    pre-optimization, the job and its frequency calculation, if timed.
+    """
+    inner = getattr(job, 'job', job)
+    geometry = getattr(inner, 'geometry', None)
+    if geometry is None or not len(geometry):
+        return []
+    predicted = getattr(job, 'predicted', None) or dict()
+    rows = list()
+    stages = [('preopt', getattr(inner, 'preopt', None),
+               getattr(job, 'ptime', 0)),
+              (stage_of(getattr(job, 'jobtype', None) or inner.jobtype),
+               inner.basis, getattr(job, 'otime', 0)),
+              (getattr(job, 'freqopt', None), inner.basis,
+               getattr(job, 'ftime', 0))]
+    for stage, basis, seconds in stages:
+        if stage in STAGES and basis and seconds and seconds > 0:
+            rows.append([stage, len(geometry),
+                         memplan.estimate_functions(geometry, basis),
+                         inner.nproc, inner.para_arch, seconds,
+                         predicted.get(stage, (None, None))[0]])
+    return rows